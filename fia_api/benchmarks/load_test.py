@@ -0,0 +1,429 @@
+"""
+Load test of the API at a target request rate.
+
+Logs in a pool of users, then fires requests at a fixed rate (open loop, so a
+slow API doesn't slow the load down) across login, converse, get-flashcards
+and get-conversations, and reports p50/p95/p99 latency and throughput per
+endpoint.
+
+Start the stand-in server and the API pointed at it (see
+fia_api.benchmarks.stand_in), then run:
+
+    python -m fia_api.benchmarks.load_test --rps 20 --duration 60
+
+The API's rate limits and token quota would reject most of the load, so leave
+them off, as they are by default.
+
+Pass --output to save the results, and --baseline with an earlier output to
+exit non-zero if any endpoint's p95 latency or throughput regressed by more
+than --max-regression.
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+import uuid
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+from pydantic import BaseModel
+
+ENDPOINT_WEIGHTS = {
+    "login": 1,
+    "converse": 4,
+    "get_flashcards": 2,
+    "get_conversations": 2,
+}
+CONVERSE_MESSAGES = ("Hallo, Wie Geht's?", "Ich habe ein Hund.", "Was machst du?")
+DEFAULT_RPS = 10
+DEFAULT_DURATION_SECONDS = 30
+DEFAULT_USER_COUNT = 20
+DEFAULT_MAX_REGRESSION = 0.2
+ENDPOINT_COLUMN_WIDTH = 20
+NUMBER_COLUMN_WIDTH = 10
+TABLE_HEADER = ("endpoint", "requests", "errors", "rps", "p50 ms", "p95 ms", "p99 ms")
+
+# (seconds taken, succeeded) of a request.
+Measurement = Tuple[float, bool]
+
+
+class BenchmarkUser(BaseModel):
+    """A user the load is sent as."""
+
+    username: str
+    password: str
+    access_token: str = ""
+    conversation_id: str = "new"
+
+
+class EndpointResult(BaseModel):
+    """Latency and throughput of one endpoint."""
+
+    requests: int
+    errors: int
+    throughput_rps: float
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+
+
+def get_percentile(sorted_latencies: List[float], percentile: float) -> float:
+    """
+    Get a percentile by the nearest-rank method.
+
+    :param sorted_latencies: List of latencies, sorted.
+    :param percentile: Float percentile, between 0 and 100.
+    :returns: Float latency at the percentile, 0 if there are none.
+    """
+    if not sorted_latencies:
+        return 0
+
+    position = len(sorted_latencies) * percentile / 100
+    rank = max(int(position + 0.5), 1)
+    return sorted_latencies[min(rank, len(sorted_latencies)) - 1]
+
+
+def summarize_endpoint(
+    measurements: List[Measurement],
+    duration: float,
+) -> EndpointResult:
+    """
+    Summarize the latencies of one endpoint.
+
+    :param measurements: List of (seconds taken, succeeded) of each request.
+    :param duration: Float seconds the load test ran for.
+    :returns: EndpointResult
+    """
+    latencies_ms = sorted(latency * 1000 for latency, _ in measurements)
+    successes = sum(succeeded for _, succeeded in measurements)
+
+    return EndpointResult(
+        requests=len(measurements),
+        errors=len(measurements) - successes,
+        throughput_rps=successes / duration,
+        p50_ms=get_percentile(latencies_ms, 50),  # noqa: WPS432
+        p95_ms=get_percentile(latencies_ms, 95),  # noqa: WPS432
+        p99_ms=get_percentile(latencies_ms, 99),  # noqa: WPS432
+    )
+
+
+def summarize_results(
+    results: Dict[str, List[Measurement]],
+    duration: float,
+) -> Dict[str, EndpointResult]:
+    """
+    Summarize the latencies of each endpoint.
+
+    :param results: Dict of endpoint -> list of (seconds taken, succeeded).
+    :param duration: Float seconds the load test ran for.
+    :returns: Dict of endpoint -> EndpointResult.
+    """
+    return {
+        endpoint: summarize_endpoint(measurements, duration)
+        for endpoint, measurements in sorted(results.items())
+    }
+
+
+def find_regressions(
+    summary: Dict[str, EndpointResult],
+    baseline: Dict[str, EndpointResult],
+    max_regression: float,
+) -> List[str]:
+    """
+    Compare results to a baseline.
+
+    :param summary: Dict of endpoint -> EndpointResult of this run.
+    :param baseline: Dict of endpoint -> EndpointResult of the baseline run.
+    :param max_regression: Float fraction either metric may get worse by.
+    :returns: List of string descriptions of each regression.
+    """
+    regressions = []
+
+    for endpoint, endpoint_result in summary.items():
+        baseline_result = baseline.get(endpoint)
+        if baseline_result is None:
+            continue
+
+        if endpoint_result.p95_ms > baseline_result.p95_ms * (1 + max_regression):
+            regressions.append(
+                f"{endpoint} p95 {baseline_result.p95_ms:.0f}ms -> "
+                f"{endpoint_result.p95_ms:.0f}ms",
+            )
+
+        min_throughput = baseline_result.throughput_rps * (1 - max_regression)
+        if endpoint_result.throughput_rps < min_throughput:
+            regressions.append(
+                f"{endpoint} throughput {baseline_result.throughput_rps:.1f}rps "
+                f"-> {endpoint_result.throughput_rps:.1f}rps",
+            )
+
+    return regressions
+
+
+async def login(client: httpx.AsyncClient, user: BenchmarkUser) -> httpx.Response:
+    """
+    Log a user in, refreshing their access token.
+
+    :param client: httpx AsyncClient for the API.
+    :param user: BenchmarkUser to log in.
+    :returns: httpx Response.
+    """
+    response = await client.post(
+        "/api/user/login",
+        data={"username": user.username, "password": user.password},
+    )
+    if response.is_success:
+        user.access_token = response.json()["access_token"]
+
+    return response
+
+
+async def create_user(client: httpx.AsyncClient) -> BenchmarkUser:
+    """
+    Create and log in a user.
+
+    :param client: httpx AsyncClient for the API.
+    :returns: BenchmarkUser
+    """
+    user = BenchmarkUser(
+        username=f"benchmark-{uuid.uuid4()}",
+        password=str(uuid.uuid4()),
+    )
+    response = await client.post(
+        "/api/user/create",
+        json={"username": user.username, "password": user.password},
+    )
+    response.raise_for_status()
+    (await login(client, user)).raise_for_status()
+
+    return user
+
+
+async def send_request(
+    client: httpx.AsyncClient,
+    endpoint: str,
+    user: BenchmarkUser,
+) -> httpx.Response:
+    """
+    Send a request to an endpoint as a user.
+
+    :param client: httpx AsyncClient for the API.
+    :param endpoint: String name of the endpoint, one of ENDPOINT_WEIGHTS.
+    :param user: BenchmarkUser to send it as.
+    :returns: httpx Response.
+    """
+    if endpoint == "login":
+        return await login(client, user)
+
+    headers = {"Authorization": f"Bearer {user.access_token}"}
+
+    if endpoint == "converse":
+        response = await client.post(
+            "/api/teacher/converse",
+            headers=headers,
+            json={
+                "conversation_id": user.conversation_id,
+                "message": random.choice(CONVERSE_MESSAGES),  # noqa: S311
+            },
+        )
+        if response.is_success:
+            user.conversation_id = response.json()["conversation_id"]
+        return response
+
+    if endpoint == "get_flashcards":
+        return await client.get("/api/flashcards/get-flashcards", headers=headers)
+
+    return await client.get("/api/user/get-conversations", headers=headers)
+
+
+async def run_load_test(  # noqa: WPS210
+    base_url: str,
+    rps: float,
+    duration: float,
+    user_count: int,
+) -> Dict[str, EndpointResult]:
+    """
+    Send requests at the target rate and measure them.
+
+    :param base_url: String URL of the API.
+    :param rps: Float target requests per second.
+    :param duration: Float seconds to send requests for.
+    :param user_count: Int number of users to spread the requests across.
+    :returns: Dict of endpoint -> EndpointResult.
+    """
+    results: Dict[str, List[Measurement]] = defaultdict(list)
+
+    async def _measure(endpoint: str, user: BenchmarkUser) -> None:  # noqa: WPS430
+        started_at = time.monotonic()
+        try:
+            response = await send_request(client, endpoint, user)
+        except httpx.HTTPError:
+            succeeded = False
+        else:
+            succeeded = response.is_success
+        results[endpoint].append((time.monotonic() - started_at, succeeded))
+
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with httpx.AsyncClient(
+        base_url=base_url,
+        timeout=None,
+        limits=limits,
+    ) as client:
+        users = [await create_user(client) for _ in range(user_count)]
+
+        endpoints = list(ENDPOINT_WEIGHTS)
+        weights = list(ENDPOINT_WEIGHTS.values())
+        tasks = []
+        started_at = time.monotonic()
+
+        for request_index in range(int(rps * duration)):
+            await asyncio.sleep(
+                max(started_at + request_index / rps - time.monotonic(), 0),
+            )
+            endpoint = random.choices(endpoints, weights)[0]  # noqa: S311
+            tasks.append(
+                asyncio.create_task(
+                    _measure(endpoint, random.choice(users)),  # noqa: S311
+                ),
+            )
+
+        await asyncio.gather(*tasks)
+        elapsed = time.monotonic() - started_at
+
+    return summarize_results(results, elapsed)
+
+
+def format_row(endpoint: str, *numbers: str) -> str:
+    """
+    Format a row of the results table.
+
+    :param endpoint: String name of the endpoint, left aligned.
+    :param numbers: Strings of the numbers, right aligned.
+    :returns: String row.
+    """
+    return endpoint.ljust(ENDPOINT_COLUMN_WIDTH) + "".join(
+        number.rjust(NUMBER_COLUMN_WIDTH) for number in numbers
+    )
+
+
+def format_summary(summary: Dict[str, EndpointResult]) -> str:
+    """
+    Format the results as a table.
+
+    :param summary: Dict of endpoint -> EndpointResult.
+    :returns: String table.
+    """
+    rows = [format_row(*TABLE_HEADER)]
+    for endpoint, endpoint_result in summary.items():
+        rows.append(
+            format_row(
+                endpoint,
+                str(endpoint_result.requests),
+                str(endpoint_result.errors),
+                f"{endpoint_result.throughput_rps:.1f}",
+                f"{endpoint_result.p50_ms:.0f}",
+                f"{endpoint_result.p95_ms:.0f}",
+                f"{endpoint_result.p99_ms:.0f}",
+            ),
+        )
+
+    return "\n".join(rows)
+
+
+def load_summary(path: str) -> Dict[str, EndpointResult]:
+    """
+    Load results saved with --output.
+
+    :param path: String path of the JSON file.
+    :returns: Dict of endpoint -> EndpointResult.
+    """
+    with open(path) as summary_file:
+        raw_summary: Dict[str, Any] = json.load(summary_file)
+
+    return {
+        endpoint: EndpointResult(**endpoint_result)
+        for endpoint, endpoint_result in raw_summary.items()
+    }
+
+
+def save_summary(summary: Dict[str, EndpointResult], path: str) -> None:
+    """
+    Save results, to be loaded with load_summary.
+
+    :param summary: Dict of endpoint -> EndpointResult.
+    :param path: String path of the JSON file.
+    """
+    with open(path, "w") as output_file:
+        json.dump(
+            {
+                endpoint: endpoint_result.model_dump()
+                for endpoint, endpoint_result in summary.items()
+            },
+            output_file,
+            indent=2,
+        )
+
+
+def parse_args(argv: Optional[List[str]]) -> argparse.Namespace:
+    """
+    Parse the arguments of the load test.
+
+    :param argv: Optional list of string arguments, defaults to sys.argv.
+    :returns: Namespace of the arguments.
+    """
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--rps", type=float, default=DEFAULT_RPS)
+    parser.add_argument("--duration", type=float, default=DEFAULT_DURATION_SECONDS)
+    parser.add_argument("--users", type=int, default=DEFAULT_USER_COUNT)
+    parser.add_argument("--output")
+    parser.add_argument("--baseline")
+    parser.add_argument(
+        "--max-regression",
+        type=float,
+        default=DEFAULT_MAX_REGRESSION,
+    )
+
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:  # pragma: no cover
+    """
+    Entrypoint of the load test.
+
+    :param argv: Optional list of string arguments, defaults to sys.argv.
+    :returns: Int exit code, 1 if there were regressions.
+    """
+    args = parse_args(argv)
+
+    summary = asyncio.run(
+        run_load_test(args.base_url, args.rps, args.duration, args.users),
+    )
+    summary_table = format_summary(summary)
+    sys.stdout.write(f"{summary_table}\n")
+
+    if args.output:
+        save_summary(summary, args.output)
+
+    if not args.baseline:
+        return 0
+
+    regressions = find_regressions(
+        summary,
+        load_summary(args.baseline),
+        args.max_regression,
+    )
+    for regression in regressions:
+        sys.stdout.write(f"REGRESSION: {regression}\n")
+
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
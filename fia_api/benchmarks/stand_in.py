@@ -0,0 +1,331 @@
+"""
+Stand-in server for the OpenAI and Google Text-to-Speech APIs.
+
+Serves Chat Completions (including streaming and function calls), Whisper
+transcriptions and Text-to-Speech synthesis with configurable latency, error
+rate and token counts, so the API can be load tested fully offline.
+
+Run it with:
+
+    python -m fia_api.benchmarks.stand_in --port 8001 --latency-median-ms 800
+
+and point the API at it with:
+
+    FIA_API_OPENAI_API_BASE=http://127.0.0.1:8001/v1
+    FIA_API_GOOGLE_TTS_API_ENDPOINT=http://127.0.0.1:8001
+"""
+import argparse
+import asyncio
+import base64
+import enum
+import json
+import random
+import re
+import time
+import uuid
+from typing import Any, AsyncIterator, Dict, Optional
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel
+
+from fia_api.web.api.teacher.schema import (
+    BatchLearningMoments,
+    ConversationContinuation,
+    LearningMoment,
+    LearningMoments,
+    MessageLearningMoments,
+    Mistake,
+)
+
+STAND_IN_LEARNING_MOMENTS = LearningMoments(
+    learning_moments=[
+        LearningMoment(
+            moment=Mistake(
+                incorrect_section="Wie Geht's?",
+                corrected_section="Wie geht es dir?",
+                explanation="Only nouns are capitalised in German.",
+            ),
+        ),
+    ],
+)
+STAND_IN_REPLY = "Mir geht es gut, danke! Wie geht es dir?"
+STAND_IN_SUMMARY = "They said hello and talked about their day."
+STAND_IN_TRANSCRIPTION = "Hallo, wie geht es dir?"
+# Roughly the bitrate of the MP3s Google returns.
+STAND_IN_AUDIO_BYTES_PER_CHARACTER = 500
+DEFAULT_PORT = 8001
+
+
+class LatencyDistribution(str, enum.Enum):  # noqa: WPS600
+    """Shape of the simulated latency."""
+
+    FIXED = "fixed"
+    UNIFORM = "uniform"
+    LOGNORMAL = "lognormal"
+
+
+class StandInConfig(BaseModel):
+    """How the stand-in server behaves."""
+
+    latency_distribution: LatencyDistribution = LatencyDistribution.LOGNORMAL
+    # Median latency of LLM calls. Uniform latencies are between 0 and twice
+    # the median.
+    latency_median_ms: float = 800.0
+    # Spread of the lognormal distribution, larger means a longer tail.
+    latency_sigma: float = 0.5
+    tts_latency_median_ms: float = 300.0
+    # Fraction of requests failing with a 503.
+    error_rate: float = 0
+    prompt_tokens: int = 200
+    completion_tokens: int = 100
+
+
+def sample_latency(config: StandInConfig, median_ms: float) -> float:
+    """
+    Sample a latency from the configured distribution.
+
+    :param config: StandInConfig
+    :param median_ms: Float median latency in milliseconds.
+    :returns: Float latency in seconds.
+    """
+    if config.latency_distribution == LatencyDistribution.FIXED:
+        latency_ms = median_ms
+    elif config.latency_distribution == LatencyDistribution.UNIFORM:
+        latency_ms = random.uniform(0, 2 * median_ms)  # noqa: S311
+    else:
+        latency_ms = random.lognormvariate(0, config.latency_sigma) * median_ms
+
+    return latency_ms / 1000
+
+
+def get_error_response(config: StandInConfig) -> Optional[JSONResponse]:
+    """
+    Randomly fail a request, at the configured error rate.
+
+    :param config: StandInConfig
+    :returns: A 503 JSONResponse shaped like an OpenAI error, or None.
+    """
+    if random.random() >= config.error_rate:  # noqa: S311
+        return None
+
+    return JSONResponse(
+        status_code=503,  # noqa: WPS432
+        content={
+            "error": {
+                "message": "The stand-in server is overloaded.",
+                "type": "server_error",
+                "param": None,
+                "code": None,
+            },
+        },
+    )
+
+
+def get_function_arguments(function_name: str, chat_request: Dict[str, Any]) -> str:
+    """
+    Get plausible arguments for a function call.
+
+    :param function_name: String name of the function called.
+    :param chat_request: Dict of the Chat Completion request.
+    :returns: String JSON arguments.
+    """
+    if function_name == "get_learning_moments":
+        return STAND_IN_LEARNING_MOMENTS.model_dump_json()
+
+    if function_name == "get_batch_learning_moments":
+        batch = json.loads(chat_request["messages"][-1]["content"])
+        return BatchLearningMoments(
+            messages=[
+                MessageLearningMoments(
+                    id=batch_message["id"],
+                    learning_moments=STAND_IN_LEARNING_MOMENTS.learning_moments,
+                )
+                for batch_message in batch
+            ],
+        ).model_dump_json()
+
+    return ConversationContinuation(message=STAND_IN_REPLY).model_dump_json()
+
+
+def get_chat_completion(
+    config: StandInConfig,
+    chat_request: Dict[str, Any],
+) -> Dict[str, Any]:
+    """
+    Build a Chat Completion response for a request.
+
+    :param config: StandInConfig
+    :param chat_request: Dict of the Chat Completion request.
+    :returns: Dict of the Chat Completion response.
+    """
+    message: Dict[str, Any] = {"role": "assistant", "content": STAND_IN_SUMMARY}
+    function_call = chat_request.get("function_call")
+
+    if isinstance(function_call, dict):
+        message = {
+            "role": "assistant",
+            "content": None,
+            "function_call": {
+                "name": function_call["name"],
+                "arguments": get_function_arguments(
+                    function_call["name"],
+                    chat_request,
+                ),
+            },
+        }
+
+    completion_id = uuid.uuid4().hex
+
+    return {
+        "id": f"chatcmpl-{completion_id}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": chat_request.get("model"),
+        "choices": [{"index": 0, "message": message, "finish_reason": "stop"}],
+        "usage": {
+            "prompt_tokens": config.prompt_tokens,
+            "completion_tokens": config.completion_tokens,
+            "total_tokens": config.prompt_tokens + config.completion_tokens,
+        },
+    }
+
+
+async def stream_chat_completion(
+    config: StandInConfig,
+    chat_request: Dict[str, Any],
+) -> AsyncIterator[str]:
+    """
+    Stream the reply as Chat Completion chunks, spread over the latency.
+
+    :param config: StandInConfig
+    :param chat_request: Dict of the Chat Completion request.
+    :yields: String Server-Sent Events.
+    """
+    # Words with the space after them, so the tokens join back into the reply.
+    tokens = re.findall(r"\S+\s*", STAND_IN_REPLY)
+    latency = sample_latency(config, config.latency_median_ms)
+
+    for token in tokens:
+        await asyncio.sleep(latency / len(tokens))
+        chunk = json.dumps(
+            {
+                "object": "chat.completion.chunk",
+                "model": chat_request.get("model"),
+                "choices": [{"index": 0, "delta": {"content": token}}],
+            },
+        )
+        yield f"data: {chunk}\n\n"
+
+    yield "data: [DONE]\n\n"
+
+
+async def chat_completions(request: Request) -> Any:
+    """
+    Answer a Chat Completion request, streamed if it asks to be.
+
+    :param request: Request to the stand-in server.
+    :returns: Chat Completion, or a streaming or error response.
+    """
+    config: StandInConfig = request.app.state.config
+    chat_request = await request.json()
+
+    error_response = get_error_response(config)
+    if error_response is not None:
+        return error_response
+
+    if chat_request.get("stream"):
+        return StreamingResponse(
+            stream_chat_completion(config, chat_request),
+            media_type="text/event-stream",
+        )
+
+    await asyncio.sleep(sample_latency(config, config.latency_median_ms))
+    return get_chat_completion(config, chat_request)
+
+
+async def transcriptions(request: Request) -> Any:
+    """
+    Answer a Whisper transcription request.
+
+    :param request: Request to the stand-in server.
+    :returns: Transcription, or an error response.
+    """
+    config: StandInConfig = request.app.state.config
+
+    error_response = get_error_response(config)
+    if error_response is not None:
+        return error_response
+
+    await asyncio.sleep(sample_latency(config, config.latency_median_ms))
+    return {"text": STAND_IN_TRANSCRIPTION}
+
+
+async def synthesize(request: Request) -> Dict[str, str]:
+    """
+    Answer a Text-to-Speech request with silence as long as the text.
+
+    :param request: Request to the stand-in server.
+    :returns: Dict of the base64 encoded audio.
+    """
+    config: StandInConfig = request.app.state.config
+    synthesize_request = await request.json()
+
+    await asyncio.sleep(sample_latency(config, config.tts_latency_median_ms))
+    text = synthesize_request["input"].get("text", "")
+    audio_content = b"\0" * (len(text) * STAND_IN_AUDIO_BYTES_PER_CHARACTER)
+    return {"audioContent": base64.b64encode(audio_content).decode()}
+
+
+def get_stand_in_app(config: StandInConfig) -> FastAPI:
+    """
+    Create the stand-in server.
+
+    :param config: StandInConfig
+    :returns: FastAPI application.
+    """
+    app = FastAPI(title="fia_api stand-in")
+    app.state.config = config
+
+    app.post("/v1/chat/completions")(chat_completions)
+    app.post("/v1/audio/transcriptions")(transcriptions)
+    app.post("/v1/text:synthesize")(synthesize)
+
+    return app
+
+
+def get_argument_parser() -> argparse.ArgumentParser:
+    """
+    Get the parser of the stand-in server's arguments.
+
+    Each StandInConfig field is an option, e.g. --latency-median-ms, parsed
+    when the config is validated.
+
+    :returns: ArgumentParser
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+
+    for field_name, model_field in StandInConfig.model_fields.items():
+        option_name = field_name.replace("_", "-")
+        parser.add_argument(
+            f"--{option_name}",
+            dest=field_name,
+            default=model_field.default,
+        )
+
+    return parser
+
+
+def main() -> None:  # pragma: no cover
+    """Entrypoint of the stand-in server."""
+    args = get_argument_parser().parse_args()
+
+    config = StandInConfig.model_validate(args, from_attributes=True)
+    uvicorn.run(get_stand_in_app(config), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
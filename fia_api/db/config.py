@@ -11,6 +11,7 @@ MODELS_MODULES: List[str] = [
     "fia_api.db.models.user_conversation_model",
     "fia_api.db.models.flashcard_model",
     "fia_api.db.models.learning_moment_model",
+    "fia_api.db.models.conversation_summary_model",
 ]  # noqa: WPS407
 
 TORTOISE_CONFIG = {  # noqa: WPS407
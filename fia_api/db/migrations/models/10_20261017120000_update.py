@@ -0,0 +1,21 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        ALTER TABLE "token_usage" ADD "saved_prompt_token_usage" INT NOT NULL  DEFAULT 0;
+        CREATE TABLE IF NOT EXISTS "conversation_summaries" (
+    "id" SERIAL NOT NULL PRIMARY KEY,
+    "last_modified" TIMESTAMPTZ NOT NULL  DEFAULT CURRENT_TIMESTAMP,
+    "first_created" TIMESTAMPTZ NOT NULL  DEFAULT CURRENT_TIMESTAMP,
+    "conversation_id" UUID NOT NULL UNIQUE,
+    "summary" TEXT NOT NULL,
+    "summarized_message_count" INT NOT NULL  DEFAULT 0
+);
+COMMENT ON TABLE "conversation_summaries" IS 'Model for the rolling summary of the older part of a conversation.';"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        ALTER TABLE "token_usage" DROP COLUMN "saved_prompt_token_usage";
+        DROP TABLE IF EXISTS "conversation_summaries";"""
@@ -0,0 +1,21 @@
+from tortoise import fields
+
+from fia_api.db.models.fia_base_model import FiaBaseModel
+
+
+class ConversationSummaryModel(FiaBaseModel):
+    """Model for the rolling summary of the older part of a conversation."""
+
+    conversation_id = fields.data.UUIDField(null=False, required=True, unique=True)
+
+    summary = fields.data.TextField(null=False, required=True)
+
+    # How many messages of the conversation (after the initial prompt) the
+    # summary covers.
+    summarized_message_count = fields.IntField(null=False, default=0)
+
+    def __str__(self) -> str:
+        return f"ConversationSummary: {self.id}"
+
+    class Meta:
+        table = "conversation_summaries"
@@ -11,6 +11,10 @@ class TokenUsageModel(FiaBaseModel):
     prompt_token_usage = fields.IntField(null=False, default=0)
     completion_token_usage = fields.IntField(null=False, default=0)
 
+    # Estimated prompt tokens not sent thanks to summarizing long
+    # conversations.
+    saved_prompt_token_usage = fields.IntField(null=False, default=0)
+
     def __str__(self) -> str:
         return f"TokenUsage: {self.id}"
 
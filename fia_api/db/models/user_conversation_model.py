@@ -21,6 +21,13 @@ class UserConversationModel(FiaBaseModel):
         max_length=2,  # noqa: WPS432
     )
 
+    # Version of the conversation prompt the conversation was started with.
+    prompt_version = fields.CharField(
+        null=True,
+        required=False,
+        max_length=16,  # noqa: WPS432
+    )
+
     def __str__(self) -> str:
         return f"UserConversationModel: {self.id}"
 
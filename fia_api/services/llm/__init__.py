@@ -0,0 +1 @@
+"""LLM service."""
@@ -0,0 +1,181 @@
+"""
+Async gateway for every call made to OpenAI.
+
+All teacher code should go through here rather than calling the synchronous
+``openai`` helpers, which block the event loop for the whole round trip.
+Every call gets a deadline, retries and circuit breaking, see
+fia_api.services.llm.resilience, and Chat Completions are sent to the backend
+their route picks, see fia_api.services.llm.routing.
+"""
+import asyncio
+import io
+from typing import Any, AsyncIterator, Dict, Optional
+
+import aiohttp
+import openai
+
+from fia_api.services.llm.resilience import LLMUnavailableError, call_with_resilience
+from fia_api.services.llm.routing import LLMRoute, call_with_routing
+from fia_api.settings import settings
+
+openai.api_key = settings.openai_api_key
+openai.api_base = settings.openai_api_base
+
+# Whisper isn't routed, but gets its own circuit breaker.
+TRANSCRIPTION_BACKEND = "whisper"
+# Whisper works out the format from the file name, and sniffs the content
+# anyway, so every upload is sent as a WAV.
+TRANSCRIPTION_FILE_NAME = "audio.wav"
+
+
+class SharedHTTPSession:
+    """
+    The pooled HTTP session shared across all requests in this worker.
+
+    Set up in the app lifespan, see fia_api.services.llm.lifetime.
+    """
+
+    session: Optional[aiohttp.ClientSession] = None
+
+
+shared_http_session = SharedHTTPSession()
+
+
+def set_http_session(http_session: Optional[aiohttp.ClientSession]) -> None:
+    """
+    Set the pooled HTTP session used for all OpenAI requests.
+
+    :param http_session: The aiohttp session to use, or None to unset it.
+    """
+    shared_http_session.session = http_session
+
+
+def _use_shared_session() -> None:
+    """
+    Point the openai library at the shared session for the current context.
+
+    ``openai.aiosession`` is a ContextVar, so it has to be set in the context
+    of each request rather than once at startup. If no session has been set
+    up (e.g. in tests), openai falls back to a session per call.
+    """
+    http_session = shared_http_session.session
+    if http_session is not None and not http_session.closed:
+        openai.aiosession.set(http_session)
+
+
+async def create_chat_completion(
+    route: LLMRoute = LLMRoute.DEFAULT,
+    **kwargs: Any,
+) -> Any:
+    """
+    Asynchronously create an OpenAI Chat Completion.
+
+    :param route: LLMRoute picking the backend (and so the model) to use.
+    :param kwargs: Passed directly to ``openai.ChatCompletion.acreate``.
+    :returns: The OpenAI response object.
+    """
+    _use_shared_session()
+
+    async def _create(  # noqa: WPS430
+        backend: str,
+        backend_kwargs: Dict[str, Any],
+    ) -> Any:
+        return await call_with_resilience(
+            lambda: openai.ChatCompletion.acreate(**kwargs, **backend_kwargs),
+            backend=backend,
+        )
+
+    return await call_with_routing(route, _create)
+
+
+async def _iter_stream_content(chunks: Any) -> AsyncIterator[str]:
+    """
+    Yield the content of a Chat Completion stream, with a deadline per chunk.
+
+    :param chunks: The async iterator of chunks from OpenAI.
+    :raises LLMUnavailableError: If the stream stalls.
+    :yields: String content deltas.
+    """
+    stream = aiter(chunks)
+    while True:  # noqa: WPS457
+        try:
+            chunk = await asyncio.wait_for(
+                anext(stream),
+                timeout=settings.llm_deadline_seconds,
+            )
+        except StopAsyncIteration:
+            return
+        except asyncio.TimeoutError as exc:
+            raise LLMUnavailableError("LLM stream stalled") from exc
+
+        content = chunk["choices"][0]["delta"].get("content")  # noqa: WPS219
+
+        if content:
+            yield content
+
+
+async def stream_chat_completion(
+    route: LLMRoute = LLMRoute.DEFAULT,
+    **kwargs: Any,
+) -> AsyncIterator[str]:
+    """
+    Asynchronously stream the content of an OpenAI Chat Completion.
+
+    Only starting the stream is retried (or sent to a fallback backend), once
+    tokens have been yielded it can't be. The deadline applies to the wait for
+    each chunk, and LLMUnavailableError is raised if the stream stalls.
+
+    :param route: LLMRoute picking the backend (and so the model) to use.
+    :param kwargs: Passed directly to ``openai.ChatCompletion.acreate``.
+    :yields: String content deltas as they are generated.
+    """
+    _use_shared_session()
+
+    async def _start_stream(  # noqa: WPS430
+        backend: str,
+        backend_kwargs: Dict[str, Any],
+    ) -> Any:
+        return await call_with_resilience(
+            lambda: openai.ChatCompletion.acreate(
+                stream=True,
+                **kwargs,
+                **backend_kwargs,
+            ),
+            hedge=False,
+            backend=backend,
+        )
+
+    chunks = await call_with_routing(route, _start_stream)
+
+    async for content in _iter_stream_content(chunks):
+        yield content
+
+
+async def transcribe_audio(audio: bytes, language_code: str) -> str:
+    """
+    Asynchronously transcribe audio with Whisper.
+
+    :param audio: Bytes of the audio to transcribe.
+    :param language_code: String ISO 639-1 language code the audio is in.
+    :returns: String transcription of the audio.
+    """
+    _use_shared_session()
+
+    def _transcribe() -> Any:  # noqa: WPS430
+        # A file per attempt, so an abandoned attempt can't move the position
+        # of the next one.
+        audio_file = io.BytesIO(audio)
+        audio_file.name = TRANSCRIPTION_FILE_NAME
+        return openai.Audio.atranscribe(
+            "whisper-1",
+            audio_file,
+            language=language_code,
+        )
+
+    transcription = await call_with_resilience(
+        _transcribe,
+        hedge=False,
+        backend=TRANSCRIPTION_BACKEND,
+    )
+
+    return transcription["text"]
@@ -0,0 +1,29 @@
+import aiohttp
+from fastapi import FastAPI
+
+from fia_api.services.llm.gateway import set_http_session
+from fia_api.settings import settings
+
+
+def init_llm(app: FastAPI) -> None:  # pragma: no cover
+    """
+    Creates the pooled HTTP session shared by all LLM requests.
+
+    :param app: current fastapi application.
+    """
+    app.state.llm_session = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(
+            limit=settings.openai_max_connections,
+        ),
+    )
+    set_http_session(app.state.llm_session)
+
+
+async def shutdown_llm(app: FastAPI) -> None:  # pragma: no cover
+    """
+    Closes the pooled LLM HTTP session.
+
+    :param app: current FastAPI app.
+    """
+    set_http_session(None)
+    await app.state.llm_session.close()
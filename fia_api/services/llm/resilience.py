@@ -0,0 +1,324 @@
+"""
+Deadlines, retries, circuit breaking and hedging for calls to the LLM.
+
+Every attempt gets a deadline. Attempts that time out or hit a transient
+upstream error are retried with exponential backoff and full jitter. Too many
+consecutive failures open the circuit breaker, and calls fail fast with
+LLMUnavailableError until it lets a trial call through again.
+
+With settings.llm_hedging_enabled, an attempt that hasn't answered by the p95
+latency of recent calls fires a second identical request, and whichever
+answers first is used.
+
+Each backend (see fia_api.services.llm.routing) has its own circuit breaker
+and latency tracker.
+"""
+import asyncio
+import random
+import time
+from collections import defaultdict, deque
+from typing import Any, Awaitable, Callable, DefaultDict, Optional, Set, Tuple, TypeVar
+
+import openai
+from loguru import logger
+
+from fia_api.settings import settings
+
+ResultT = TypeVar("ResultT")
+
+# Transient upstream errors worth retrying. Anything else (e.g. a bad request)
+# would fail the same way again.
+RETRYABLE_ERRORS = (
+    asyncio.TimeoutError,
+    openai.error.Timeout,
+    openai.error.APIError,
+    openai.error.APIConnectionError,
+    openai.error.RateLimitError,
+    openai.error.ServiceUnavailableError,
+    openai.error.TryAgain,
+)
+
+# Max number of recent latencies the p95 is worked out from.
+LATENCY_WINDOW_SIZE = 200
+# Hedge once a call is slower than this fraction of recent calls.
+HEDGE_LATENCY_QUANTILE = 0.95
+DEFAULT_BACKEND = "default"
+
+
+class LLMUnavailableError(Exception):
+    """The LLM can't be reached, or the circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """Fails fast once an upstream has failed too many times in a row."""
+
+    def __init__(self) -> None:
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+
+    def is_open(self) -> bool:
+        """
+        Whether calls are currently failing fast.
+
+        :returns: True if the breaker is open and not yet due a trial call.
+        """
+        return (
+            self.opened_at is not None
+            and time.monotonic() - self.opened_at < settings.llm_circuit_reset_seconds
+        )
+
+    def allow_request(self) -> bool:
+        """
+        Whether a call may be made.
+
+        Once open, a trial call is let through every
+        settings.llm_circuit_reset_seconds, and its result closes or re-opens
+        the breaker.
+
+        :returns: True if the call may be made.
+        """
+        if self.opened_at is None:
+            return True
+
+        if time.monotonic() - self.opened_at < settings.llm_circuit_reset_seconds:
+            return False
+
+        self.opened_at = time.monotonic()
+        return True
+
+    def record_success(self) -> None:
+        """Close the breaker."""
+        self.consecutive_failures = 0
+        self.opened_at = None
+
+    def record_failure(self) -> None:
+        """Count a failure, opening the breaker if there have been too many."""
+        self.consecutive_failures += 1
+
+        if self.consecutive_failures >= settings.llm_circuit_failure_threshold:
+            if self.opened_at is None:
+                logger.error("LLM circuit breaker opened")
+            self.opened_at = time.monotonic()
+
+
+class LatencyTracker:
+    """
+    Latencies of recent successful calls.
+
+    Used to pick the hedge delay, and to route around slow backends. Only
+    calls from the last settings.llm_latency_window_seconds count, so a
+    backend that stops being used because it was slow is tried again later.
+    """
+
+    def __init__(self) -> None:
+        # (time recorded, latency)
+        self.latencies: "deque[Tuple[float, float]]" = deque(
+            maxlen=LATENCY_WINDOW_SIZE,
+        )
+
+    def record(self, latency: float) -> None:
+        """
+        Record the latency of a successful call.
+
+        :param latency: Float seconds the call took.
+        """
+        self.latencies.append((time.monotonic(), latency))
+
+    def get_p95(self, min_samples: int) -> Optional[float]:
+        """
+        Get the p95 latency of recent calls.
+
+        :param min_samples: Int number of recent calls needed to trust it.
+        :returns: Float seconds, or None if there aren't enough recent calls.
+        """
+        window_start = time.monotonic() - settings.llm_latency_window_seconds
+        sorted_latencies = sorted(
+            latency
+            for recorded_at, latency in self.latencies
+            if recorded_at >= window_start
+        )
+
+        if not sorted_latencies or len(sorted_latencies) < min_samples:
+            return None
+
+        return sorted_latencies[int(len(sorted_latencies) * HEDGE_LATENCY_QUANTILE)]
+
+    def get_hedge_delay(self) -> float:
+        """
+        Get how long to wait before sending a hedged request.
+
+        :returns: Float seconds, the p95 latency once there are enough samples.
+        """
+        p95_latency = self.get_p95(settings.llm_hedge_min_samples)
+        if p95_latency is None:
+            return settings.llm_hedge_default_delay_seconds
+
+        return p95_latency
+
+
+# Backend name -> its CircuitBreaker/LatencyTracker.
+circuit_breakers: DefaultDict[str, CircuitBreaker] = defaultdict(CircuitBreaker)
+latency_trackers: DefaultDict[str, LatencyTracker] = defaultdict(LatencyTracker)
+
+
+def get_retry_delay(attempt: int) -> float:
+    """
+    Get how long to wait before a retry, with exponential backoff and jitter.
+
+    :param attempt: Int number of attempts made so far.
+    :returns: Float seconds to wait.
+    """
+    max_delay = min(
+        settings.llm_retry_backoff_max_seconds,
+        settings.llm_retry_backoff_seconds * 2 ** (attempt - 1),
+    )
+
+    return random.uniform(0, max_delay)  # noqa: S311
+
+
+async def _cancel_all(tasks: Set["asyncio.Task[Any]"]) -> None:
+    """
+    Cancel tasks and wait for them to finish.
+
+    :param tasks: The tasks to cancel.
+    """
+    for task in tasks:
+        task.cancel()
+
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def _wait_for_first_success(
+    pending: Set["asyncio.Task[ResultT]"],
+) -> ResultT:
+    """
+    Wait for the first of some tasks to succeed.
+
+    :param pending: The tasks. Those that finish are removed from it.
+    :returns: The result of the first task to succeed, or raises the error of
+              the last to fail.
+    """
+    while True:  # noqa: WPS457
+        done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        pending.difference_update(done)
+        succeeded = [task for task in done if task.exception() is None]
+
+        if succeeded:
+            return succeeded[0].result()
+
+        if not pending:
+            return done.pop().result()
+
+
+async def call_hedged(
+    func: Callable[[], Awaitable[ResultT]],
+    latency_tracker: LatencyTracker,
+) -> ResultT:
+    """
+    Call func, and call it again if the first call is slow.
+
+    The calls still running are cancelled once one succeeds, or if this is.
+
+    :param func: Function making the request.
+    :param latency_tracker: LatencyTracker of the backend called.
+    :raises Exception: The error of the last call to fail, if both did.
+    :raises asyncio.CancelledError: If cancelled, e.g. by the deadline.
+    :returns: The result of whichever call succeeds first.
+    """
+    pending = {asyncio.ensure_future(func())}
+
+    try:
+        done, _ = await asyncio.wait(
+            pending,
+            timeout=latency_tracker.get_hedge_delay(),
+        )
+        if not done:
+            logger.info("Sending hedged LLM request")
+            pending.add(asyncio.ensure_future(func()))
+
+        hedged_result = await _wait_for_first_success(pending)
+    except (Exception, asyncio.CancelledError):
+        await _cancel_all(pending)
+        raise
+
+    await _cancel_all(pending)
+
+    return hedged_result
+
+
+async def call_attempt(
+    func: Callable[[], Awaitable[ResultT]],
+    hedge: bool,
+    backend: str,
+    attempt: int,
+) -> ResultT:
+    """
+    Make one attempt at a call, with a deadline and the circuit breaker.
+
+    :param func: Function making the request.
+    :param hedge: Whether the request is safe to hedge.
+    :param backend: String name of the backend called.
+    :param attempt: Int number of the attempt, to log.
+    :raises LLMUnavailableError: If the circuit is open.
+    :raises RETRYABLE_ERRORS: If the attempt failed with a transient error.
+    :returns: The result of func.
+    """
+    circuit_breaker = circuit_breakers[backend]
+    latency_tracker = latency_trackers[backend]
+    if not circuit_breaker.allow_request():
+        raise LLMUnavailableError("LLM circuit breaker is open")
+
+    started_at = time.monotonic()
+    try:
+        llm_result = await asyncio.wait_for(
+            (
+                call_hedged(func, latency_tracker)
+                if hedge and settings.llm_hedging_enabled
+                else func()
+            ),
+            timeout=settings.llm_deadline_seconds,
+        )
+    except RETRYABLE_ERRORS as exc:
+        circuit_breaker.record_failure()
+        logger.warning(
+            {
+                "message": "LLM call failed",
+                "backend": backend,
+                "attempt": attempt,
+                "error": repr(exc),
+            },
+        )
+        raise
+
+    circuit_breaker.record_success()
+    latency_tracker.record(time.monotonic() - started_at)
+
+    return llm_result
+
+
+async def call_with_resilience(
+    func: Callable[[], Awaitable[ResultT]],
+    hedge: bool = True,
+    backend: str = DEFAULT_BACKEND,
+) -> ResultT:
+    """
+    Call the LLM with a deadline, retries and the circuit breaker.
+
+    :param func: Function making the request. Called again for each attempt.
+    :param hedge: Whether the request is safe to hedge.
+    :param backend: String name of the backend called, whose circuit breaker
+                    and latency tracker to use.
+    :raises LLMUnavailableError: If the circuit is open, or all attempts
+                                 failed with transient errors.
+    :returns: The result of func.
+    """
+    for attempt in range(1, settings.llm_max_retries + 1):
+        try:
+            return await call_attempt(func, hedge, backend, attempt)
+        except RETRYABLE_ERRORS:
+            await asyncio.sleep(get_retry_delay(attempt))
+
+    try:
+        return await call_attempt(func, hedge, backend, settings.llm_max_retries + 1)
+    except RETRYABLE_ERRORS as exc:
+        raise LLMUnavailableError("LLM call failed") from exc
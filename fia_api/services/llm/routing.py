@@ -0,0 +1,149 @@
+"""
+Routing of LLM calls between backends.
+
+Each kind of call (an LLMRoute) has a list of backends in
+settings.llm_routes, most preferred first, so e.g. learning moments can go to
+a fast, cheap model while long conversation continuations go to a stronger
+one. A backend is passed over for the next while its circuit breaker is open
+or its recent p95 latency is above settings.llm_fallback_p95_seconds, and if a
+call to a backend fails outright the next one is tried.
+"""
+import enum
+from typing import Any, Awaitable, Callable, Dict, List, TypeVar
+
+from loguru import logger
+
+from fia_api.services.llm.resilience import (
+    DEFAULT_BACKEND,
+    LLMUnavailableError,
+    circuit_breakers,
+    latency_trackers,
+)
+from fia_api.settings import settings
+
+ResultT = TypeVar("ResultT")
+
+
+class LLMRoute(str, enum.Enum):  # noqa: WPS600
+    """Kinds of LLM call, each routed separately."""
+
+    DEFAULT = "default"
+    LEARNING_MOMENTS = "learning_moments"
+    BATCH_LEARNING_MOMENTS = "batch_learning_moments"
+    CONVERSATION_CONTINUATION = "conversation_continuation"
+    SHORT_CONVERSATION_CONTINUATION = "short_conversation_continuation"
+    CONVERSATION_SUMMARY = "conversation_summary"
+
+
+def get_continuation_route(message: str) -> LLMRoute:
+    """
+    Get the route to continue a conversation on, by the user's last message.
+
+    :param message: String last message from the user.
+    :returns: LLMRoute
+    """
+    if len(message) <= settings.llm_short_message_characters:
+        return LLMRoute.SHORT_CONVERSATION_CONTINUATION
+
+    return LLMRoute.CONVERSATION_CONTINUATION
+
+
+def get_route_backends(route: LLMRoute) -> List[str]:
+    """
+    Get the backends configured for a route, most preferred first.
+
+    :param route: LLMRoute of the call.
+    :returns: List of string backend names.
+    """
+    return (
+        settings.llm_routes.get(route.value)
+        or settings.llm_routes.get(LLMRoute.DEFAULT.value)
+        or [DEFAULT_BACKEND]
+    )
+
+
+def get_route_model(route: LLMRoute) -> str:
+    """
+    Get the model calls on a route normally go to.
+
+    :param route: LLMRoute of the call.
+    :returns: String model name of the most preferred backend.
+    """
+    return settings.llm_backends[get_route_backends(route)[0]].model
+
+
+def is_backend_healthy(backend: str) -> bool:
+    """
+    Whether a backend is fast and up enough to prefer.
+
+    :param backend: String backend name.
+    :returns: True unless its circuit is open or its p95 is over the threshold.
+    """
+    if circuit_breakers[backend].is_open():
+        return False
+
+    p95_latency = latency_trackers[backend].get_p95(
+        settings.llm_fallback_min_samples,
+    )
+    return p95_latency is None or p95_latency <= settings.llm_fallback_p95_seconds
+
+
+def get_backends_in_order(route: LLMRoute) -> List[str]:
+    """
+    Get the backends to try for a call, healthy ones first.
+
+    Unhealthy backends are still tried last, in case every backend is slow.
+
+    :param route: LLMRoute of the call.
+    :returns: List of string backend names.
+    """
+    backends = get_route_backends(route)
+    healthy_backends = [backend for backend in backends if is_backend_healthy(backend)]
+
+    return healthy_backends + [
+        backend for backend in backends if backend not in healthy_backends
+    ]
+
+
+def get_backend_kwargs(backend: str) -> Dict[str, Any]:
+    """
+    Get the kwargs to send a Chat Completion to a backend.
+
+    :param backend: String backend name.
+    :returns: Dict of model, and api_base/api_key if the backend sets them.
+    """
+    llm_backend = settings.llm_backends[backend]
+
+    return llm_backend.model_dump(exclude_none=True)
+
+
+async def call_with_routing(
+    route: LLMRoute,
+    call: Callable[[str, Dict[str, Any]], Awaitable[ResultT]],
+) -> ResultT:
+    """
+    Make a call on the best backend for the route, falling back on failure.
+
+    A backend has failed when call raises LLMUnavailableError. If every
+    backend fails, the error of the last one is raised.
+
+    :param route: LLMRoute of the call.
+    :param call: Function making the call, given the backend name and the
+                 kwargs to send to it.
+    :returns: The result of call.
+    """
+    backends = get_backends_in_order(route)
+
+    for backend in backends[:-1]:
+        try:
+            return await call(backend, get_backend_kwargs(backend))
+        except LLMUnavailableError:
+            logger.warning(
+                {
+                    "message": "LLM backend unavailable, falling back",
+                    "route": route.value,
+                    "backend": backend,
+                },
+            )
+
+    return await call(backends[-1], get_backend_kwargs(backends[-1]))
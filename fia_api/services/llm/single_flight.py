@@ -0,0 +1,272 @@
+"""
+Single-flight coalescing of identical in-flight LLM requests.
+
+Concurrent calls with the same key share one in-flight request within a
+worker. With settings.single_flight_redis_enabled, a Redis lock also
+coalesces them across workers: the worker holding the lock makes the request
+and publishes the result for the others waiting on it. The lock is refreshed
+while the request runs, however long retries and fallbacks make it, so it
+never expires under the worker holding it.
+"""
+import asyncio
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Optional, Type, TypeVar, cast
+
+from loguru import logger
+from pydantic import BaseModel
+from redis.asyncio import ConnectionPool, Redis, RedisError
+
+from fia_api.settings import settings
+
+ResultT = TypeVar("ResultT", bound=BaseModel)
+
+SINGLE_FLIGHT_PREFIX = "single_flight"
+
+# Refresh the lock this many times per settings.single_flight_lock_ttl_seconds.
+LOCK_REFRESHES_PER_TTL = 3
+
+# Extends or deletes the lock only if it is still held with the given token,
+# all in one step so a lock taken over by another worker is never touched.
+EXTEND_LOCK_SCRIPT = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("PEXPIRE", KEYS[1], ARGV[2])
+end
+return 0
+"""
+RELEASE_LOCK_SCRIPT = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("DEL", KEYS[1])
+end
+return 0
+"""
+
+# Key -> the in-flight request in this worker. Each request's result is of
+# the result_type it was started with.
+_in_flight: Dict[str, "asyncio.Future[Any]"] = {}
+
+
+def _get_lock_ttl_ms() -> int:
+    """
+    Get how long a lock lasts unless refreshed, and a result is kept for.
+
+    :returns: Int milliseconds.
+    """
+    return int(settings.single_flight_lock_ttl_seconds * 1000)
+
+
+async def _wait_for_leader(
+    redis: Redis,
+    key: str,
+    result_type: Type[ResultT],
+) -> Optional[ResultT]:
+    """
+    Wait for the worker holding the lock to publish the result of its request.
+
+    :param redis: Redis client.
+    :param key: String key of the request.
+    :param result_type: Pydantic model the result is parsed as.
+    :returns: The result, or None if the lock was released without one.
+    """
+    lock_key = f"{SINGLE_FLIGHT_PREFIX}:lock:{key}"
+    leader_token = await redis.get(lock_key)
+    if leader_token is None:
+        return None
+
+    result_key = f"{SINGLE_FLIGHT_PREFIX}:result:{key}:{leader_token.decode()}"
+
+    while True:  # noqa: WPS457
+        raw_result = await redis.get(result_key)
+        if raw_result is not None:
+            return result_type.model_validate_json(raw_result)
+
+        if await redis.get(lock_key) != leader_token:
+            # The lock was released or expired without a result being stored,
+            # so one might have been stored just before it was released.
+            raw_result = await redis.get(result_key)
+            if raw_result is None:
+                return None
+            return result_type.model_validate_json(raw_result)
+
+        await asyncio.sleep(settings.single_flight_poll_interval_seconds)
+
+
+async def _keep_lock(redis: Redis, lock_key: str, token: str) -> None:
+    """
+    Keep refreshing the lock until cancelled, while this worker holds it.
+
+    :param redis: Redis client.
+    :param lock_key: String key of the lock.
+    :param token: String token of the lock this worker holds.
+    """
+    refresh_interval = settings.single_flight_lock_ttl_seconds / LOCK_REFRESHES_PER_TTL
+
+    while True:  # noqa: WPS457
+        await asyncio.sleep(refresh_interval)
+        try:
+            lock_extended = await redis.eval(
+                EXTEND_LOCK_SCRIPT,
+                1,
+                lock_key,
+                token,
+                _get_lock_ttl_ms(),
+            )
+        except RedisError:
+            logger.exception("Failed to refresh single flight lock")
+            return
+
+        if not lock_extended:
+            logger.warning({"message": "Lost single flight lock", "key": lock_key})
+            return
+
+
+async def _lead(
+    redis: Redis,
+    key: str,
+    token: str,
+    func: Callable[[], Awaitable[ResultT]],
+) -> ResultT:
+    """
+    Make the request while holding the lock, and publish the result.
+
+    :param redis: Redis client.
+    :param key: String key of the request.
+    :param token: String token of the lock this worker holds.
+    :param func: Function making the request.
+    :returns: The result of func.
+    :raises Exception: If func fails, after releasing the lock.
+    """
+    lock_key = f"{SINGLE_FLIGHT_PREFIX}:lock:{key}"
+    lock_keeper = asyncio.create_task(_keep_lock(redis, lock_key, token))
+
+    try:
+        single_flight_result = await func()
+    except Exception:
+        await _release_lock(redis, lock_key, token)
+        raise
+    finally:
+        lock_keeper.cancel()
+
+    try:
+        await redis.set(
+            f"{SINGLE_FLIGHT_PREFIX}:result:{key}:{token}",
+            single_flight_result.model_dump_json(),
+            px=_get_lock_ttl_ms(),
+        )
+    except RedisError:
+        logger.exception("Failed to publish single flight result")
+
+    await _release_lock(redis, lock_key, token)
+
+    return single_flight_result
+
+
+async def _release_lock(redis: Redis, lock_key: str, token: str) -> None:
+    """
+    Release the lock, if this worker still holds it.
+
+    :param redis: Redis client.
+    :param lock_key: String key of the lock.
+    :param token: String token of the lock this worker holds.
+    """
+    try:
+        await redis.eval(RELEASE_LOCK_SCRIPT, 1, lock_key, token)
+    except RedisError:
+        logger.exception("Failed to release single flight lock")
+
+
+async def coalesce_across_workers(
+    redis_pool: ConnectionPool,
+    key: str,
+    func: Callable[[], Awaitable[ResultT]],
+    result_type: Type[ResultT],
+) -> ResultT:
+    """
+    Run func, unless another worker is already running it for the same key.
+
+    :param redis_pool: Redis connection pool.
+    :param key: String key identifying identical requests.
+    :param func: Function making the request.
+    :param result_type: Pydantic model the result is parsed as.
+    :returns: The result of func, from this worker or another one.
+    """
+    lock_key = f"{SINGLE_FLIGHT_PREFIX}:lock:{key}"
+    token = uuid.uuid4().hex
+    deadline = asyncio.get_running_loop().time() + (
+        settings.single_flight_lock_ttl_seconds
+    )
+
+    async with Redis(connection_pool=redis_pool) as redis:
+        while asyncio.get_running_loop().time() < deadline:
+            if await redis.set(lock_key, token, nx=True, px=_get_lock_ttl_ms()):
+                return await _lead(redis, key, token, func)
+
+            leader_result = await _wait_for_leader(redis, key, result_type)
+            if leader_result is not None:
+                return leader_result
+
+    # Leaders kept giving up without a result for as long as a lock lasts, so
+    # just make the request.
+    return await func()
+
+
+async def _run_leader(
+    key: str,
+    func: Callable[[], Awaitable[ResultT]],
+    result_type: Type[ResultT],
+    redis_pool: Optional[ConnectionPool],
+) -> ResultT:
+    """
+    Make the request for this worker, coalescing across workers if enabled.
+
+    :param key: String key identifying identical requests.
+    :param func: Function making the request.
+    :param result_type: Pydantic model the result is parsed as.
+    :param redis_pool: Optional Redis connection pool.
+    :returns: The result of func.
+    """
+    if redis_pool is None or not settings.single_flight_redis_enabled:
+        return await func()
+
+    try:
+        return await coalesce_across_workers(redis_pool, key, func, result_type)
+    except RedisError:
+        logger.exception("Failed to coalesce request across workers")
+
+    return await func()
+
+
+async def single_flight(
+    key: str,
+    func: Callable[[], Awaitable[ResultT]],
+    result_type: Type[ResultT],
+    redis_pool: Optional[ConnectionPool] = None,
+) -> ResultT:
+    """
+    Share one in-flight request between concurrent callers with the same key.
+
+    :param key: String key identifying identical requests.
+    :param func: Function making the request.
+    :param result_type: Pydantic model the result is parsed as.
+    :param redis_pool: Optional Redis connection pool to coalesce across
+                       workers.
+    :returns: The result of func, possibly from another caller's request.
+    """
+    if not settings.single_flight_enabled:
+        return await func()
+
+    in_flight = _in_flight.get(key)
+
+    if in_flight is None:
+        in_flight = asyncio.ensure_future(
+            _run_leader(key, func, result_type, redis_pool),
+        )
+        _in_flight[key] = in_flight
+
+        def _forget(done: "asyncio.Future[Any]") -> None:  # noqa: WPS430
+            if _in_flight.get(key) is done:
+                del _in_flight[key]  # noqa: WPS420
+
+        in_flight.add_done_callback(_forget)
+
+    # Shielded so one caller going away doesn't cancel it for the others.
+    return cast(ResultT, await asyncio.shield(in_flight))
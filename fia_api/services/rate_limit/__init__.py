@@ -0,0 +1 @@
+"""Rate limiting and token quota service."""
@@ -0,0 +1,213 @@
+"""
+Per-user rate limits and daily LLM token quotas, kept in Redis.
+
+Each user gets a token bucket per endpoint, holding up to
+settings.rate_limit_bucket_capacity requests and refilling at
+settings.rate_limit_refill_per_second. Separately, the LLM tokens used on
+behalf of each user are counted per UTC day and capped at
+settings.token_quota_daily_tokens.
+
+Both fail open: if Redis is unavailable, requests are let through.
+"""
+import math
+import time
+from contextvars import ContextVar
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Tuple
+
+from loguru import logger
+from redis.asyncio import ConnectionPool, Redis, RedisError
+
+from fia_api.settings import settings
+
+RATE_LIMIT_PREFIX = "rate_limit"
+QUOTA_PREFIX = "token_quota"
+
+# Refills the bucket for the time since it was last updated, then takes a
+# token if there is one, all in one step so concurrent requests can't race.
+# Returns the seconds until a token is available as a string, as Redis would
+# truncate a Lua number to an integer.
+RATE_LIMIT_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local refill_rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call("HMGET", KEYS[1], "tokens", "updated_at")
+
+local available = capacity
+if bucket[1] then
+    local refilled = (now - tonumber(bucket[2])) * refill_rate
+    available = math.min(capacity, tonumber(bucket[1]) + refilled)
+end
+
+local retry_after = 0
+if available >= 1 then
+    available = available - 1
+else
+    retry_after = (1 - available) / refill_rate
+end
+
+redis.call("HSET", KEYS[1], "tokens", available, "updated_at", now)
+-- A bucket left alone long enough is full, so can go.
+redis.call("EXPIRE", KEYS[1], math.ceil(capacity / refill_rate) + 1)
+
+return tostring(retry_after)
+"""
+
+# The Redis pool and user ID LLM token usage is counted against.
+TokenQuotaOwner = Tuple[ConnectionPool, str]
+
+# Who LLM token usage in the current request is counted against. Set once the
+# request has passed its limits, see start_token_quota.
+_token_quota_owner: ContextVar[Optional[TokenQuotaOwner]] = ContextVar(
+    "token_quota_owner",
+    default=None,
+)
+
+
+async def take_rate_limit_token(
+    redis_pool: ConnectionPool,
+    user_id: str,
+    endpoint: str,
+) -> float:
+    """
+    Take a token from the user's bucket for an endpoint, if there is one.
+
+    :param redis_pool: Redis connection pool.
+    :param user_id: String ID of the user the bucket belongs to.
+    :param endpoint: String name of the endpoint the bucket is for.
+    :returns: Float seconds until a token is available, 0 if one was taken.
+    """
+    async with Redis(connection_pool=redis_pool) as redis:
+        retry_after = await redis.eval(
+            RATE_LIMIT_SCRIPT,
+            1,
+            f"{RATE_LIMIT_PREFIX}:{endpoint}:{user_id}",
+            settings.rate_limit_bucket_capacity,
+            settings.rate_limit_refill_per_second,
+            time.time(),
+        )
+
+    return float(retry_after)
+
+
+def _get_token_quota_key(user_id: str) -> str:
+    """
+    Get the key of the user's token usage for today.
+
+    :param user_id: String ID of the user.
+    :returns: String Redis key.
+    """
+    today = datetime.now(timezone.utc).date().isoformat()
+    return f"{QUOTA_PREFIX}:{user_id}:{today}"
+
+
+def _seconds_until_tomorrow() -> float:
+    """
+    Get the seconds until the quotas reset at midnight UTC.
+
+    :returns: Float seconds.
+    """
+    now = datetime.now(timezone.utc)
+    tomorrow = datetime.combine(
+        now.date() + timedelta(days=1),
+        datetime.min.time(),
+        tzinfo=timezone.utc,
+    )
+    return (tomorrow - now).total_seconds()
+
+
+async def get_token_quota_retry_after(
+    redis_pool: ConnectionPool,
+    user_id: str,
+) -> float:
+    """
+    Check whether the user has used up their tokens for today.
+
+    :param redis_pool: Redis connection pool.
+    :param user_id: String ID of the user.
+    :returns: Float seconds until the quota resets if used up, otherwise 0.
+    """
+    if not settings.token_quota_daily_tokens:
+        return 0
+
+    async with Redis(connection_pool=redis_pool) as redis:
+        used_tokens = await redis.get(_get_token_quota_key(user_id))
+
+    if used_tokens is None or int(used_tokens) < settings.token_quota_daily_tokens:
+        return 0
+
+    return _seconds_until_tomorrow()
+
+
+async def check_limits(
+    redis_pool: ConnectionPool,
+    user_id: str,
+    endpoint: str,
+) -> float:
+    """
+    Check a request against the user's rate limit and token quota.
+
+    :param redis_pool: Redis connection pool.
+    :param user_id: String ID of the user making the request.
+    :param endpoint: String name of the endpoint requested.
+    :returns: Float seconds to wait before retrying, 0 if the request can go.
+    """
+    try:
+        retry_after = await get_token_quota_retry_after(redis_pool, user_id)
+        if retry_after:
+            return retry_after
+
+        if settings.rate_limit_enabled:
+            return await take_rate_limit_token(redis_pool, user_id, endpoint)
+    except RedisError:
+        logger.exception("Failed to check rate limits")
+
+    return 0
+
+
+def start_token_quota(redis_pool: ConnectionPool, user_id: str) -> None:
+    """
+    Count LLM token usage in the rest of this request against the user.
+
+    :param redis_pool: Redis connection pool.
+    :param user_id: String ID of the user.
+    """
+    _token_quota_owner.set((redis_pool, user_id))
+
+
+async def _increment_token_quota(redis: Redis, user_id: str, tokens: int) -> None:
+    """
+    Add to the user's token usage for today.
+
+    :param redis: Redis client.
+    :param user_id: String ID of the user.
+    :param tokens: Int tokens used.
+    """
+    quota_key = _get_token_quota_key(user_id)
+
+    async with redis.pipeline(transaction=True) as pipe:
+        pipe.incrby(quota_key, tokens)
+        pipe.expire(quota_key, math.ceil(_seconds_until_tomorrow()) + 60)
+        await pipe.execute()
+
+
+async def add_token_quota_usage(tokens: int) -> None:
+    """
+    Count LLM tokens against the quota of the user the request is for.
+
+    Does nothing outside of a request that called start_token_quota, e.g. in
+    the background worker.
+
+    :param tokens: Int tokens used.
+    """
+    token_quota_owner = _token_quota_owner.get()
+    if token_quota_owner is None or not tokens:
+        return
+
+    redis_pool, user_id = token_quota_owner
+
+    try:
+        async with Redis(connection_pool=redis_pool) as redis:
+            await _increment_token_quota(redis, user_id, tokens)
+    except RedisError:
+        logger.exception("Failed to record token quota usage")
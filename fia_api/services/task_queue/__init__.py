@@ -0,0 +1 @@
+"""Background task queue service."""
@@ -0,0 +1,217 @@
+"""
+Redis-backed queue of background tasks.
+
+Tasks are registered by name with register_task and enqueued as JSON with
+their kwargs, so the kwargs must be JSON serializable. A worker (see
+fia_api/worker.py) moves each one to its own processing list while running
+it, so a task is never lost if the worker dies part way through: the next
+worker to start requeues it. Tasks may therefore run more than once, and
+handlers must be safe to retry. Failed tasks are retried with an exponential
+backoff, and after settings.task_queue_max_retries they are moved to the
+dead-letter list to be inspected by hand.
+"""
+import json
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from loguru import logger
+from redis.asyncio import ConnectionPool, Redis
+
+from fia_api.settings import settings
+
+TASK_QUEUE_PREFIX = "task_queue"
+PENDING_KEY = f"{TASK_QUEUE_PREFIX}:pending"
+# Sorted set of tasks waiting to be retried, scored by when to retry them.
+DELAYED_KEY = f"{TASK_QUEUE_PREFIX}:delayed"
+DEAD_LETTER_KEY = f"{TASK_QUEUE_PREFIX}:dead_letter"
+# List of the tasks each worker is running, and the key it keeps alive while
+# it's running.
+PROCESSING_KEY_PREFIX = f"{TASK_QUEUE_PREFIX}:processing"
+WORKER_KEY_PREFIX = f"{TASK_QUEUE_PREFIX}:worker"
+
+# Identifies the worker in this process.
+WORKER_ID = uuid.uuid4().hex
+
+TaskHandler = Callable[..., Awaitable[None]]
+
+# Task name -> the function that runs it.
+_task_handlers: Dict[str, TaskHandler] = {}
+
+
+def register_task(name: str) -> Callable[[TaskHandler], TaskHandler]:
+    """
+    Register a function as the handler of a task.
+
+    :param name: String name the task is enqueued with.
+    :returns: Decorator registering the function.
+    """
+
+    def _register(handler: TaskHandler) -> TaskHandler:  # noqa: WPS430
+        _task_handlers[name] = handler
+        return handler
+
+    return _register
+
+
+async def enqueue_task(
+    redis_pool: ConnectionPool,
+    name: str,
+    **kwargs: Any,
+) -> None:
+    """
+    Enqueue a task to be run by a worker.
+
+    :param redis_pool: Redis connection pool.
+    :param name: String name of a registered task.
+    :param kwargs: JSON serializable kwargs to run the task with.
+    """
+    task = {"name": name, "kwargs": kwargs, "attempts": 0}
+
+    async with Redis(connection_pool=redis_pool) as redis:
+        await redis.lpush(PENDING_KEY, json.dumps(task))
+
+
+async def _retry_or_dead_letter(redis: Redis, task: Dict[str, Any]) -> None:
+    """
+    Schedule a failed task to be retried, or dead-letter it if out of retries.
+
+    :param redis: Redis client.
+    :param task: The task that failed.
+    """
+    task["attempts"] += 1
+
+    if task["attempts"] > settings.task_queue_max_retries:
+        logger.error({"message": "Task dead-lettered", "task": task})
+        await redis.lpush(DEAD_LETTER_KEY, json.dumps(task))
+        return
+
+    backoff_factor = 2 ** (task["attempts"] - 1)
+    retry_delay = settings.task_queue_retry_backoff_seconds * backoff_factor
+    retry_at = time.time() + retry_delay
+    await redis.zadd(DELAYED_KEY, {json.dumps(task): retry_at})
+
+
+async def _promote_delayed_tasks(redis: Redis) -> None:
+    """
+    Move delayed tasks that are due to be retried back to the queue.
+
+    :param redis: Redis client.
+    """
+    due_tasks = await redis.zrangebyscore(DELAYED_KEY, 0, time.time())
+
+    for raw_task in due_tasks:
+        # Only the worker that removes the task gets to requeue it.
+        if await redis.zrem(DELAYED_KEY, raw_task):
+            await redis.lpush(PENDING_KEY, raw_task)
+
+
+async def run_task(redis_pool: ConnectionPool, raw_task: bytes) -> None:
+    """
+    Run a task, scheduling a retry if it fails.
+
+    :param redis_pool: Redis connection pool.
+    :param raw_task: Bytes of the JSON encoded task.
+    """
+    task = json.loads(raw_task)
+    handler = _task_handlers.get(task["name"])
+
+    async with Redis(connection_pool=redis_pool) as redis:
+        if handler is None:
+            logger.error({"message": "Unknown task", "task": task})
+            await redis.lpush(DEAD_LETTER_KEY, raw_task)
+            return
+
+        try:
+            await handler(**task["kwargs"])
+        except Exception:
+            logger.exception({"message": "Task failed", "task": task})
+            await _retry_or_dead_letter(redis, task)
+
+
+def get_processing_key(worker_id: str) -> str:
+    """
+    Get the key of the list of tasks a worker is running.
+
+    :param worker_id: String ID of the worker.
+    :returns: String key.
+    """
+    return f"{PROCESSING_KEY_PREFIX}:{worker_id}"
+
+
+async def requeue_stale_tasks(redis_pool: ConnectionPool) -> int:
+    """
+    Requeue the tasks of workers that died while running them.
+
+    Run when a worker starts. A worker is presumed dead once it hasn't been
+    seen for settings.task_queue_worker_timeout_seconds.
+
+    :param redis_pool: Redis connection pool.
+    :returns: Int number of tasks requeued.
+    """
+    requeued = 0
+
+    async with Redis(connection_pool=redis_pool) as redis:
+        async for processing_key in redis.scan_iter(f"{PROCESSING_KEY_PREFIX}:*"):
+            worker_id = processing_key.decode().rsplit(":", 1)[-1]
+            if await redis.exists(f"{WORKER_KEY_PREFIX}:{worker_id}"):
+                continue
+
+            while await redis.rpoplpush(processing_key, PENDING_KEY) is not None:
+                requeued += 1
+
+    return requeued
+
+
+async def _claim_next_task(
+    redis_pool: ConnectionPool,
+    processing_key: str,
+    timeout: int,
+) -> Optional[bytes]:
+    """
+    Wait for the next task, moving it to this worker's processing list.
+
+    :param redis_pool: Redis connection pool.
+    :param processing_key: String key of this worker's processing list.
+    :param timeout: Whole seconds to wait for a task, as BLMOVE takes them.
+    :returns: Bytes of the JSON encoded task, or None if there wasn't one.
+    """
+    async with Redis(connection_pool=redis_pool) as redis:
+        await redis.set(
+            f"{WORKER_KEY_PREFIX}:{WORKER_ID}",
+            1,
+            ex=settings.task_queue_worker_timeout_seconds,
+        )
+        await _promote_delayed_tasks(redis)
+        return await redis.blmove(
+            PENDING_KEY,
+            processing_key,
+            timeout,
+            src="RIGHT",
+            dest="LEFT",
+        )
+
+
+async def process_next_task(redis_pool: ConnectionPool, timeout: int) -> bool:
+    """
+    Wait for the next task and run it.
+
+    The task stays on this worker's processing list until it has run, so it
+    is requeued by requeue_stale_tasks if the worker dies.
+
+    :param redis_pool: Redis connection pool.
+    :param timeout: Whole seconds to wait for a task, as BLMOVE takes them.
+    :returns: True if a task was run.
+    """
+    processing_key = get_processing_key(WORKER_ID)
+    raw_task = await _claim_next_task(redis_pool, processing_key, timeout)
+
+    if raw_task is None:
+        return False
+
+    await run_task(redis_pool, raw_task)
+
+    async with Redis(connection_pool=redis_pool) as redis:
+        await redis.lrem(processing_key, 1, raw_task)
+
+    return True
@@ -0,0 +1 @@
+"""Token usage accounting service."""
@@ -0,0 +1,275 @@
+"""
+Token usage accounting.
+
+By default usage is incremented in the DB straight away. With
+settings.token_usage_write_behind set, usage deltas are collected per
+conversation in memory or in Redis instead, and flushed to the DB in batches
+by a background task, keeping DB round trips off the request path.
+"""
+import uuid
+from collections import Counter, defaultdict
+from typing import DefaultDict, Dict, List, Mapping, Optional
+
+from loguru import logger
+from redis.asyncio import ConnectionPool, Redis, RedisError
+from tortoise import expressions
+from tortoise.transactions import in_transaction
+
+from fia_api.db.models.token_usage_model import TokenUsageModel
+from fia_api.services.rate_limit.limiter import add_token_quota_usage
+from fia_api.settings import TokenUsageWriteBehind, settings
+
+TOKEN_USAGE_FIELDS = (
+    "prompt_token_usage",
+    "completion_token_usage",
+    "saved_prompt_token_usage",
+)
+
+# Set of conversation IDs with deltas waiting in Redis.
+PENDING_SET_KEY = "token_usage:pending"
+PENDING_KEY_PREFIX = "token_usage:pending:"
+
+# Deltas waiting to be flushed in this worker, conversation_id -> deltas.
+_pending_deltas: DefaultDict[str, Counter[str]] = defaultdict(Counter)
+
+
+class TokenUsageRedis:
+    """
+    The Redis pool used by the Redis write-behind mode.
+
+    Set up in the app lifespan, see fia_api.services.token_usage.lifetime.
+    """
+
+    redis_pool: Optional[ConnectionPool] = None
+
+
+token_usage_redis = TokenUsageRedis()
+
+
+def set_redis_pool(redis_pool: Optional[ConnectionPool]) -> None:
+    """
+    Set the Redis pool used by the Redis write-behind mode.
+
+    :param redis_pool: Redis connection pool, or None to unset it.
+    """
+    token_usage_redis.redis_pool = redis_pool
+
+
+async def apply_token_usage(
+    conversation_id: str,
+    deltas: Mapping[str, int],
+) -> None:
+    """
+    Atomically add deltas to the token usage of a conversation in the DB.
+
+    :param conversation_id: String ID of the conversation.
+    :param deltas: Mapping of TokenUsageModel field to the amount to add.
+    """
+    updates = {
+        field: expressions.F(field) + deltas[field]
+        for field in TOKEN_USAGE_FIELDS
+        if deltas.get(field)
+    }
+    if not updates:
+        return
+
+    await TokenUsageModel.filter(
+        conversation_id=uuid.UUID(conversation_id),
+    ).update(**updates)
+
+
+async def _record_in_redis(
+    redis_pool: ConnectionPool,
+    conversation_id: str,
+    deltas: Mapping[str, int],
+) -> None:
+    """
+    Add deltas to the pending usage of a conversation in Redis.
+
+    :param redis_pool: Redis connection pool.
+    :param conversation_id: String ID of the conversation.
+    :param deltas: Mapping of TokenUsageModel field to the amount to add.
+    """
+    async with Redis(connection_pool=redis_pool) as redis:
+        async with redis.pipeline(transaction=True) as pipe:
+            for field, delta in deltas.items():
+                pipe.hincrby(f"{PENDING_KEY_PREFIX}{conversation_id}", field, delta)
+            pipe.sadd(PENDING_SET_KEY, conversation_id)
+            await pipe.execute()
+
+
+async def record_token_usage(
+    conversation_id: str,
+    prompt_tokens: int,
+    completion_tokens: int,
+    saved_prompt_tokens: int = 0,
+) -> None:
+    """
+    Record token usage for a conversation.
+
+    The used tokens also count towards the daily quota of the user making the
+    request.
+
+    :param conversation_id: String ID of the conversation.
+    :param prompt_tokens: Int number of prompt tokens used.
+    :param completion_tokens: Int number of completion tokens used.
+    :param saved_prompt_tokens: Int estimated number of prompt tokens saved.
+    """
+    await add_token_quota_usage(prompt_tokens + completion_tokens)
+
+    token_counts = zip(
+        TOKEN_USAGE_FIELDS,
+        (prompt_tokens, completion_tokens, saved_prompt_tokens),
+    )
+    deltas = {field: delta for field, delta in token_counts if delta}
+    if not deltas:
+        return
+
+    write_behind = settings.token_usage_write_behind
+
+    if write_behind == TokenUsageWriteBehind.MEMORY:
+        _pending_deltas[conversation_id].update(deltas)
+        return
+
+    if write_behind == TokenUsageWriteBehind.REDIS and token_usage_redis.redis_pool:
+        try:
+            await _record_in_redis(
+                token_usage_redis.redis_pool,
+                conversation_id,
+                deltas,
+            )
+        except RedisError:
+            logger.exception("Failed to record token usage in Redis")
+        else:
+            return
+
+    await apply_token_usage(conversation_id, deltas)
+
+
+def _decode_deltas(
+    conversation_ids: List[str],
+    raw_deltas: List[Dict[bytes, bytes]],
+) -> Dict[str, Dict[str, int]]:
+    """
+    Decode the pending deltas of conversations read from Redis.
+
+    :param conversation_ids: List of String conversation IDs.
+    :param raw_deltas: List of the raw hash of deltas of each conversation.
+    :returns: Dict of conversation_id -> deltas, without empty ones.
+    """
+    decoded_deltas = {}
+
+    for conversation_id, conversation_deltas in zip(conversation_ids, raw_deltas):
+        if conversation_deltas:
+            decoded_deltas[conversation_id] = {
+                field.decode(): int(delta)
+                for field, delta in conversation_deltas.items()
+            }
+
+    return decoded_deltas
+
+
+async def _pop_raw_deltas(
+    redis: Redis,
+    conversation_ids: List[str],
+) -> List[Dict[bytes, bytes]]:
+    """
+    Read and delete the pending deltas of conversations in Redis.
+
+    :param redis: Redis client.
+    :param conversation_ids: List of String conversation IDs.
+    :returns: List of the raw hash of deltas of each conversation.
+    """
+    async with redis.pipeline(transaction=True) as pipe:
+        for conversation_id in conversation_ids:
+            pipe.hgetall(f"{PENDING_KEY_PREFIX}{conversation_id}")
+            pipe.delete(f"{PENDING_KEY_PREFIX}{conversation_id}")
+        pipe_results = await pipe.execute()
+
+    return pipe_results[::2]
+
+
+async def _take_redis_deltas(
+    redis_pool: ConnectionPool,
+) -> Dict[str, Dict[str, int]]:
+    """
+    Take a batch of pending deltas out of Redis.
+
+    :param redis_pool: Redis connection pool.
+    :returns: Dict of conversation_id -> deltas.
+    """
+    async with Redis(connection_pool=redis_pool) as redis:
+        raw_conversation_ids = await redis.spop(
+            PENDING_SET_KEY,
+            settings.token_usage_flush_batch_size,
+        )
+        if not raw_conversation_ids:
+            return {}
+
+        conversation_ids = [
+            conversation_id.decode() for conversation_id in raw_conversation_ids
+        ]
+        raw_deltas = await _pop_raw_deltas(redis, conversation_ids)
+
+    return _decode_deltas(conversation_ids, raw_deltas)
+
+
+async def _take_pending_deltas() -> DefaultDict[str, Counter[str]]:
+    """
+    Take the pending deltas of this worker, and a batch of those in Redis.
+
+    :returns: Dict of conversation_id -> deltas.
+    """
+    pending_deltas = defaultdict(Counter, _pending_deltas)
+    _pending_deltas.clear()
+
+    redis_pool = token_usage_redis.redis_pool
+    if redis_pool is None:
+        return pending_deltas
+
+    try:
+        redis_deltas = await _take_redis_deltas(redis_pool)
+    except RedisError:
+        logger.exception("Failed to read pending token usage from Redis")
+        return pending_deltas
+
+    for conversation_id, deltas in redis_deltas.items():
+        pending_deltas[conversation_id].update(deltas)
+
+    return pending_deltas
+
+
+async def _apply_token_usage_batch(
+    deltas_to_flush: Mapping[str, Mapping[str, int]],
+) -> None:
+    """
+    Add the deltas of many conversations to the DB in one transaction.
+
+    :param deltas_to_flush: Mapping of conversation_id -> deltas.
+    """
+    async with in_transaction():
+        for conversation_id, deltas in deltas_to_flush.items():
+            await apply_token_usage(conversation_id, deltas)
+
+
+async def flush_token_usage() -> int:
+    """
+    Flush all pending token usage deltas to the DB in one transaction.
+
+    If the DB write fails the deltas are put back to be retried next time.
+
+    :returns: Int number of conversations flushed.
+    """
+    deltas_to_flush = await _take_pending_deltas()
+    if not deltas_to_flush:
+        return 0
+
+    try:
+        await _apply_token_usage_batch(deltas_to_flush)
+    except Exception:
+        logger.exception("Failed to flush token usage, will retry")
+        for conversation_id, deltas in deltas_to_flush.items():
+            _pending_deltas[conversation_id].update(deltas)
+        return 0
+
+    return len(deltas_to_flush)
@@ -0,0 +1,48 @@
+import asyncio
+
+from fastapi import FastAPI
+from loguru import logger
+
+from fia_api.services.token_usage.accounting import flush_token_usage, set_redis_pool
+from fia_api.settings import TokenUsageWriteBehind, settings
+
+
+async def run_token_usage_flusher() -> None:  # pragma: no cover
+    """Periodically flush pending token usage to the DB."""
+    while True:  # noqa: WPS457
+        await asyncio.sleep(settings.token_usage_flush_interval_seconds)
+
+        try:
+            await flush_token_usage()
+        except Exception:
+            logger.exception("Token usage flusher failed")
+
+
+def init_token_usage(app: FastAPI) -> None:  # pragma: no cover
+    """
+    Starts flushing pending token usage if write-behind is enabled.
+
+    Must run after the Redis pool is created.
+
+    :param app: current fastapi application.
+    """
+    set_redis_pool(app.state.redis_pool)
+    app.state.token_usage_flusher = None
+
+    if settings.token_usage_write_behind != TokenUsageWriteBehind.OFF:
+        app.state.token_usage_flusher = asyncio.create_task(
+            run_token_usage_flusher(),
+        )
+
+
+async def shutdown_token_usage(app: FastAPI) -> None:  # pragma: no cover
+    """
+    Stops the flusher and flushes anything still pending.
+
+    :param app: current FastAPI app.
+    """
+    if app.state.token_usage_flusher is not None:
+        app.state.token_usage_flusher.cancel()
+        await flush_token_usage()
+
+    set_redis_pool(None)
@@ -0,0 +1 @@
+"""Text-to-Speech service."""
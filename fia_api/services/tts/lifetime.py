@@ -0,0 +1,44 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import FastAPI
+from loguru import logger
+
+from fia_api.services.tts.synthesizer import (
+    create_text_to_speech_client,
+    set_tts_service,
+)
+from fia_api.settings import settings
+
+
+def init_tts(app: FastAPI) -> None:  # pragma: no cover
+    """
+    Creates the Text-to-Speech client and the thread pool it runs on.
+
+    If the client can't be created (e.g. there are no credentials), requests
+    fall back to creating one each, so the error is raised where audio is
+    requested rather than stopping the app.
+
+    :param app: current fastapi application.
+    """
+    app.state.tts_executor = ThreadPoolExecutor(
+        max_workers=settings.tts_max_concurrency,
+        thread_name_prefix="tts",
+    )
+
+    try:
+        tts_client = create_text_to_speech_client()
+    except Exception:
+        logger.exception("Failed to create the Text-to-Speech client")
+        tts_client = None
+
+    set_tts_service(tts_client, app.state.tts_executor)
+
+
+async def shutdown_tts(app: FastAPI) -> None:  # pragma: no cover
+    """
+    Stops the Text-to-Speech thread pool.
+
+    :param app: current FastAPI app.
+    """
+    set_tts_service(None, None)
+    app.state.tts_executor.shutdown(wait=False, cancel_futures=True)
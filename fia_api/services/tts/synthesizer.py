@@ -0,0 +1,114 @@
+"""
+Synthesis of speech with Google Text-to-Speech.
+
+The client is created once in the app lifespan (see
+fia_api.services.tts.lifetime) and shared by every request, so each request
+only pays for the synthesis call. The calls block, so they run on a dedicated
+thread pool, with at most settings.tts_max_concurrency at once.
+"""
+import asyncio
+import functools
+from concurrent.futures import Executor
+from typing import Optional
+
+from google.auth.credentials import AnonymousCredentials
+from google.cloud import texttospeech
+
+from fia_api.settings import settings
+
+
+class TTSService:
+    """
+    The client, thread pool and concurrency limit shared across all requests.
+
+    Set up in the app lifespan, see fia_api.services.tts.lifetime.
+    """
+
+    client: Optional[texttospeech.TextToSpeechClient] = None
+    executor: Optional[Executor] = None
+    semaphore: Optional[asyncio.Semaphore] = None
+
+
+tts_service = TTSService()
+
+
+def create_text_to_speech_client() -> texttospeech.TextToSpeechClient:
+    """
+    Create a Google Text-to-Speech client.
+
+    With settings.google_tts_api_endpoint set, the client talks REST to that
+    endpoint without credentials, e.g. to use a stand-in server.
+
+    :returns: TextToSpeechClient
+    """
+    if settings.google_tts_api_endpoint is not None:
+        return texttospeech.TextToSpeechClient(
+            credentials=AnonymousCredentials(),
+            transport="rest",
+            client_options={"api_endpoint": settings.google_tts_api_endpoint},
+        )
+
+    return texttospeech.TextToSpeechClient.from_service_account_file(
+        settings.google_cloud_api_key_path,
+    )
+
+
+def set_tts_service(
+    tts_client: Optional[texttospeech.TextToSpeechClient],
+    tts_executor: Optional[Executor],
+) -> None:
+    """
+    Set the client and thread pool used for all synthesis.
+
+    :param tts_client: The client to use, or None to create one per call.
+    :param tts_executor: The thread pool to synthesize on, or None to use the
+                         default one.
+    """
+    tts_service.client = tts_client
+    tts_service.executor = tts_executor
+    tts_service.semaphore = None
+
+
+def _get_tts_semaphore() -> asyncio.Semaphore:
+    """
+    Get the semaphore limiting how many synthesis calls run at once.
+
+    :returns: asyncio Semaphore of settings.tts_max_concurrency.
+    """
+    if tts_service.semaphore is None:
+        tts_service.semaphore = asyncio.Semaphore(settings.tts_max_concurrency)
+
+    return tts_service.semaphore
+
+
+async def synthesize_speech(
+    text: str,
+    voice: texttospeech.VoiceSelectionParams,
+    audio_config: texttospeech.AudioConfig,
+) -> bytes:
+    """
+    Convert text to audio.
+
+    If no client has been set up (e.g. in tests), one is created for the call.
+
+    :param text: String text to convert.
+    :param voice: VoiceSelectionParams to convert with.
+    :param audio_config: AudioConfig to convert with.
+    :returns: Bytes of the audio.
+    """
+    async with _get_tts_semaphore():
+        tts_client = tts_service.client
+        if tts_client is None:
+            tts_client = await asyncio.to_thread(create_text_to_speech_client)
+
+        response = await asyncio.get_running_loop().run_in_executor(
+            tts_service.executor,
+            functools.partial(
+                tts_client.synthesize_speech,
+                input=texttospeech.SynthesisInput(text=text),
+                voice=voice,
+                audio_config=audio_config,
+            ),
+        )
+
+    return response.audio_content
@@ -6,8 +6,9 @@
 import enum
 from pathlib import Path
 from tempfile import gettempdir
-from typing import Optional
+from typing import Dict, List, Optional
 
+from pydantic import BaseModel
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from yarl import URL
 
@@ -25,6 +26,23 @@ class LogLevel(str, enum.Enum):  # noqa: WPS600
     FATAL = "FATAL"
 
 
+class TokenUsageWriteBehind(str, enum.Enum):  # noqa: WPS600
+    """Where token usage is collected before being flushed to the DB."""
+
+    OFF = "off"
+    MEMORY = "memory"
+    REDIS = "redis"
+
+
+class LLMBackend(BaseModel):
+    """An OpenAI compatible model that LLM calls can be routed to."""
+
+    model: str
+    # Default to openai_api_base and openai_api_key.
+    api_base: Optional[str] = None
+    api_key: Optional[str] = None
+
+
 class Settings(BaseSettings):
     """
     Application settings.
@@ -66,7 +84,153 @@ class Settings(BaseSettings):
     jwt_refresh_secret_key: str = "jwt_refresh_secret_key"
 
     openai_api_key: str = "INVALID_OPENAI_API_KEY"
+    # Point at a stand-in server (see fia_api.benchmarks) to run offline.
+    openai_api_base: str = "https://api.openai.com/v1"
+    # Max concurrent connections in the pooled OpenAI HTTP session.
+    openai_max_connections: int = 100
+
+    # Every LLM attempt gets a deadline. Transient failures are retried with
+    # exponential backoff and jitter, and after llm_circuit_failure_threshold
+    # consecutive failures calls fail fast for llm_circuit_reset_seconds.
+    llm_deadline_seconds: float = 30.0
+    llm_max_retries: int = 2
+    llm_retry_backoff_seconds: float = 0.5
+    llm_retry_backoff_max_seconds: float = 8.0
+    llm_circuit_failure_threshold: int = 5
+    llm_circuit_reset_seconds: float = 30.0
+    # Send a second request if the first hasn't answered by the p95 latency
+    # (or the default delay until there are enough samples).
+    llm_hedging_enabled: bool = False
+    llm_hedge_min_samples: int = 20
+    llm_hedge_default_delay_seconds: float = 5.0
+
+    # Models LLM calls can be sent to, by name, e.g.
+    # FIA_API_LLM_BACKENDS='{"fast": {"model": "gpt-3.5-turbo"}, "strong": {"model": "gpt-4"}}'
+    llm_backends: Dict[str, LLMBackend] = {
+        "default": LLMBackend(model="gpt-3.5-turbo-0613"),
+    }
+    # Backends to try for each kind of call, most preferred first, e.g.
+    # FIA_API_LLM_ROUTES='{"learning_moments": ["fast", "strong"]}'. Kinds of
+    # call are learning_moments, batch_learning_moments,
+    # conversation_continuation, short_conversation_continuation (for user
+    # messages up to llm_short_message_characters long) and
+    # conversation_summary. Anything not listed uses the default route.
+    llm_routes: Dict[str, List[str]] = {"default": ["default"]}
+    llm_short_message_characters: int = 80
+    # A backend is skipped in favour of the next in its route while its
+    # circuit breaker is open, or its p95 latency over the last
+    # llm_latency_window_seconds is above llm_fallback_p95_seconds (once it has
+    # llm_fallback_min_samples calls in that window).
+    llm_fallback_p95_seconds: float = 10.0
+    llm_fallback_min_samples: int = 20
+    llm_latency_window_seconds: float = 300.0
+
+    # Fetch the learning moments and the conversation continuation
+    # concurrently instead of one after the other.
+    teacher_concurrent_pipeline: bool = True
+
+    # Collect token usage in memory/Redis and flush it to the DB in batches,
+    # rather than updating the DB after every OpenAI call.
+    token_usage_write_behind: TokenUsageWriteBehind = TokenUsageWriteBehind.OFF
+    token_usage_flush_interval_seconds: float = 5.0
+    token_usage_flush_batch_size: int = 500
+
+    # Token bucket per user and endpoint for the LLM backed endpoints, off by
+    # default. E.g. a capacity of 10 refilling at 0.2 allows bursts of 10
+    # requests and 12 a minute after that.
+    rate_limit_enabled: bool = False
+    rate_limit_bucket_capacity: int = 10
+    rate_limit_refill_per_second: float = 0.2
+    # LLM tokens each user may use per UTC day, 0 for no limit.
+    token_quota_daily_tokens: int = 0
+
+    # Share one in-flight LLM request between identical concurrent requests.
+    # The Redis lock also coalesces them across workers. It expires
+    # single_flight_lock_ttl_seconds after a worker dies, and is refreshed
+    # while the request runs.
+    single_flight_enabled: bool = True
+    single_flight_redis_enabled: bool = False
+    single_flight_lock_ttl_seconds: float = 30.0
+    single_flight_poll_interval_seconds: float = 0.05
+
+    # Persist learning moments and flashcards from a background worker
+    # (python -m fia_api.worker) instead of before replying.
+    task_queue_enabled: bool = False
+    task_queue_max_retries: int = 3
+    task_queue_retry_backoff_seconds: float = 1.0
+    task_queue_poll_timeout_seconds: int = 1
+    # A worker not seen for this long is presumed dead, and the tasks it was
+    # running are requeued when a worker starts.
+    task_queue_worker_timeout_seconds: int = 60
+
+    # The analyze-messages endpoint checks up to
+    # batch_learning_moments_max_messages messages (and
+    # batch_learning_moments_max_characters of them) per OpenAI call.
+    batch_learning_moments_max_messages: int = 20
+    batch_learning_moments_max_characters: int = 4000
+    batch_learning_moments_max_request_messages: int = 500
+
+    # Cache of LearningMoments for repeated messages.
+    learning_moments_cache_enabled: bool = True
+    learning_moments_cache_ttl_seconds: int = 60 * 60 * 24 * 7
+    learning_moments_cache_max_entries: int = 100000
+    learning_moments_cache_max_message_length: int = 200
+
+    # Keep conversation_opener_pool_size ready made greetings per language in
+    # Redis, refilled in the background every
+    # conversation_opener_refill_interval_seconds. A new conversation whose
+    # first message is at most conversation_opener_max_message_characters long
+    # (e.g. "Hallo!") is greeted from the pool, so only waits on its learning
+    # moments.
+    conversation_opener_pool_enabled: bool = False
+    conversation_opener_pool_size: int = 20
+    conversation_opener_max_message_characters: int = 40
+    conversation_opener_refill_interval_seconds: float = 10.0
+
+    # Cache of conversation histories passed to OpenAI.
+    conversation_history_cache_enabled: bool = True
+    conversation_history_cache_ttl_seconds: int = 60 * 60 * 24
+    # Max conversations each worker keeps in memory.
+    conversation_history_cache_max_local: int = 1000
+
+    # Once a conversation is estimated to go over the token budget, only the
+    # most recent turns are sent verbatim and older ones are summarized. The
+    # summary is regenerated every context_window_summary_interval_turns.
+    context_window_enabled: bool = True
+    context_window_token_budget: int = 2000
+    context_window_recent_turns: int = 4
+    context_window_summary_interval_turns: int = 5
+
+    # Audio uploads are transcribed from memory, so cap their size. Whisper
+    # rejects anything over 25MB anyway.
+    audio_upload_max_bytes: int = 25 * 1024 * 1024
+
+    # Synthesized audio is cached on disk in tts_cache_dir, evicting the least
+    # recently played files once they take up more than tts_cache_max_bytes.
+    # With tts_cache_redis_enabled it is also shared between servers through
+    # Redis.
+    tts_cache_enabled: bool = True
+    tts_cache_dir: Path = TEMP_DIR / "fia_api_tts_cache"
+    tts_cache_max_bytes: int = 512 * 1024 * 1024
+    tts_cache_redis_enabled: bool = False
+    tts_cache_redis_ttl_seconds: int = 60 * 60 * 24 * 7
+
     google_cloud_api_key_path: str = "INVALID_GOOGLE_CLOUD_API_KEY_PATH"
+    # e.g. http://127.0.0.1:8001 to use a stand-in server over REST, with no
+    # credentials.
+    google_tts_api_endpoint: Optional[str] = None
+    # Synthesis calls block, so run on a dedicated pool of this many threads,
+    # and at most this many run at once.
+    tts_max_concurrency: int = 16
+    # Synthesize each sentence separately, so audio of a long reply starts
+    # playing once its first sentence is ready. Up to tts_chunk_concurrency
+    # sentences of a reply are synthesized at once.
+    tts_sentence_chunking_enabled: bool = True
+    tts_chunk_concurrency: int = 4
+    # Synthesize the audio of each reply into the cache in the background, and
+    # return a handle to fetch it by, valid for tts_audio_handle_ttl_seconds.
+    tts_prewarm_enabled: bool = False
+    tts_audio_handle_ttl_seconds: int = 60 * 60
 
     get_learning_moments_prompt: str = """You are a {language} language teacher
     who works with native English speakers to help them learn to speak
@@ -86,6 +250,8 @@ class Settings(BaseSettings):
     6) Mistakes are only spelling and grammar related. Punctuation is not a mistake.
     7) The mistake and the corrected section will be used to create a flashcard, so ensure there is enough information in them to make sense."""
 
+    batch_learning_moments_prompt: str = """You will be given several messages as a JSON list, each with an id and a message. Check each message on its own, and give the learning moments of every message under its id. Give an empty list of learning moments for messages with no mistakes."""
+
     conversation_continuation_prompt: str = """You are a native {language} speaker named Fia and you are helping your friend learn {language}. You are light-hearted, happy, and friendly. You are helping your friend learn {language} through conversation in {language} with them. Only speak to them in {language}.
 
     You can respond in English in only two situations:
@@ -94,6 +260,10 @@ class Settings(BaseSettings):
 
     You should remember that this person is your friend and you should talk to them like they are your friend. Always continue the conversation with questions instead of ending the conversation. e.g. Ask them how their day was, what they plan to do for the weekend, etc. Don't ask if they would like to talk about anything else, instead, suggest a new topic to talk about."""
 
+    conversation_opener_prompt: str = """Your friend has just greeted you to start a new conversation. Greet them back warmly and ask them a question to get the conversation going. Keep it short, and don't mention anything they might have said."""
+
+    conversation_summary_prompt: str = """You summarize language learning conversations between a learner and their friend and teacher Fia. Given the summary so far (if any) and the next part of the conversation, write a short updated summary in English. Keep the topics discussed, facts the learner shared about themselves, and anything Fia promised to come back to. Do not list language mistakes."""
+
     @property
     def db_url(self) -> URL:
         """
@@ -0,0 +1,62 @@
+import pytest
+from httpx import AsyncClient
+
+from fia_api.benchmarks.load_test import EndpointResult, find_regressions
+from fia_api.benchmarks.stand_in import (
+    LatencyDistribution,
+    StandInConfig,
+    get_stand_in_app,
+)
+from fia_api.web.api.teacher.prompts import get_prompt_registry
+from fia_api.web.api.teacher.schema import LearningMoments
+
+
+@pytest.mark.anyio
+async def test_stand_in_chat_completion() -> None:
+    """Tests that the stand-in answers function calls with valid arguments."""
+    config = StandInConfig(
+        latency_distribution=LatencyDistribution.FIXED,
+        latency_median_ms=0,
+        prompt_tokens=10,
+    )
+
+    async with AsyncClient(
+        app=get_stand_in_app(config),
+        base_url="http://test",
+    ) as stand_in_client:
+        response = await stand_in_client.post(
+            "/v1/chat/completions",
+            json={
+                "model": "gpt-3.5-turbo-0613",
+                "messages": [{"role": "user", "content": "Hallo"}],
+                **get_prompt_registry().learning_moments.get_function_kwargs(),
+            },
+        )
+
+    completion = response.json()
+    function_call = completion["choices"][0]["message"]["function_call"]
+    assert LearningMoments.model_validate_json(function_call["arguments"])
+    assert completion["usage"]["prompt_tokens"] == 10
+
+
+def test_find_regressions() -> None:
+    """Tests that slower p95 latency and lower throughput are regressions."""
+    baseline = {
+        "converse": EndpointResult(
+            requests=100,
+            errors=0,
+            throughput_rps=10,
+            p50_ms=100,
+            p95_ms=200,
+            p99_ms=300,
+        ),
+    }
+    summary = {
+        "converse": baseline["converse"].model_copy(
+            update={"p95_ms": 260, "throughput_rps": 9},
+        ),
+    }
+
+    regressions = find_regressions(summary, baseline, 0.2)
+
+    assert regressions == ["converse p95 200ms -> 260ms"]
@@ -1,11 +1,49 @@
+import json
+import logging
+import os
+import time
 import uuid
+from contextlib import contextmanager
 from dataclasses import dataclass
-from typing import Dict, List
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Union
+from unittest.mock import MagicMock, patch
 
 import pytest
 from fastapi import FastAPI
 from httpx import AsyncClient
 from pytest_mock import MockerFixture
+from redis.asyncio import ConnectionPool, Redis
+
+from fia_api.db.models.conversation_model import (
+    ConversationElementModel,
+    ConversationElementRole,
+)
+from fia_api.db.models.conversation_summary_model import ConversationSummaryModel
+from fia_api.db.models.flashcard_model import FlashcardModel
+from fia_api.db.models.learning_moment_model import LearningMomentModel
+from fia_api.db.models.user_conversation_model import UserConversationModel
+from fia_api.db.models.user_model import UserModel
+from fia_api.services.llm.resilience import LLMUnavailableError
+from fia_api.services.task_queue.queue import process_next_task
+from fia_api.settings import settings
+from fia_api.web.api.teacher import tasks  # noqa: F401
+from fia_api.web.api.teacher.history_cache import (
+    append_conversation_history,
+    get_conversation_history,
+    get_history_key,
+    load_conversation_history,
+)
+from fia_api.web.api.teacher.opener_pool import (
+    claim_opener_pool_refill,
+    refill_opener_pools,
+)
+from fia_api.web.api.teacher.prompts import get_prompt_registry, language_code_map
+from fia_api.web.api.teacher.schema import LearningMoment, LearningMoments, Mistake
+from fia_api.web.api.teacher.streaming import stream_response
+from fia_api.web.api.teacher.utils import store_learning_moments
+from fia_api.web.api.user.utils import get_user_from_token
 
 
 @dataclass
@@ -21,7 +59,8 @@ class OpenAIAPIMessage:
     """Mock class for OpenAI Chat Completion."""
 
     role: str
-    function_call: OpenAIAPIFunctionCall
+    function_call: Optional[OpenAIAPIFunctionCall] = None
+    content: Optional[str] = None
 
 
 @dataclass
@@ -39,7 +78,32 @@ class OpenAIAPIResponse:
     usage: Dict[str, int]
 
 
-def get_mocked_openai_response(*args, **kwargs) -> OpenAIAPIResponse:  # type: ignore
+# A mocked OpenAI response. Streamed ones are an async iterator of chunks.
+MockedResponse = Union[OpenAIAPIResponse, AsyncIterator[Dict[str, Any]]]
+
+
+async def get_mocked_openai_stream() -> AsyncIterator[Dict[str, Any]]:
+    """
+    Yield the mocked chunks of a streamed OpenAI Chat Completion.
+
+    :yields: Dicts shaped like OpenAI stream chunks.
+    """
+    for token in ("Mir ", "geht ", "es ", "gut!"):
+        yield {"choices": [{"delta": {"content": token}}]}
+
+
+async def get_broken_openai_stream() -> AsyncIterator[Dict[str, Any]]:
+    """
+    Yield the first mocked chunk of a streamed OpenAI Chat Completion, then fail.
+
+    :raises RuntimeError: After the first chunk.
+    :yields: Dicts shaped like OpenAI stream chunks.
+    """
+    yield {"choices": [{"delta": {"content": "Mir "}}]}
+    raise RuntimeError("Upstream error")
+
+
+def get_mocked_openai_response(*args, **kwargs) -> MockedResponse:  # type: ignore
     """
     Return the mocked OpenAI API response based on the input.
 
@@ -84,12 +148,142 @@ def get_mocked_openai_response(*args, **kwargs) -> OpenAIAPIResponse:  # type: i
         },
     )
 
+    if kwargs.get("stream"):
+        return get_mocked_openai_stream()
+
+    if "functions" not in kwargs:
+        return OpenAIAPIResponse(
+            choices=[
+                OpenAIAPIChoices(
+                    message=OpenAIAPIMessage(
+                        role="assistant",
+                        content="They said hello.",
+                    ),
+                ),
+            ],
+            usage={
+                "prompt_tokens": 50,
+                "completion_tokens": 5,
+                "total_tokens": 55,
+            },
+        )
+
     if kwargs["functions"][0]["name"] == "get_learning_moments":
         return learning_moments_api_response
 
+    if kwargs["functions"][0]["name"] == "get_batch_learning_moments":
+        return get_mocked_batch_learning_moments_response(kwargs["messages"])
+
     return chat_continuation_api_response
 
 
+def get_mocked_batch_learning_moments_response(
+    messages: List[Dict[str, str]],
+) -> OpenAIAPIResponse:
+    """
+    Return a mocked batch learning moments response.
+
+    Every message containing "Geht's" has a mistake.
+
+    :param messages: The OpenAI messages sent.
+    :returns: OpenAIAPIReponse
+    """
+    batch = json.loads(messages[-1]["content"])
+    mistake = {
+        "moment": {
+            "incorrect_section": "Wie Geht's?",
+            "corrected_section": "Wie geht es dir?",
+            "explanation": "Only nouns are capitalised.",
+        },
+    }
+
+    return OpenAIAPIResponse(
+        choices=[
+            OpenAIAPIChoices(
+                message=OpenAIAPIMessage(
+                    role="assistant",
+                    function_call=OpenAIAPIFunctionCall(
+                        name="get_batch_learning_moments",
+                        arguments=json.dumps(
+                            {
+                                "messages": [
+                                    {
+                                        "id": batch_message["id"],
+                                        "learning_moments": (
+                                            [mistake]
+                                            if "Geht's" in batch_message["message"]
+                                            else []
+                                        ),
+                                    }
+                                    for batch_message in batch
+                                ],
+                            },
+                        ),
+                    ),
+                ),
+            ),
+        ],
+        usage={
+            "prompt_tokens": 300,
+            "completion_tokens": 100,
+            "total_tokens": 400,
+        },
+    )
+
+
+def get_failing_openai_response(*args, **kwargs) -> MockedResponse:  # type: ignore
+    """
+    Like get_mocked_openai_response, but the learning moments call fails.
+
+    :param args: All args passed to OpenAI
+    :param kwargs: All kwargs passed to OpenAI
+    :raises RuntimeError: For the learning moments call.
+    :returns: OpenAIAPIReponse
+    """
+    if kwargs["functions"][0]["name"] == "get_learning_moments":
+        raise RuntimeError("Upstream error")
+
+    return get_mocked_openai_response(*args, **kwargs)
+
+
+def get_mocked_speech(**kwargs: Any) -> SimpleNamespace:
+    """
+    Return mocked Text-to-Speech audio, which is the text in angle brackets.
+
+    :param kwargs: All kwargs passed to synthesize_speech.
+    :returns: Object shaped like a SynthesizeSpeechResponse.
+    """
+    return SimpleNamespace(audio_content=f"<{kwargs['input'].text}>".encode())
+
+
+def get_slow_first_sentence_speech(**kwargs: Any) -> SimpleNamespace:
+    """
+    Like get_mocked_speech, but "Hallo." is the slowest, so finishes last.
+
+    :param kwargs: All kwargs passed to synthesize_speech.
+    :returns: Object shaped like a SynthesizeSpeechResponse.
+    """
+    if kwargs["input"].text == "Hallo.":
+        time.sleep(0.05)
+
+    return get_mocked_speech(**kwargs)
+
+
+def get_last_continuation_messages(mocked_create: MagicMock) -> List[Dict[str, str]]:
+    """
+    Get the messages of the last conversation continuation sent to OpenAI.
+
+    :param mocked_create: The mocked OpenAI Chat Completion create.
+    :returns: List of OpenAI messages.
+    """
+    continuation_calls = [
+        call
+        for call in mocked_create.call_args_list
+        if call.kwargs["functions"][0]["name"] == "get_conversation_response"
+    ]
+    return continuation_calls[-1].kwargs["messages"]
+
+
 async def get_access_token(
     fastapi_app: FastAPI,
     client: AsyncClient,
@@ -170,7 +364,7 @@ async def test_conversations(
 
     # Begin conversation:
     mocker.patch(
-        "fia_api.web.api.teacher.utils.openai.ChatCompletion.create",
+        "fia_api.services.llm.gateway.openai.ChatCompletion.acreate",
         side_effect=get_mocked_openai_response,
     )
     response = await client.post(
@@ -236,3 +430,1201 @@ async def test_conversations(
         headers=auth_headers,
     )
     assert len(response.json()["flashcards"]) == 4
+
+
+@pytest.mark.anyio
+async def test_failed_learning_moments_keep_reply(
+    fastapi_app: FastAPI,
+    client: AsyncClient,
+    mocker: MockerFixture,
+) -> None:
+    """
+    Tests that a failing learning moments call still returns the reply.
+
+    :param fastapi_app: current application.
+    :param client: client for the app.
+    :param mocker: Automatically supplied by pytest to mock objects.
+    """
+    access_token = await get_access_token(fastapi_app, client)
+    auth_headers = {
+        "Authorization": f"Bearer {access_token}",
+    }
+
+    mocker.patch(
+        "fia_api.services.llm.gateway.openai.ChatCompletion.acreate",
+        side_effect=get_failing_openai_response,
+    )
+    response = await client.post(
+        fastapi_app.url_path_for("converse"),
+        headers=auth_headers,
+        json={
+            "conversation_id": "new",
+            "message": "Hallo, Wie Geht's?",
+        },
+    )
+
+    assert response.status_code == 200
+    assert not response.json()["learning_moments"]["learning_moments"]
+    assert response.json()["conversation_response"]
+
+
+@pytest.mark.anyio
+async def test_converse_stream(
+    fastapi_app: FastAPI,
+    client: AsyncClient,
+    mocker: MockerFixture,
+) -> None:
+    """
+    Tests that the streaming converse route sends tokens and stores the reply.
+
+    :param fastapi_app: current application.
+    :param client: client for the app.
+    :param mocker: Automatically supplied by pytest to mock objects.
+    """
+    access_token = await get_access_token(fastapi_app, client)
+    auth_headers = {
+        "Authorization": f"Bearer {access_token}",
+    }
+
+    mocker.patch(
+        "fia_api.services.llm.gateway.openai.ChatCompletion.acreate",
+        side_effect=get_mocked_openai_response,
+    )
+    response = await client.post(
+        fastapi_app.url_path_for("converse_stream"),
+        headers=auth_headers,
+        json={
+            "conversation_id": "new",
+            "message": "Hallo, Wie Geht's?",
+        },
+    )
+
+    assert response.headers["content-type"].startswith("text/event-stream")
+
+    events = []
+    for raw_event in response.text.strip().split("\n\n"):
+        event_line, data_line = raw_event.split("\n")
+        events.append(
+            (
+                event_line.removeprefix("event: "),
+                json.loads(data_line.removeprefix("data: ")),
+            ),
+        )
+
+    tokens = [data["token"] for event, data in events if event == "token"]
+    assert "".join(tokens) == "Mir geht es gut!"
+
+    event_names = [event for event, _ in events]
+    assert event_names.count("learning_moments") == 1
+    assert event_names[-1] == "done"
+
+    done = events[-1][1]
+    assert done["conversation_response"] == "Mir geht es gut!"
+    assert done["learning_moments"]["learning_moments"]
+
+    # The streamed reply was stored:
+    response = await client.get(
+        fastapi_app.url_path_for("get_user_conversation"),
+        headers=auth_headers,
+        params={
+            "conversation_id": done["conversation_id"],
+        },
+    )
+    assert response.json()["conversation"][-1]["message"] == "Mir geht es gut!"
+
+
+def get_broken_stream_response(*args, **kwargs) -> MockedResponse:  # type: ignore
+    """
+    Like get_mocked_openai_response, but the streamed reply fails part way.
+
+    :param args: All args passed to OpenAI
+    :param kwargs: All kwargs passed to OpenAI
+    :returns: OpenAIAPIReponse
+    """
+    if kwargs.get("stream"):
+        return get_broken_openai_stream()
+
+    return get_mocked_openai_response(*args, **kwargs)
+
+
+async def get_conversation_elements(user: UserModel) -> List[ConversationElementModel]:
+    """
+    Get the messages in a user's only conversation.
+
+    :param user: UserModel the conversation is with.
+    :returns: List of ConversationElementModel, oldest first.
+    """
+    user_conversation = await UserConversationModel.get(user=user)
+
+    return await ConversationElementModel.filter(
+        conversation_id=user_conversation.conversation_id,
+    )
+
+
+@pytest.mark.anyio
+async def test_converse_stream_failure(
+    fastapi_app: FastAPI,
+    client: AsyncClient,
+    mocker: MockerFixture,
+) -> None:
+    """
+    Tests that a reply failing part way ends with an error and is still stored.
+
+    :param fastapi_app: current application.
+    :param client: client for the app.
+    :param mocker: Automatically supplied by pytest to mock objects.
+    """
+    access_token = await get_access_token(fastapi_app, client)
+    mocker.patch(
+        "fia_api.services.llm.gateway.openai.ChatCompletion.acreate",
+        side_effect=get_broken_stream_response,
+    )
+
+    response = await client.post(
+        fastapi_app.url_path_for("converse_stream"),
+        headers={"Authorization": f"Bearer {access_token}"},
+        json={"conversation_id": "new", "message": "Hallo, Wie Geht's?"},
+    )
+
+    assert response.text.strip().split("\n\n")[-1].startswith("event: error")
+    conversation_elements = await get_conversation_elements(
+        await get_user_from_token(access_token),
+    )
+    assert [
+        (conversation_element.role, conversation_element.content)
+        for conversation_element in conversation_elements[1:]
+    ] == [
+        (ConversationElementRole.USER, "Hallo, Wie Geht's?"),
+        (ConversationElementRole.SYSTEM, "Mir "),
+    ]
+
+
+@pytest.mark.anyio
+async def test_converse_stream_disconnect(
+    fastapi_app: FastAPI,
+    client: AsyncClient,
+    mocker: MockerFixture,
+) -> None:
+    """
+    Tests that the reply is stored if the client disconnects part way.
+
+    :param fastapi_app: current application.
+    :param client: client for the app.
+    :param mocker: Automatically supplied by pytest to mock objects.
+    """
+    user = await get_user_from_token(await get_access_token(fastapi_app, client))
+    mocker.patch(
+        "fia_api.services.llm.gateway.openai.ChatCompletion.acreate",
+        side_effect=get_mocked_openai_response,
+    )
+
+    sse_events = stream_response("new", "Hallo, Wie Geht's?", user)
+    assert (await anext(sse_events)).startswith("event: token")
+    await sse_events.aclose()
+
+    conversation_elements = await get_conversation_elements(user)
+    assert [
+        (conversation_element.role, conversation_element.content)
+        for conversation_element in conversation_elements[1:]
+    ] == [
+        (ConversationElementRole.USER, "Hallo, Wie Geht's?"),
+        (ConversationElementRole.SYSTEM, "Mir "),
+    ]
+
+
+@pytest.mark.anyio
+async def test_learning_moments_cache(
+    fastapi_app: FastAPI,
+    client: AsyncClient,
+    mocker: MockerFixture,
+) -> None:
+    """
+    Tests that repeated messages get their learning moments from the cache.
+
+    :param fastapi_app: current application.
+    :param client: client for the app.
+    :param mocker: Automatically supplied by pytest to mock objects.
+    """
+    access_token = await get_access_token(fastapi_app, client)
+    auth_headers = {
+        "Authorization": f"Bearer {access_token}",
+    }
+
+    mocked_create = mocker.patch(
+        "fia_api.services.llm.gateway.openai.ChatCompletion.acreate",
+        side_effect=get_mocked_openai_response,
+    )
+
+    # Only differing in whitespace, so should share a cache entry.
+    for message in ("Hallo, Wie Geht's?", "Hallo,  Wie Geht's? "):
+        response = await client.post(
+            fastapi_app.url_path_for("converse"),
+            headers=auth_headers,
+            json={
+                "conversation_id": "new",
+                "message": message,
+            },
+        )
+        assert response.json()["learning_moments"]["learning_moments"]
+
+    learning_moments_calls = [
+        call
+        for call in mocked_create.call_args_list
+        if call.kwargs["functions"][0]["name"] == "get_learning_moments"
+    ]
+    assert len(learning_moments_calls) == 1
+
+    response = await client.get(
+        fastapi_app.url_path_for("learning_moments_cache_stats"),
+        headers=auth_headers,
+    )
+    assert response.json()["hits"] == 1
+    assert response.json()["misses"] == 1
+    assert response.json()["entries"] == 1
+    assert response.json()["saved_prompt_tokens"] == 181
+
+
+@pytest.mark.anyio
+async def test_conversation_history_cache(
+    fastapi_app: FastAPI,
+    client: AsyncClient,
+    fake_redis_pool: ConnectionPool,
+    mocker: MockerFixture,
+) -> None:
+    """
+    Tests that the history sent to OpenAI is right whether cached or not.
+
+    :param fastapi_app: current application.
+    :param client: client for the app.
+    :param fake_redis_pool: fake redis pool.
+    :param mocker: Automatically supplied by pytest to mock objects.
+    """
+    access_token = await get_access_token(fastapi_app, client)
+    auth_headers = {
+        "Authorization": f"Bearer {access_token}",
+    }
+    converse_url = fastapi_app.url_path_for("converse")
+
+    mocked_create = mocker.patch(
+        "fia_api.services.llm.gateway.openai.ChatCompletion.acreate",
+        side_effect=get_mocked_openai_response,
+    )
+
+    response = await client.post(
+        converse_url,
+        headers=auth_headers,
+        json={"conversation_id": "new", "message": "Hallo"},
+    )
+    conversation_id = response.json()["conversation_id"]
+    assert [msg["role"] for msg in get_last_continuation_messages(mocked_create)] == [
+        "system",
+        "user",
+    ]
+
+    await client.post(
+        converse_url,
+        headers=auth_headers,
+        json={"conversation_id": conversation_id, "message": "Wie geht's?"},
+    )
+    cached_messages = get_last_continuation_messages(mocked_create)
+    assert len(cached_messages) == 4
+    assert cached_messages[-1] == {"role": "user", "content": "Wie geht's?"}
+
+    # Losing the cached history rebuilds it from the DB:
+    async with Redis(connection_pool=fake_redis_pool) as redis:
+        await redis.delete(f"conversation_history:{conversation_id}")
+
+    await client.post(
+        converse_url,
+        headers=auth_headers,
+        json={"conversation_id": conversation_id, "message": "Gut"},
+    )
+    assert get_last_continuation_messages(mocked_create) == cached_messages + [
+        {"role": "system", "content": "Mir geht es gut, danke!  Wie geht es dir?"},
+        {"role": "user", "content": "Gut"},
+    ]
+
+
+@pytest.mark.anyio
+async def test_history_rebuild_during_append(
+    fastapi_app: FastAPI,
+    fake_redis_pool: ConnectionPool,
+    mocker: MockerFixture,
+) -> None:
+    """
+    Tests that a history appended to while it is rebuilt isn't cached.
+
+    :param fastapi_app: current application.
+    :param fake_redis_pool: fake redis pool.
+    :param mocker: Automatically supplied by pytest to mock objects.
+    """
+    conversation_id = str(uuid.uuid4())
+    await ConversationElementModel.create(
+        conversation_id=conversation_id,
+        role=ConversationElementRole.SYSTEM,
+        content="Prompt",
+    )
+
+    async def _load_during_append(  # noqa: WPS430
+        loaded_conversation_id: str,
+    ) -> List[Dict[str, str]]:
+        messages = await load_conversation_history(loaded_conversation_id)
+        # Another request stores a message after it was loaded.
+        await append_conversation_history(
+            fake_redis_pool,
+            loaded_conversation_id,
+            {"role": "user", "content": "Hallo"},
+        )
+        return messages
+
+    mocker.patch(
+        "fia_api.web.api.teacher.history_cache.load_conversation_history",
+        side_effect=_load_during_append,
+    )
+
+    assert await get_conversation_history(fake_redis_pool, conversation_id) == [
+        {"role": "system", "content": "Prompt"},
+    ]
+    async with Redis(connection_pool=fake_redis_pool) as redis:
+        assert not await redis.exists(get_history_key(conversation_id))
+
+
+@pytest.mark.anyio
+async def test_context_window_summary(
+    fastapi_app: FastAPI,
+    client: AsyncClient,
+    mocker: MockerFixture,
+) -> None:
+    """
+    Tests that long conversations send a summary instead of older turns.
+
+    :param fastapi_app: current application.
+    :param client: client for the app.
+    :param mocker: Automatically supplied by pytest to mock objects.
+    """
+    access_token = await get_access_token(fastapi_app, client)
+    auth_headers = {
+        "Authorization": f"Bearer {access_token}",
+    }
+    converse_url = fastapi_app.url_path_for("converse")
+
+    mocker.patch.object(settings, "context_window_token_budget", 0)
+    mocker.patch.object(settings, "context_window_recent_turns", 1)
+    mocker.patch.object(settings, "context_window_summary_interval_turns", 2)
+    mocked_create = mocker.patch(
+        "fia_api.services.llm.gateway.openai.ChatCompletion.acreate",
+        side_effect=get_mocked_openai_response,
+    )
+
+    conversation_id = "new"
+    for message in ("Eins", "Zwei", "Drei", "Vier", "Funf"):
+        response = await client.post(
+            converse_url,
+            headers=auth_headers,
+            json={"conversation_id": conversation_id, "message": message},
+        )
+        conversation_id = response.json()["conversation_id"]
+
+    continuation_calls = [
+        call.kwargs["messages"]
+        for call in mocked_create.call_args_list
+        if call.kwargs.get("functions", [{}])[0].get("name")
+        == "get_conversation_response"
+    ]
+    summary_calls = [
+        call for call in mocked_create.call_args_list if "functions" not in call.kwargs
+    ]
+
+    # Summarized on the third turn, then again two turns later.
+    assert len(summary_calls) == 2
+    last_messages = continuation_calls[-1]
+    assert last_messages[1]["content"].endswith("They said hello.")
+    assert last_messages[-1]["content"] == "Funf"
+    assert len(last_messages) == 5
+
+    response = await client.get(
+        fastapi_app.url_path_for("get_token_usage"),
+        headers=auth_headers,
+        params={"conversation_id": conversation_id},
+    )
+    assert response.json()["saved_prompt_token_usage"] > 0
+
+
+@pytest.mark.anyio
+async def test_context_window_summary_failure(
+    fastapi_app: FastAPI,
+    client: AsyncClient,
+    mocker: MockerFixture,
+) -> None:
+    """
+    Tests that a failed summary falls back to the recent turns, not an error.
+
+    :param fastapi_app: current application.
+    :param client: client for the app.
+    :param mocker: Automatically supplied by pytest to mock objects.
+    """
+    access_token = await get_access_token(fastapi_app, client)
+    auth_headers = {
+        "Authorization": f"Bearer {access_token}",
+    }
+    converse_url = fastapi_app.url_path_for("converse")
+
+    mocker.patch.object(settings, "context_window_token_budget", 0)
+    mocker.patch.object(settings, "context_window_recent_turns", 1)
+    mocker.patch(
+        "fia_api.web.api.teacher.context_window.summarize_messages",
+        side_effect=LLMUnavailableError("LLM circuit breaker is open"),
+    )
+    mocked_create = mocker.patch(
+        "fia_api.services.llm.gateway.openai.ChatCompletion.acreate",
+        side_effect=get_mocked_openai_response,
+    )
+
+    conversation_id = "new"
+    for message in ("Eins", "Zwei", "Drei"):
+        response = await client.post(
+            converse_url,
+            headers=auth_headers,
+            json={"conversation_id": conversation_id, "message": message},
+        )
+        assert response.status_code == 200
+        conversation_id = response.json()["conversation_id"]
+
+    last_messages = mocked_create.call_args_list[-1].kwargs["messages"]
+    # The initial prompt, the previous turn and the latest message.
+    assert len(last_messages) == 4
+    assert last_messages[-1]["content"] == "Drei"
+    assert not await ConversationSummaryModel.exists(
+        conversation_id=conversation_id,
+    )
+
+
+@pytest.mark.anyio
+async def test_prompt_version_stored(
+    fastapi_app: FastAPI,
+    client: AsyncClient,
+    mocker: MockerFixture,
+) -> None:
+    """
+    Tests that conversations store the version of the prompt they started with.
+
+    :param fastapi_app: current application.
+    :param client: client for the app.
+    :param mocker: Automatically supplied by pytest to mock objects.
+    """
+    access_token = await get_access_token(fastapi_app, client)
+    mocked_create = mocker.patch(
+        "fia_api.services.llm.gateway.openai.ChatCompletion.acreate",
+        side_effect=get_mocked_openai_response,
+    )
+
+    response = await client.post(
+        fastapi_app.url_path_for("converse"),
+        headers={"Authorization": f"Bearer {access_token}"},
+        json={"conversation_id": "new", "message": "Hallo"},
+    )
+
+    prompt_registry = get_prompt_registry()
+    user_conversation = await UserConversationModel.get(
+        conversation_id=response.json()["conversation_id"],
+    )
+    assert (
+        user_conversation.prompt_version
+        == prompt_registry.conversation_continuation.version
+    )
+    assert any(
+        call.kwargs["functions"][0] == prompt_registry.learning_moments.function
+        for call in mocked_create.call_args_list
+    )
+
+
+@pytest.mark.anyio
+async def test_learning_moments_persisted_by_worker(
+    fastapi_app: FastAPI,
+    client: AsyncClient,
+    fake_redis_pool: ConnectionPool,
+    mocker: MockerFixture,
+) -> None:
+    """
+    Tests that with the task queue, learning moments are stored by the worker.
+
+    :param fastapi_app: current application.
+    :param client: client for the app.
+    :param fake_redis_pool: fake redis pool.
+    :param mocker: Automatically supplied by pytest to mock objects.
+    """
+    mocker.patch.object(settings, "task_queue_enabled", new=True)
+    access_token = await get_access_token(fastapi_app, client)
+    mocker.patch(
+        "fia_api.services.llm.gateway.openai.ChatCompletion.acreate",
+        side_effect=get_mocked_openai_response,
+    )
+
+    response = await client.post(
+        fastapi_app.url_path_for("converse"),
+        headers={"Authorization": f"Bearer {access_token}"},
+        json={"conversation_id": "new", "message": "Hallo, Wie Geht's?"},
+    )
+    assert response.json()["learning_moments"]["learning_moments"]
+    assert not await LearningMomentModel.all().count()
+    assert not await FlashcardModel.all().count()
+
+    assert await process_next_task(fake_redis_pool, 1)
+
+    assert await LearningMomentModel.all().count()
+    assert await FlashcardModel.all().count()
+
+
+@pytest.mark.anyio
+async def test_task_queue_retry(
+    fastapi_app: FastAPI,
+    client: AsyncClient,
+    fake_redis_pool: ConnectionPool,
+    mocker: MockerFixture,
+) -> None:
+    """
+    Tests that retrying a failed persist task doesn't store its moments twice.
+
+    :param fastapi_app: current application.
+    :param client: client for the app.
+    :param fake_redis_pool: fake redis pool.
+    :param mocker: Automatically supplied by pytest to mock objects.
+    """
+    mocker.patch.object(settings, "task_queue_enabled", new=True)
+    mocker.patch.object(settings, "task_queue_retry_backoff_seconds", 0)
+    access_token = await get_access_token(fastapi_app, client)
+    mocker.patch(
+        "fia_api.services.llm.gateway.openai.ChatCompletion.acreate",
+        side_effect=get_mocked_openai_response,
+    )
+
+    await client.post(
+        fastapi_app.url_path_for("converse"),
+        headers={"Authorization": f"Bearer {access_token}"},
+        json={"conversation_id": "new", "message": "Hallo, Wie Geht's?"},
+    )
+
+    with patch(
+        "fia_api.web.api.teacher.utils.bulk_create_flashcards",
+        side_effect=RuntimeError("DB error"),
+    ):
+        assert await process_next_task(fake_redis_pool, 1)
+
+    assert not await LearningMomentModel.all().count()
+
+    assert await process_next_task(fake_redis_pool, 1)
+
+    assert await LearningMomentModel.all().count() == 2
+    assert await FlashcardModel.all().count() == 2
+
+
+@pytest.mark.anyio
+async def test_rate_limit(
+    fastapi_app: FastAPI,
+    client: AsyncClient,
+    mocker: MockerFixture,
+) -> None:
+    """
+    Tests that requests over the rate limit are rejected before any LLM work.
+
+    :param fastapi_app: current application.
+    :param client: client for the app.
+    :param mocker: Automatically supplied by pytest to mock objects.
+    """
+    mocker.patch.object(settings, "rate_limit_enabled", new=True)
+    mocker.patch.object(settings, "rate_limit_bucket_capacity", 1)
+    mocker.patch.object(settings, "rate_limit_refill_per_second", 0.01)
+    access_token = await get_access_token(fastapi_app, client)
+    mocked_create = mocker.patch(
+        "fia_api.services.llm.gateway.openai.ChatCompletion.acreate",
+        side_effect=get_mocked_openai_response,
+    )
+
+    responses = [
+        await client.post(
+            fastapi_app.url_path_for("converse"),
+            headers={"Authorization": f"Bearer {access_token}"},
+            json={"conversation_id": "new", "message": "Hallo"},
+        )
+        for _ in range(2)
+    ]
+
+    assert responses[0].status_code == 200
+    assert responses[1].status_code == 429
+    assert int(responses[1].headers["Retry-After"]) == 100
+    assert mocked_create.call_count == 2
+
+
+@pytest.mark.anyio
+async def test_daily_token_quota(
+    fastapi_app: FastAPI,
+    client: AsyncClient,
+    mocker: MockerFixture,
+) -> None:
+    """
+    Tests that users are stopped once they've used their tokens for the day.
+
+    :param fastapi_app: current application.
+    :param client: client for the app.
+    :param mocker: Automatically supplied by pytest to mock objects.
+    """
+    mocker.patch.object(settings, "token_quota_daily_tokens", 500)
+    access_token = await get_access_token(fastapi_app, client)
+    mocker.patch(
+        "fia_api.services.llm.gateway.openai.ChatCompletion.acreate",
+        side_effect=get_mocked_openai_response,
+    )
+
+    # Each converse uses 2 * (181 + 114) tokens.
+    responses = [
+        await client.post(
+            fastapi_app.url_path_for("converse"),
+            headers={"Authorization": f"Bearer {access_token}"},
+            json={"conversation_id": "new", "message": "Hallo"},
+        )
+        for _ in range(2)
+    ]
+
+    assert responses[0].status_code == 200
+    assert responses[1].status_code == 429
+    retry_after = int(responses[1].headers["Retry-After"])
+    assert retry_after <= 60 * 60 * 24
+
+
+@pytest.mark.anyio
+async def test_analyze_messages(
+    fastapi_app: FastAPI,
+    client: AsyncClient,
+    mocker: MockerFixture,
+) -> None:
+    """
+    Tests that many messages are checked in batches and split back out.
+
+    :param fastapi_app: current application.
+    :param client: client for the app.
+    :param mocker: Automatically supplied by pytest to mock objects.
+    """
+    mocker.patch.object(settings, "batch_learning_moments_max_messages", 2)
+    access_token = await get_access_token(fastapi_app, client)
+    mocked_create = mocker.patch(
+        "fia_api.services.llm.gateway.openai.ChatCompletion.acreate",
+        side_effect=get_mocked_openai_response,
+    )
+
+    messages = ["Hallo", "Wie Geht's?", "Tschüss", "Na, wie Geht's?", "Gut"]
+    response = await client.post(
+        fastapi_app.url_path_for("analyze_messages"),
+        headers={"Authorization": f"Bearer {access_token}"},
+        json={
+            "conversation_id": "new",
+            "messages": [
+                {"id": f"message-{index}", "message": message}
+                for index, message in enumerate(messages)
+            ],
+        },
+    )
+
+    assert mocked_create.call_count == 3
+    analyzed_messages = response.json()["messages"]
+    assert [analyzed["id"] for analyzed in analyzed_messages] == [
+        f"message-{index}" for index in range(len(messages))
+    ]
+    assert [
+        len(analyzed["learning_moments"]["learning_moments"])
+        for analyzed in analyzed_messages
+    ] == [0, 1, 0, 1, 0]
+    assert await FlashcardModel.all().count() == 2
+
+
+def get_failing_batch_response(*args, **kwargs) -> MockedResponse:  # type: ignore
+    """
+    Like get_mocked_openai_response, but batches containing "Tschüss" fail.
+
+    :param args: All args passed to OpenAI
+    :param kwargs: All kwargs passed to OpenAI
+    :raises LLMUnavailableError: For batches containing "Tschüss".
+    :returns: OpenAIAPIReponse
+    """
+    if "Tschüss" in kwargs["messages"][-1]["content"]:
+        raise LLMUnavailableError("Upstream error")
+
+    return get_mocked_openai_response(*args, **kwargs)
+
+
+@pytest.mark.anyio
+async def test_analyze_messages_batch_failure(
+    fastapi_app: FastAPI,
+    client: AsyncClient,
+    mocker: MockerFixture,
+) -> None:
+    """
+    Tests that one failed batch doesn't lose the others' learning moments.
+
+    :param fastapi_app: current application.
+    :param client: client for the app.
+    :param mocker: Automatically supplied by pytest to mock objects.
+    """
+    mocker.patch.object(settings, "batch_learning_moments_max_messages", 2)
+    access_token = await get_access_token(fastapi_app, client)
+    mocker.patch(
+        "fia_api.services.llm.gateway.openai.ChatCompletion.acreate",
+        side_effect=get_failing_batch_response,
+    )
+
+    messages = ["Hallo", "Wie Geht's?", "Tschüss", "Na, wie Geht's?", "Gut"]
+    response = await client.post(
+        fastapi_app.url_path_for("analyze_messages"),
+        headers={"Authorization": f"Bearer {access_token}"},
+        json={
+            "conversation_id": "new",
+            "messages": [
+                {"id": f"message-{index}", "message": message}
+                for index, message in enumerate(messages)
+            ],
+        },
+    )
+
+    assert response.status_code == 200
+    assert [
+        len(analyzed["learning_moments"]["learning_moments"])
+        for analyzed in response.json()["messages"]
+    ] == [0, 1, 0, 0, 0]
+    assert await FlashcardModel.all().count() == 1
+
+
+class QueryCounter(logging.Handler):
+    """Counts the queries Tortoise sends to the DB."""
+
+    def __init__(self) -> None:
+        super().__init__(level=logging.DEBUG)
+        self.queries: List[str] = []
+
+    def emit(self, record: logging.LogRecord) -> None:
+        """
+        Count a logged query.
+
+        :param record: LogRecord of the query.
+        """
+        self.queries.append(record.getMessage())
+
+
+@contextmanager
+def count_queries(query_counter: QueryCounter) -> Iterator[None]:
+    """
+    Count the queries Tortoise sends to the DB within the block.
+
+    :param query_counter: QueryCounter to count the queries with.
+    :yields: Nothing, once the counter is listening.
+    """
+    db_client_logger = logging.getLogger("tortoise.db_client")
+    original_level = db_client_logger.level
+    db_client_logger.setLevel(logging.DEBUG)
+    db_client_logger.addHandler(query_counter)
+
+    try:
+        yield
+    finally:
+        db_client_logger.removeHandler(query_counter)
+        db_client_logger.setLevel(original_level)
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("moment_count", [1, 5])
+async def test_store_learning_moments(fastapi_app: FastAPI, moment_count: int) -> None:
+    """
+    Tests that learning moments are stored and linked in a fixed number of queries.
+
+    :param fastapi_app: current application.
+    :param moment_count: number of learning moments to store.
+    """
+    conversation_element = await ConversationElementModel.create(
+        conversation_id=uuid.uuid4(),
+        role=ConversationElementRole.USER,
+        content="Ich habe ein Hund. Wie Geht's?",
+    )
+    learning_moments = LearningMoments(
+        learning_moments=[
+            LearningMoment(
+                moment=Mistake(
+                    incorrect_section=f"Mistake {index}",
+                    corrected_section=f"Correction {index}",
+                    explanation="Explanation.",
+                ),
+            )
+            for index in range(moment_count)
+        ],
+    )
+
+    query_counter = QueryCounter()
+    with count_queries(query_counter):
+        await store_learning_moments(conversation_element, learning_moments)
+
+    # An insert of the moments, then a select and an insert to link them, all
+    # in one transaction.
+    assert len(query_counter.queries) == 3, query_counter.queries
+
+    stored_learning_moments = await conversation_element.learning_moments.all()
+    assert sorted(
+        LearningMoment.model_validate(
+            learning_moment_model.learning_moment,
+        ).moment.incorrect_section
+        for learning_moment_model in stored_learning_moments
+    ) == [f"Mistake {index}" for index in range(moment_count)]
+
+
+@pytest.mark.anyio
+async def test_new_conversation_query_count(
+    fastapi_app: FastAPI,
+    client: AsyncClient,
+    mocker: MockerFixture,
+) -> None:
+    """
+    Tests that starting a conversation only takes a handful of queries.
+
+    :param fastapi_app: current application.
+    :param client: client for the app.
+    :param mocker: Automatically supplied by pytest to mock objects.
+    """
+    access_token = await get_access_token(fastapi_app, client)
+    mocker.patch(
+        "fia_api.services.llm.gateway.openai.ChatCompletion.acreate",
+        side_effect=get_mocked_openai_response,
+    )
+
+    query_counter = QueryCounter()
+    with count_queries(query_counter):
+        response = await client.post(
+            fastapi_app.url_path_for("converse"),
+            headers={"Authorization": f"Bearer {access_token}"},
+            json={"conversation_id": "new", "message": "Hallo, Wie Geht's?"},
+        )
+
+    assert response.status_code == 200
+    # 1 to fetch the user with their details, 3 to create the conversation (its
+    # initial prompt, user mapping and token usage), 2 to store the message and
+    # reply, 2 to add the token usage of each OpenAI call, and 4 for the 2
+    # learning moments (an insert, a select and an insert to link them, and an
+    # insert of their flashcards).
+    assert len(query_counter.queries) == 12, query_counter.queries
+
+
+@pytest.mark.anyio
+async def test_conversation_opener_pool(
+    fastapi_app: FastAPI,
+    client: AsyncClient,
+    fake_redis_pool: ConnectionPool,
+    mocker: MockerFixture,
+) -> None:
+    """
+    Tests that new conversations starting with a greeting use the opener pool.
+
+    :param fastapi_app: current application.
+    :param client: client for the app.
+    :param fake_redis_pool: fake redis pool.
+    :param mocker: Automatically supplied by pytest to mock objects.
+    """
+    mocker.patch.object(settings, "conversation_opener_pool_enabled", new=True)
+    mocker.patch.object(settings, "conversation_opener_pool_size", 2)
+    access_token = await get_access_token(fastapi_app, client)
+    mocked_create = mocker.patch(
+        "fia_api.services.llm.gateway.openai.ChatCompletion.acreate",
+        side_effect=get_mocked_openai_response,
+    )
+
+    # Only one worker claims each refill.
+    assert await claim_opener_pool_refill(fake_redis_pool)
+    assert not await claim_opener_pool_refill(fake_redis_pool)
+    assert await refill_opener_pools(fake_redis_pool) == 2 * len(language_code_map)
+    assert not await refill_opener_pools(fake_redis_pool)
+    mocked_create.reset_mock()
+
+    response = await client.post(
+        fastapi_app.url_path_for("converse"),
+        headers={"Authorization": f"Bearer {access_token}"},
+        json={"conversation_id": "new", "message": "Hallo!"},
+    )
+
+    # Only the learning moments were asked for.
+    assert mocked_create.call_count == 1
+    assert response.json()["conversation_response"] == (
+        "Mir geht es gut, danke!  Wie geht es dir?"
+    )
+
+    response = await client.get(
+        fastapi_app.url_path_for("conversation_opener_pool_stats"),
+        headers={"Authorization": f"Bearer {access_token}"},
+    )
+    stats = response.json()
+    assert stats["depths"]["de"] == 1
+    assert stats["hits"] == 1
+    assert stats["hit_rate"] == 1
+
+
+@pytest.mark.anyio
+async def test_converse_with_audio(
+    fastapi_app: FastAPI,
+    client: AsyncClient,
+    mocker: MockerFixture,
+) -> None:
+    """
+    Tests that audio is transcribed from memory, and too large audio rejected.
+
+    :param fastapi_app: current application.
+    :param client: client for the app.
+    :param mocker: Automatically supplied by pytest to mock objects.
+    """
+    access_token = await get_access_token(fastapi_app, client)
+    mocker.patch(
+        "fia_api.services.llm.gateway.openai.ChatCompletion.acreate",
+        side_effect=get_mocked_openai_response,
+    )
+    transcribed_audio = []
+
+    async def _transcribe(  # noqa: WPS430
+        model: str,
+        audio_file: Any,
+        **kwargs: Any,
+    ) -> Any:
+        transcribed_audio.append(audio_file.read())
+        return {"text": "Hallo, Wie Geht's?"}
+
+    mocker.patch(
+        "fia_api.services.llm.gateway.openai.Audio.atranscribe",
+        side_effect=_transcribe,
+    )
+    mocker.patch.object(settings, "audio_upload_max_bytes", 8)
+    converse_with_audio_url = fastapi_app.url_path_for("converse_with_audio")
+    headers = {"Authorization": f"Bearer {access_token}"}
+
+    response = await client.post(
+        converse_with_audio_url,
+        headers=headers,
+        params={"conversation_id": "new", "language_code": "de"},
+        files={"audio_file": ("hallo.wav", b"RIFFWAVE", "audio/wav")},
+    )
+
+    assert response.json()["input_message"] == "Hallo, Wie Geht's?"
+    assert transcribed_audio == [b"RIFFWAVE"]
+
+    response = await client.post(
+        converse_with_audio_url,
+        headers=headers,
+        params={"conversation_id": "new", "language_code": "de"},
+        files={"audio_file": ("hallo.wav", b"RIFFWAVE!", "audio/wav")},
+    )
+
+    assert response.status_code == 413
+    assert len(transcribed_audio) == 1
+
+
+@pytest.mark.anyio
+async def test_get_audio_cache(
+    fastapi_app: FastAPI,
+    client: AsyncClient,
+    mocker: MockerFixture,
+    tmp_path: Path,
+) -> None:
+    """
+    Tests that audio is cached on disk and in Redis, and evicted when too big.
+
+    :param fastapi_app: current application.
+    :param client: client for the app.
+    :param mocker: Automatically supplied by pytest to mock objects.
+    :param tmp_path: Temporary directory to cache audio in.
+    """
+    access_token = await get_access_token(fastapi_app, client)
+    text_to_speech_client = mocker.MagicMock()
+    text_to_speech_client.synthesize_speech.side_effect = get_mocked_speech
+    mocker.patch(
+        "fia_api.services.tts.synthesizer.tts_service.client",
+        text_to_speech_client,
+    )
+    mocker.patch.object(settings, "tts_cache_dir", tmp_path)
+    mocker.patch.object(settings, "tts_cache_redis_enabled", new=True)
+    get_audio_url = fastapi_app.url_path_for("get_audio")
+    headers = {"Authorization": f"Bearer {access_token}"}
+
+    async def _get_audio(text: str) -> bytes:  # noqa: WPS430
+        response = await client.post(
+            get_audio_url,
+            headers=headers,
+            json={"text": text, "language_code": "de"},
+        )
+        return response.content
+
+    assert await _get_audio("Hallo") == b"<Hallo>"
+    assert await _get_audio("Hallo") == b"<Hallo>"
+    assert text_to_speech_client.synthesize_speech.call_count == 1
+
+    # Another server's disk cache is filled from Redis.
+    cached_file = next(tmp_path.iterdir())
+    cached_file.unlink()
+    assert await _get_audio("Hallo") == b"<Hallo>"
+    assert text_to_speech_client.synthesize_speech.call_count == 1
+    assert cached_file.exists()
+
+    # Caching both goes over the bound, so the least recently played is evicted.
+    tschues_audio = "<Tschüs>".encode()
+    mocker.patch.object(
+        settings,
+        "tts_cache_max_bytes",
+        len(b"<Hallo>") + len(tschues_audio) - 1,
+    )
+    os.utime(cached_file, (0, 0))
+    assert await _get_audio("Tschüs") == tschues_audio
+    assert text_to_speech_client.synthesize_speech.call_count == 2
+    assert [path.read_bytes() for path in tmp_path.iterdir()] == [tschues_audio]
+
+
+@pytest.mark.anyio
+async def test_get_audio_by_sentence(
+    fastapi_app: FastAPI,
+    client: AsyncClient,
+    mocker: MockerFixture,
+    tmp_path: Path,
+) -> None:
+    """
+    Tests that sentences are synthesized and cached separately, and kept in order.
+
+    :param fastapi_app: current application.
+    :param client: client for the app.
+    :param mocker: Automatically supplied by pytest to mock objects.
+    :param tmp_path: Temporary directory to cache audio in.
+    """
+    access_token = await get_access_token(fastapi_app, client)
+
+    text_to_speech_client = mocker.MagicMock()
+    text_to_speech_client.synthesize_speech.side_effect = get_slow_first_sentence_speech
+    mocker.patch(
+        "fia_api.services.tts.synthesizer.tts_service.client",
+        text_to_speech_client,
+    )
+    mocker.patch.object(settings, "tts_cache_dir", tmp_path)
+    get_audio_url = fastapi_app.url_path_for("get_audio")
+    headers = {"Authorization": f"Bearer {access_token}"}
+
+    response = await client.post(
+        get_audio_url,
+        headers=headers,
+        json={"text": "Hallo. Wie geht's?\nGut! ", "language_code": "de"},
+    )
+
+    assert response.content == "<Hallo.><Wie geht's?><Gut!>".encode()
+    assert text_to_speech_client.synthesize_speech.call_count == 3
+
+    response = await client.post(
+        get_audio_url,
+        headers=headers,
+        json={"text": "Wie geht's?", "language_code": "de"},
+    )
+
+    assert response.content == "<Wie geht's?>".encode()
+    assert text_to_speech_client.synthesize_speech.call_count == 3
+
+
+@pytest.mark.anyio
+async def test_prewarm_reply_audio(
+    fastapi_app: FastAPI,
+    client: AsyncClient,
+    mocker: MockerFixture,
+    tmp_path: Path,
+) -> None:
+    """
+    Tests that reply audio is synthesized once in the background and fetchable.
+
+    :param fastapi_app: current application.
+    :param client: client for the app.
+    :param mocker: Automatically supplied by pytest to mock objects.
+    :param tmp_path: Temporary directory to cache audio in.
+    """
+    access_token = await get_access_token(fastapi_app, client)
+    mocker.patch(
+        "fia_api.services.llm.gateway.openai.ChatCompletion.acreate",
+        side_effect=get_mocked_openai_response,
+    )
+    text_to_speech_client = mocker.MagicMock()
+    text_to_speech_client.synthesize_speech.side_effect = get_mocked_speech
+    mocker.patch(
+        "fia_api.services.tts.synthesizer.tts_service.client",
+        text_to_speech_client,
+    )
+    mocker.patch.object(settings, "tts_cache_dir", tmp_path)
+    mocker.patch.object(settings, "tts_prewarm_enabled", new=True)
+    headers = {"Authorization": f"Bearer {access_token}"}
+
+    response = await client.post(
+        fastapi_app.url_path_for("converse"),
+        headers=headers,
+        json={"conversation_id": "new", "message": "Hallo, Wie Geht's?"},
+    )
+    audio_handle = response.json()["audio_handle"]
+    assert audio_handle
+
+    response = await client.get(
+        fastapi_app.url_path_for("get_audio_by_handle", audio_handle=audio_handle),
+        headers=headers,
+    )
+
+    assert response.content == b"<Mir geht es gut, danke!><Wie geht es dir?>"
+    assert text_to_speech_client.synthesize_speech.call_count == 2
+
+    response = await client.get(
+        fastapi_app.url_path_for("get_audio_by_handle", audio_handle="unknown"),
+        headers=headers,
+    )
+
+    assert response.status_code == 404
+
+
+@pytest.mark.anyio
+async def test_converse_with_voice(
+    fastapi_app: FastAPI,
+    client: AsyncClient,
+    mocker: MockerFixture,
+    tmp_path: Path,
+) -> None:
+    """
+    Tests that a voice turn returns the reply and its audio in one response.
+
+    :param fastapi_app: current application.
+    :param client: client for the app.
+    :param mocker: Automatically supplied by pytest to mock objects.
+    :param tmp_path: Temporary directory to cache audio in.
+    """
+    access_token = await get_access_token(fastapi_app, client)
+    mocker.patch(
+        "fia_api.services.llm.gateway.openai.ChatCompletion.acreate",
+        side_effect=get_mocked_openai_response,
+    )
+    mocker.patch(
+        "fia_api.services.llm.gateway.openai.Audio.atranscribe",
+        return_value={"text": "Hallo, Wie Geht's?"},
+    )
+    text_to_speech_client = mocker.MagicMock()
+    text_to_speech_client.synthesize_speech.side_effect = get_mocked_speech
+    mocker.patch(
+        "fia_api.services.tts.synthesizer.tts_service.client",
+        text_to_speech_client,
+    )
+    mocker.patch.object(settings, "tts_cache_dir", tmp_path)
+
+    response = await client.post(
+        fastapi_app.url_path_for("converse_with_voice"),
+        headers={"Authorization": f"Bearer {access_token}"},
+        params={"conversation_id": "new", "language_code": "de"},
+        files={"audio_file": ("hallo.wav", b"RIFFWAVE", "audio/wav")},
+    )
+
+    content_type, boundary = response.headers["content-type"].split("; boundary=")
+    assert content_type == "multipart/mixed"
+    parts = response.content.split(f"--{boundary}".encode())
+    json_part = parts[1].split(b"\r\n\r\n", 1)
+    audio_part = parts[2].split(b"\r\n\r\n", 1)
+    assert json_part[0].endswith(b"application/json")
+    converse_response = json.loads(json_part[1])
+    assert converse_response["input_message"] == "Hallo, Wie Geht's?"
+    assert converse_response["audio_handle"]
+    assert audio_part[0].endswith(b"audio/mpeg")
+    assert audio_part[1] == b"<Mir geht es gut, danke!><Wie geht es dir?>\r\n"
+    assert parts[3] == b"--\r\n"
+    assert text_to_speech_client.synthesize_speech.call_count == 2
@@ -6,7 +6,10 @@ from fastapi import FastAPI
 from httpx import AsyncClient
 from pytest_mock import MockerFixture
 
-from fia_api.web.api.flashcards.utils import create_flashcard
+from fia_api.db.models.flashcard_model import FlashcardModel
+from fia_api.db.models.user_model import UserModel
+from fia_api.web.api.flashcards.schema import FlashcardSpec
+from fia_api.web.api.flashcards.utils import bulk_create_flashcards
 
 username = str(uuid.uuid4())
 
@@ -87,12 +90,17 @@ async def test_flashcards(
     assert not response.json()["flashcards"]
 
     # Create flashcard:
-    await create_flashcard(
-        username,
-        "front of card",
-        "back of card",
-        conversation_id,
-        explanation="Explainer",
+    user = await UserModel.get(username=username)
+    await bulk_create_flashcards(
+        user,
+        [
+            FlashcardSpec(
+                conversation_id=conversation_id,
+                front="front of card",
+                back="back of card",
+                explanation="Explainer",
+            ),
+        ],
     )
 
     # Now one flashcard
@@ -127,12 +135,16 @@ async def test_flashcards(
     )
 
     # Add two more flashcards:
-    await create_flashcard(
-        username,
-        "front 2",
-        "back 2",
-        str(uuid.uuid4()),
-        both_sides=True,
+    await bulk_create_flashcards(
+        user,
+        [
+            FlashcardSpec(
+                conversation_id=str(uuid.uuid4()),
+                front="front 2",
+                back="back 2",
+                both_sides=True,
+            ),
+        ],
     )
 
     # Now there are three flashcards:
@@ -174,3 +186,44 @@ async def test_flashcards(
         headers=auth_headers,
     )
     assert len(response.json()["flashcards"]) == 4
+
+
+@pytest.mark.anyio
+async def test_bulk_create_flashcards(
+    fastapi_app: FastAPI,
+    client: AsyncClient,
+) -> None:
+    """
+    Tests that many flashcards are created for an already fetched user.
+
+    :param fastapi_app: current application.
+    :param client: client for the app.
+    """
+    await get_access_token(fastapi_app, client)
+    user = await UserModel.get(username=username)
+    conversation_id = str(uuid.uuid4())
+
+    await bulk_create_flashcards(
+        user,
+        [
+            FlashcardSpec(
+                conversation_id=conversation_id,
+                front="ein Hund",
+                back="einen Hund",
+                explanation="Haben takes the accusative.",
+            ),
+            FlashcardSpec(
+                conversation_id=conversation_id,
+                front="der Hund",
+                back="the dog",
+                both_sides=True,
+            ),
+        ],
+    )
+
+    flashcards = await FlashcardModel.filter(user=user).order_by("front")
+    assert [(flashcard.front, flashcard.back) for flashcard in flashcards] == [
+        ("der Hund", "the dog"),
+        ("ein Hund", "einen Hund"),
+        ("the dog", "der Hund"),
+    ]
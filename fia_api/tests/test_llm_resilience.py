@@ -0,0 +1,140 @@
+import asyncio
+from types import SimpleNamespace
+from typing import Any, Iterator
+
+import openai
+import pytest
+from pytest_mock import MockerFixture
+
+from fia_api.services.llm.gateway import create_chat_completion
+from fia_api.services.llm.resilience import (
+    LLMUnavailableError,
+    circuit_breakers,
+    latency_trackers,
+)
+from fia_api.settings import settings
+from fia_api.web.api.teacher.utils import request_conversation_continuation
+
+ACREATE_PATH = "fia_api.services.llm.gateway.openai.ChatCompletion.acreate"
+
+
+@pytest.fixture(autouse=True)
+def reset_backends(mocker: MockerFixture) -> Iterator[None]:
+    """
+    Don't wait between retries, and reset the backends after each test.
+
+    :param mocker: Automatically supplied by pytest to mock objects.
+    :yields: Nothing.
+    """
+    mocker.patch.object(settings, "llm_retry_backoff_seconds", 0)
+
+    yield
+
+    circuit_breakers.clear()
+    latency_trackers.clear()
+
+
+@pytest.mark.anyio
+async def test_transient_error_retried(mocker: MockerFixture) -> None:
+    """
+    Tests that a transient upstream error is retried.
+
+    :param mocker: Automatically supplied by pytest to mock objects.
+    """
+    mocked_create = mocker.patch(
+        ACREATE_PATH,
+        side_effect=[openai.error.ServiceUnavailableError("Down"), "response"],
+    )
+
+    assert await create_chat_completion() == "response"
+    assert mocked_create.call_count == 2
+
+
+@pytest.mark.anyio
+async def test_deadline(mocker: MockerFixture) -> None:
+    """
+    Tests that a hung call is given up on after the deadline.
+
+    :param mocker: Automatically supplied by pytest to mock objects.
+    """
+    mocker.patch.object(settings, "llm_deadline_seconds", 0.01)
+    mocker.patch.object(settings, "llm_max_retries", 0)
+
+    async def _hang(**kwargs: Any) -> None:  # noqa: WPS430
+        await asyncio.sleep(10)
+
+    mocker.patch(ACREATE_PATH, side_effect=_hang)
+
+    with pytest.raises(LLMUnavailableError):
+        await create_chat_completion()
+
+
+@pytest.mark.anyio
+async def test_circuit_breaker(mocker: MockerFixture) -> None:
+    """
+    Tests that calls fail fast once the upstream has failed repeatedly.
+
+    :param mocker: Automatically supplied by pytest to mock objects.
+    """
+    mocker.patch.object(settings, "llm_circuit_failure_threshold", 2)
+    mocker.patch.object(settings, "llm_max_retries", 1)
+    mocked_create = mocker.patch(
+        ACREATE_PATH,
+        side_effect=openai.error.APIConnectionError("Unreachable"),
+    )
+
+    with pytest.raises(LLMUnavailableError):
+        await create_chat_completion()
+    assert mocked_create.call_count == 2
+
+    with pytest.raises(LLMUnavailableError):
+        await create_chat_completion()
+    assert mocked_create.call_count == 2
+
+
+@pytest.mark.anyio
+async def test_hedged_request(mocker: MockerFixture) -> None:
+    """
+    Tests that a slow call is hedged, and the first answer is used.
+
+    :param mocker: Automatically supplied by pytest to mock objects.
+    """
+    mocker.patch.object(settings, "llm_hedging_enabled", new=True)
+    mocker.patch.object(settings, "llm_hedge_default_delay_seconds", 0.01)
+    responses = iter(["slow", "fast"])
+
+    async def _respond(**kwargs: Any) -> str:  # noqa: WPS430
+        response = next(responses)
+        if response == "slow":
+            await asyncio.sleep(10)
+        return response
+
+    mocked_create = mocker.patch(ACREATE_PATH, side_effect=_respond)
+
+    assert await create_chat_completion() == "fast"
+    assert mocked_create.call_count == 2
+
+
+@pytest.mark.anyio
+async def test_malformed_continuation_not_retried(mocker: MockerFixture) -> None:
+    """
+    Tests that a malformed continuation fails without asking for it again.
+
+    The gateway already retries failed calls, so it shouldn't be done twice.
+
+    :param mocker: Automatically supplied by pytest to mock objects.
+    """
+    function_call = SimpleNamespace(arguments='{"message": ')
+    openai_message = SimpleNamespace(function_call=function_call)
+    mocked_create = mocker.patch(
+        "fia_api.web.api.teacher.utils.create_chat_completion",
+        return_value=SimpleNamespace(choices=[SimpleNamespace(message=openai_message)]),
+    )
+    mocker.patch("fia_api.web.api.teacher.utils.store_token_usage")
+
+    with pytest.raises(LLMUnavailableError):
+        await request_conversation_continuation(
+            "conversation",
+            [{"role": "user", "content": "Hallo"}],
+        )
+    assert mocked_create.call_count == 1
@@ -0,0 +1,119 @@
+from typing import Any, Iterator
+
+import openai
+import pytest
+from pytest_mock import MockerFixture
+
+from fia_api.services.llm.gateway import create_chat_completion
+from fia_api.services.llm.resilience import circuit_breakers, latency_trackers
+from fia_api.services.llm.routing import (
+    LLMRoute,
+    get_backends_in_order,
+    get_continuation_route,
+)
+from fia_api.settings import LLMBackend, settings
+
+ACREATE_PATH = "fia_api.services.llm.gateway.openai.ChatCompletion.acreate"
+
+
+@pytest.fixture(autouse=True)
+def fast_and_strong_backends(mocker: MockerFixture) -> Iterator[None]:
+    """
+    Route learning moments to a fast backend, falling back to a strong one.
+
+    :param mocker: Automatically supplied by pytest to mock objects.
+    :yields: Nothing.
+    """
+    mocker.patch.object(
+        settings,
+        "llm_backends",
+        {
+            "fast": LLMBackend(model="fast-model"),
+            "strong": LLMBackend(model="strong-model", api_base="http://strong"),
+        },
+    )
+    mocker.patch.object(
+        settings,
+        "llm_routes",
+        {
+            "default": ["strong"],
+            "learning_moments": ["fast", "strong"],
+        },
+    )
+    mocker.patch.object(settings, "llm_retry_backoff_seconds", 0)
+    mocker.patch.object(settings, "llm_fallback_min_samples", 2)
+
+    yield
+
+    circuit_breakers.clear()
+    latency_trackers.clear()
+
+
+def test_routes() -> None:
+    """Tests that calls are routed by kind, and unlisted kinds use default."""
+    assert get_backends_in_order(LLMRoute.LEARNING_MOMENTS) == ["fast", "strong"]
+    assert get_backends_in_order(LLMRoute.CONVERSATION_SUMMARY) == ["strong"]
+    assert get_continuation_route("Hallo") == (LLMRoute.SHORT_CONVERSATION_CONTINUATION)
+    assert get_continuation_route("Hallo " * 100) == (
+        LLMRoute.CONVERSATION_CONTINUATION
+    )
+
+
+@pytest.mark.anyio
+async def test_backend_model_used(mocker: MockerFixture) -> None:
+    """
+    Tests that the model and API base of the routed backend are used.
+
+    :param mocker: Automatically supplied by pytest to mock objects.
+    """
+    mocked_create = mocker.patch(ACREATE_PATH, return_value="response")
+
+    await create_chat_completion(route=LLMRoute.LEARNING_MOMENTS)
+    await create_chat_completion(route=LLMRoute.CONVERSATION_SUMMARY)
+
+    assert mocked_create.call_args_list[0].kwargs == {"model": "fast-model"}
+    assert mocked_create.call_args_list[1].kwargs == {
+        "model": "strong-model",
+        "api_base": "http://strong",
+    }
+
+
+@pytest.mark.anyio
+async def test_slow_backend_skipped(mocker: MockerFixture) -> None:
+    """
+    Tests that a backend with a p95 over the threshold is passed over.
+
+    :param mocker: Automatically supplied by pytest to mock objects.
+    """
+    mocker.patch.object(settings, "llm_fallback_p95_seconds", 1)
+    for _ in range(2):
+        latency_trackers["fast"].record(5)
+    mocked_create = mocker.patch(ACREATE_PATH, return_value="response")
+
+    await create_chat_completion(route=LLMRoute.LEARNING_MOMENTS)
+
+    assert mocked_create.call_args.kwargs["model"] == "strong-model"
+    assert get_backends_in_order(LLMRoute.LEARNING_MOMENTS) == ["strong", "fast"]
+
+
+@pytest.mark.anyio
+async def test_fallback_on_failure(mocker: MockerFixture) -> None:
+    """
+    Tests that the next backend is tried if one fails.
+
+    :param mocker: Automatically supplied by pytest to mock objects.
+    """
+    mocker.patch.object(settings, "llm_max_retries", 0)
+
+    async def _respond(**kwargs: Any) -> str:  # noqa: WPS430
+        if kwargs["model"] == "fast-model":
+            raise openai.error.ServiceUnavailableError("Down")
+        return "response"
+
+    mocked_create = mocker.patch(ACREATE_PATH, side_effect=_respond)
+
+    assert await create_chat_completion(route=LLMRoute.LEARNING_MOMENTS) == ("response")
+    assert [call.kwargs["model"] for call in mocked_create.call_args_list] == [
+        "fast-model",
+        "strong-model",
+    ]
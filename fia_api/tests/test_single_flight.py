@@ -0,0 +1,114 @@
+import asyncio
+
+import pytest
+from pytest_mock import MockerFixture
+from redis.asyncio import ConnectionPool
+
+from fia_api.services.llm.single_flight import coalesce_across_workers, single_flight
+from fia_api.settings import settings
+from fia_api.web.api.teacher.schema import ConversationContinuation
+
+
+@pytest.mark.anyio
+async def test_single_flight(mocker: MockerFixture) -> None:
+    """
+    Tests that concurrent identical requests share one call.
+
+    :param mocker: Automatically supplied by pytest to mock objects.
+    """
+    continuation = ConversationContinuation(message="Hallo!")
+
+    async def _request() -> ConversationContinuation:  # noqa: WPS430
+        await asyncio.sleep(0.05)
+        return continuation
+
+    request = mocker.AsyncMock(side_effect=_request)
+
+    results = await asyncio.gather(
+        *[single_flight("key", request, ConversationContinuation) for _ in range(5)],
+    )
+
+    assert results == [continuation for _ in range(5)]
+    assert request.call_count == 1
+
+    await single_flight("key", request, ConversationContinuation)
+    assert request.call_count == 2
+
+
+@pytest.mark.anyio
+async def test_coalesce_across_workers(
+    fake_redis_pool: ConnectionPool,
+    mocker: MockerFixture,
+) -> None:
+    """
+    Tests that identical requests from different workers share one call.
+
+    :param fake_redis_pool: fake redis pool.
+    :param mocker: Automatically supplied by pytest to mock objects.
+    """
+    mocker.patch.object(settings, "single_flight_poll_interval_seconds", 0.01)
+    continuation = ConversationContinuation(message="Hallo!")
+
+    async def _request() -> ConversationContinuation:  # noqa: WPS430
+        await asyncio.sleep(0.1)
+        return continuation
+
+    request = mocker.AsyncMock(side_effect=_request)
+
+    results = await asyncio.gather(
+        coalesce_across_workers(
+            fake_redis_pool,
+            "key",
+            request,
+            ConversationContinuation,
+        ),
+        coalesce_across_workers(
+            fake_redis_pool,
+            "key",
+            request,
+            ConversationContinuation,
+        ),
+    )
+
+    assert list(results) == [continuation, continuation]
+    assert request.call_count == 1
+
+
+@pytest.mark.anyio
+async def test_lock_outlives_ttl(
+    fake_redis_pool: ConnectionPool,
+    mocker: MockerFixture,
+) -> None:
+    """
+    Tests that the lock is kept for a request that takes longer than its TTL.
+
+    :param fake_redis_pool: fake redis pool.
+    :param mocker: Automatically supplied by pytest to mock objects.
+    """
+    mocker.patch.object(settings, "single_flight_poll_interval_seconds", 0.01)
+    mocker.patch.object(settings, "single_flight_lock_ttl_seconds", 0.1)
+    continuation = ConversationContinuation(message="Hallo!")
+
+    async def _request() -> ConversationContinuation:  # noqa: WPS430
+        await asyncio.sleep(0.5)
+        return continuation
+
+    request = mocker.AsyncMock(side_effect=_request)
+
+    results = await asyncio.gather(
+        coalesce_across_workers(
+            fake_redis_pool,
+            "key",
+            request,
+            ConversationContinuation,
+        ),
+        coalesce_across_workers(
+            fake_redis_pool,
+            "key",
+            request,
+            ConversationContinuation,
+        ),
+    )
+
+    assert list(results) == [continuation, continuation]
+    assert request.call_count == 1
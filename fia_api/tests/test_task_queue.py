@@ -0,0 +1,81 @@
+from unittest.mock import AsyncMock
+
+import pytest
+from pytest_mock import MockerFixture
+from redis.asyncio import ConnectionPool, Redis
+
+from fia_api.services.task_queue.queue import (
+    DEAD_LETTER_KEY,
+    PENDING_KEY,
+    WORKER_ID,
+    enqueue_task,
+    get_processing_key,
+    process_next_task,
+    register_task,
+    requeue_stale_tasks,
+)
+from fia_api.settings import settings
+
+
+@pytest.mark.anyio
+async def test_task_retried_then_dead_lettered(
+    fake_redis_pool: ConnectionPool,
+    mocker: MockerFixture,
+) -> None:
+    """
+    Tests that a failing task is retried, then dead-lettered.
+
+    :param fake_redis_pool: fake redis pool.
+    :param mocker: Automatically supplied by pytest to mock objects.
+    """
+    mocker.patch.object(settings, "task_queue_max_retries", 1)
+    mocker.patch.object(settings, "task_queue_retry_backoff_seconds", 0)
+    failing_task: AsyncMock = mocker.AsyncMock(side_effect=ValueError)
+    register_task("failing_task")(failing_task)
+
+    await enqueue_task(fake_redis_pool, "failing_task", value=1)
+
+    assert await process_next_task(fake_redis_pool, 1)
+    assert await process_next_task(fake_redis_pool, 1)
+    assert not await process_next_task(fake_redis_pool, 1)
+
+    assert failing_task.call_count == 2
+    failing_task.assert_called_with(value=1)
+    async with Redis(connection_pool=fake_redis_pool) as redis:
+        assert await redis.llen(DEAD_LETTER_KEY) == 1
+
+
+@pytest.mark.anyio
+async def test_stale_task_requeued(
+    fake_redis_pool: ConnectionPool,
+    mocker: MockerFixture,
+) -> None:
+    """
+    Tests that a task left running by a dead worker is requeued and run.
+
+    :param fake_redis_pool: fake redis pool.
+    :param mocker: Automatically supplied by pytest to mock objects.
+    """
+    stale_task: AsyncMock = mocker.AsyncMock()
+    register_task("stale_task")(stale_task)
+    await enqueue_task(fake_redis_pool, "stale_task", value=1)
+
+    async with Redis(connection_pool=fake_redis_pool) as redis:
+        # A worker that died after taking the task:
+        await redis.lmove(
+            PENDING_KEY,
+            get_processing_key("dead_worker"),
+            src="RIGHT",
+            dest="LEFT",
+        )
+
+        assert not await process_next_task(fake_redis_pool, 1)
+        assert await requeue_stale_tasks(fake_redis_pool) == 1
+        assert await process_next_task(fake_redis_pool, 1)
+
+        stale_task.assert_called_once_with(value=1)
+        assert not await redis.llen(get_processing_key("dead_worker"))
+        assert not await redis.llen(get_processing_key(WORKER_ID))
+
+    # This worker is alive, so its tasks aren't requeued.
+    assert not await requeue_stale_tasks(fake_redis_pool)
@@ -0,0 +1,72 @@
+import asyncio
+import uuid
+
+import pytest
+from pytest_mock import MockerFixture
+from redis.asyncio import ConnectionPool
+
+from fia_api.db.models.token_usage_model import TokenUsageModel
+from fia_api.services.token_usage.accounting import (
+    flush_token_usage,
+    record_token_usage,
+    set_redis_pool,
+)
+from fia_api.settings import TokenUsageWriteBehind, settings
+
+
+@pytest.mark.anyio
+async def test_concurrent_token_usage() -> None:
+    """Tests that concurrent usage on one conversation isn't lost."""
+    conversation_id = uuid.uuid4()
+    await TokenUsageModel.create(conversation_id=conversation_id)
+
+    await asyncio.gather(
+        *[record_token_usage(str(conversation_id), 10, 1) for _ in range(20)],
+    )
+
+    token_usage = await TokenUsageModel.get(conversation_id=conversation_id)
+    assert token_usage.prompt_token_usage == 200
+    assert token_usage.completion_token_usage == 20
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize(
+    "write_behind",
+    [TokenUsageWriteBehind.MEMORY, TokenUsageWriteBehind.REDIS],
+)
+async def test_write_behind_token_usage(
+    fake_redis_pool: ConnectionPool,
+    mocker: MockerFixture,
+    write_behind: TokenUsageWriteBehind,
+) -> None:
+    """
+    Tests that write-behind usage only reaches the DB once flushed.
+
+    :param fake_redis_pool: fake redis pool.
+    :param mocker: Automatically supplied by pytest to mock objects.
+    :param write_behind: The write-behind mode to test.
+    """
+    mocker.patch.object(settings, "token_usage_write_behind", write_behind)
+    set_redis_pool(fake_redis_pool)
+
+    conversation_ids = [uuid.uuid4(), uuid.uuid4()]
+    for conversation_id in conversation_ids:
+        await TokenUsageModel.create(conversation_id=conversation_id)
+
+        await record_token_usage(str(conversation_id), 100, 10)
+        await record_token_usage(str(conversation_id), 50, 5, 7)
+
+    token_usage = await TokenUsageModel.get(conversation_id=conversation_ids[0])
+    assert token_usage.prompt_token_usage == 0
+
+    assert await flush_token_usage() == 2
+    assert await flush_token_usage() == 0
+
+    token_usages = await TokenUsageModel.filter(conversation_id__in=conversation_ids)
+    assert len(token_usages) == 2
+    for flushed_usage in token_usages:
+        assert flushed_usage.prompt_token_usage == 150
+        assert flushed_usage.completion_token_usage == 15
+        assert flushed_usage.saved_prompt_token_usage == 7
+
+    set_redis_pool(None)
@@ -0,0 +1,125 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any
+
+import pytest
+from google.cloud import texttospeech
+from pytest_mock import MockerFixture
+from redis.asyncio import ConnectionPool
+
+from fia_api.services.tts.synthesizer import set_tts_service, synthesize_speech
+from fia_api.settings import settings
+from fia_api.web.api.teacher.audio import get_audio_stream_from_handle, prewarm_audio
+from fia_api.web.api.teacher.tts_cache import cache_size, store_cached_audio
+
+
+@pytest.mark.anyio
+async def test_synthesize_speech_concurrency_limit(mocker: MockerFixture) -> None:
+    """
+    Tests that synthesis uses the shared client, at most N calls at a time.
+
+    :param mocker: Automatically supplied by pytest to mock objects.
+    """
+    mocker.patch.object(settings, "tts_max_concurrency", 2)
+    concurrency = SimpleNamespace(running=0, max_running=0)
+    lock = threading.Lock()
+
+    def _synthesize_speech(  # noqa: WPS430
+        input: texttospeech.SynthesisInput,  # noqa: WPS125
+        **kwargs: Any,
+    ) -> Any:
+        with lock:
+            concurrency.running += 1
+            concurrency.max_running = max(
+                concurrency.max_running,
+                concurrency.running,
+            )
+        time.sleep(0.05)
+        with lock:
+            concurrency.running -= 1
+        return SimpleNamespace(audio_content=f"{input.text} mp3".encode())
+
+    tts_client = mocker.MagicMock()
+    tts_client.synthesize_speech.side_effect = _synthesize_speech
+    voice = texttospeech.VoiceSelectionParams(language_code="de")
+    audio_config = texttospeech.AudioConfig(
+        audio_encoding=texttospeech.AudioEncoding.MP3,
+    )
+
+    with ThreadPoolExecutor(max_workers=4) as tts_executor:
+        set_tts_service(tts_client, tts_executor)
+        try:
+            audio = await asyncio.gather(
+                *[
+                    synthesize_speech(str(index), voice, audio_config)
+                    for index in range(5)
+                ],
+            )
+        finally:
+            set_tts_service(None, None)
+
+    assert audio == [f"{index} mp3".encode() for index in range(5)]
+    assert tts_client.synthesize_speech.call_count == 5
+    assert concurrency.max_running == 2
+
+
+@pytest.mark.anyio
+async def test_prewarmed_audio_streams_each_sentence(
+    fake_redis_pool: ConnectionPool,
+    mocker: MockerFixture,
+) -> None:
+    """
+    Tests that pre-warming audio is streamed as each sentence is ready.
+
+    :param fake_redis_pool: fake redis pool.
+    :param mocker: Automatically supplied by pytest to mock objects.
+    """
+    mocker.patch.object(settings, "tts_cache_enabled", new=False)
+    last_sentence_allowed = asyncio.Event()
+
+    async def _synthesize_speech(  # noqa: WPS430
+        text: str,
+        voice: texttospeech.VoiceSelectionParams,
+        audio_config: texttospeech.AudioConfig,
+    ) -> bytes:
+        if text == "Wie geht es dir?":
+            await last_sentence_allowed.wait()
+        return f"<{text}>".encode()
+
+    mocker.patch(
+        "fia_api.web.api.teacher.audio.synthesize_speech",
+        side_effect=_synthesize_speech,
+    )
+
+    audio_handle = await prewarm_audio(
+        "Mir geht es gut! Wie geht es dir?",
+        "de",
+        fake_redis_pool,
+    )
+    assert audio_handle
+    audio_stream = await get_audio_stream_from_handle(audio_handle, fake_redis_pool)
+    assert audio_stream is not None
+
+    assert await anext(audio_stream) == b"<Mir geht es gut!>"
+
+    last_sentence_allowed.set()
+    assert [chunk async for chunk in audio_stream] == [b"<Wie geht es dir?>"]
+
+
+def test_store_cached_audio_twice(mocker: MockerFixture, tmp_path: Path) -> None:
+    """
+    Tests that caching audio for a key twice only counts its size once.
+
+    :param mocker: Automatically supplied by pytest to mock objects.
+    :param tmp_path: Temporary directory to cache audio in.
+    """
+    mocker.patch.object(settings, "tts_cache_dir", tmp_path)
+
+    store_cached_audio("key", b"<Hallo>")
+    store_cached_audio("key", b"<Hallo>")
+
+    assert cache_size.total_bytes[tmp_path] == len(b"<Hallo>")
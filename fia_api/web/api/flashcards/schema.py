@@ -16,6 +16,17 @@ class Flashcard(BaseModel):
     last_reviewed_date: datetime
 
 
+class FlashcardSpec(BaseModel):
+    """What to put on a flashcard to be created."""
+
+    conversation_id: str
+    front: str
+    back: str
+    explanation: Optional[str] = None
+    # Also create the reverse card, back:front.
+    both_sides: Optional[bool] = False
+
+
 class CreateFlashcardRequest(BaseModel):
     """Request object for manually creating a flashcard."""
 
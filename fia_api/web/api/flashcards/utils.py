@@ -1,47 +1,46 @@
 import uuid
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List
 
 from fia_api.db.models.flashcard_model import FlashcardModel
 from fia_api.db.models.user_model import UserModel
-from fia_api.web.api.flashcards.schema import Flashcard, GetFlashcardsResponse
+from fia_api.web.api.flashcards.schema import (
+    Flashcard,
+    FlashcardSpec,
+    GetFlashcardsResponse,
+)
 
 
-async def create_flashcard(  # noqa: WPS211
-    username: str,
-    front: str,
-    back: str,
-    conversation_id: str,
-    explanation: Optional[str] = None,
-    both_sides: Optional[bool] = False,
+async def bulk_create_flashcards(
+    user: UserModel,
+    flashcard_specs: List[FlashcardSpec],
 ) -> None:
     """
-    Create a flashcard given the params.
+    Create many flashcards for a user with one insert.
 
-    :param username: String username the card belongs to.
-    :param front: String front of the card.
-    :param back: String back of the card.
-    :param conversation_id: String conversation_id of the context.
-    :param explanation: String explanation of the answer.
-    :param both_sides: Optional boolean, if True create a card front:back and
-                        back:front.
+    :param user: UserModel the cards belong to.
+    :param flashcard_specs: List of FlashcardSpec describing each card.
     """
-    await FlashcardModel.create(
-        user=await UserModel.get(username=username),
-        front=front,
-        back=back,
-        explanation=explanation,
-        conversation_id=uuid.UUID(conversation_id),
-    )
+    flashcards: List[FlashcardModel] = []
+
+    for flashcard_spec in flashcard_specs:
+        sides = [(flashcard_spec.front, flashcard_spec.back)]
+        if flashcard_spec.both_sides:
+            sides.append((flashcard_spec.back, flashcard_spec.front))
 
-    if both_sides:
-        await FlashcardModel.create(
-            user=await UserModel.get(username=username),
-            front=back,
-            back=front,
-            explanation=explanation,
-            conversation_id=uuid.UUID(conversation_id),
+        flashcards.extend(
+            FlashcardModel(
+                user=user,
+                front=front,
+                back=back,
+                explanation=flashcard_spec.explanation,
+                conversation_id=uuid.UUID(flashcard_spec.conversation_id),
+            )
+            for front, back in sides
         )
 
+    if flashcards:
+        await FlashcardModel.bulk_create(flashcards)
+
 
 def format_flashcards_for_response(
     raw_flashcards: List[Dict[str, Any]],
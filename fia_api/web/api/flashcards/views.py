@@ -7,11 +7,14 @@ from fia_api.db.models.user_model import UserModel
 from fia_api.web.api.flashcards.schema import (
     CreateFlashcardRequest,
     DeleteFlashcardRequest,
+    FlashcardSpec,
     GetFlashcardsResponse,
     UpdateFlashcardRequest,
 )
-from fia_api.web.api.flashcards.utils import create_flashcard as create_flashcard_util
-from fia_api.web.api.flashcards.utils import format_flashcards_for_response
+from fia_api.web.api.flashcards.utils import (
+    bulk_create_flashcards,
+    format_flashcards_for_response,
+)
 from fia_api.web.api.user.schema import AuthenticatedUser
 from fia_api.web.api.user.utils import get_current_user
 
@@ -116,10 +119,7 @@ async def create_flashcard(
     :param create_flashcard_request: The flashcard ID to create.
     :param user: The AuthenticatedUser making the request.
     """
-    await create_flashcard_util(
-        user.username,
-        create_flashcard_request.front,
-        create_flashcard_request.back,
-        create_flashcard_request.conversation_id,
-        both_sides=create_flashcard_request.both_sides,
+    await bulk_create_flashcards(
+        await UserModel.get(username=user.username),
+        [FlashcardSpec(**create_flashcard_request.model_dump())],
     )
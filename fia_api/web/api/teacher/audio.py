@@ -0,0 +1,451 @@
+"""
+Text-to-Speech of replies.
+
+Audio goes through the cache in fia_api.web.api.teacher.tts_cache, one
+sentence at a time with settings.tts_sentence_chunking_enabled.
+
+With settings.tts_prewarm_enabled, the audio of each reply is synthesized into
+the cache in the background as soon as the reply is ready, and the reply
+comes with an audio handle to fetch it by. Clients almost always ask for the
+audio of a reply straight away, so that fetch is usually a cache hit, or
+streams each sentence as the synthesis already under way finishes it, rather
+than starting another one.
+"""
+import asyncio
+import hashlib
+import json
+import re
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from google.cloud import texttospeech
+from loguru import logger
+from redis.asyncio import ConnectionPool, Redis, RedisError
+
+from fia_api.services.tts.synthesizer import synthesize_speech
+from fia_api.settings import settings
+from fia_api.web.api.teacher.schema import AudioHandleSpec, ConverseResponse
+from fia_api.web.api.teacher.tts_cache import (
+    get_audio_cache_key,
+    get_redis_cached_audio,
+    open_cached_audio,
+    set_redis_cached_audio,
+    store_cached_audio,
+    stream_cached_audio,
+)
+
+AUDIO_HANDLE_PREFIX = "audio_handle"
+# Whitespace after the end of a sentence.
+SENTENCE_END_PATTERN = re.compile(r"(?<=[.!?…])\s+")
+
+# The task getting the audio of each sentence of some text, in order.
+SentenceTasks = List["asyncio.Task[bytes]"]
+
+# Audio handle -> the sentence tasks of its pre-warm in this worker, while any
+# of them run.
+_prewarm_tasks: Dict[str, SentenceTasks] = {}
+
+
+def get_synthesis_config(
+    language_code: str,
+) -> Tuple[texttospeech.VoiceSelectionParams, texttospeech.AudioConfig]:
+    """
+    Get the voice and audio config to convert text in a language with.
+
+    :param language_code: String language_code to convert to.
+    :returns: Tuple of VoiceSelectionParams and AudioConfig.
+    """
+    voice = texttospeech.VoiceSelectionParams(
+        language_code=language_code,
+        ssml_gender=texttospeech.SsmlVoiceGender.NEUTRAL,
+    )
+
+    audio_config = texttospeech.AudioConfig(
+        audio_encoding=texttospeech.AudioEncoding.MP3,
+    )
+
+    return voice, audio_config
+
+
+def split_into_sentences(text: str) -> List[str]:
+    """
+    Split text into its sentences, to synthesize separately.
+
+    :param text: String text to split.
+    :returns: List of string sentences, without surrounding whitespace.
+    """
+    return [
+        sentence.strip()
+        for sentence in SENTENCE_END_PATTERN.split(text)
+        if sentence.strip()
+    ]
+
+
+def get_sentences(text: str) -> List[str]:
+    """
+    Get the parts of some text that are synthesized separately.
+
+    :param text: String text to convert.
+    :returns: List of string sentences with
+              settings.tts_sentence_chunking_enabled, otherwise just the text.
+    """
+    if settings.tts_sentence_chunking_enabled:
+        return split_into_sentences(text) or [text]
+
+    return [text]
+
+
+async def fill_audio_cache(
+    cache_key: str,
+    text: str,
+    voice: texttospeech.VoiceSelectionParams,
+    audio_config: texttospeech.AudioConfig,
+    redis_pool: Optional[ConnectionPool],
+) -> bytes:
+    """
+    Get the audio of some text that isn't cached on disk, and cache it there.
+
+    It is taken from Redis if that tier is enabled and has it, otherwise it
+    is synthesized (and stored in Redis).
+
+    :param cache_key: String key from get_audio_cache_key.
+    :param text: String text to convert.
+    :param voice: VoiceSelectionParams to convert with.
+    :param audio_config: AudioConfig to convert with.
+    :param redis_pool: Optional Redis connection pool for the shared cache.
+    :returns: Bytes of MP3 audio.
+    """
+    shared_cache_pool = redis_pool if settings.tts_cache_redis_enabled else None
+
+    audio = None
+    if shared_cache_pool is not None:
+        audio = await get_redis_cached_audio(shared_cache_pool, cache_key)
+    if audio is None:
+        audio = await synthesize_speech(text, voice, audio_config)
+        if shared_cache_pool is not None:
+            await set_redis_cached_audio(shared_cache_pool, cache_key, audio)
+
+    await asyncio.to_thread(store_cached_audio, cache_key, audio)
+
+    return audio
+
+
+async def get_cached_audio_stream(
+    text: str,
+    voice: texttospeech.VoiceSelectionParams,
+    audio_config: texttospeech.AudioConfig,
+    redis_pool: Optional[ConnectionPool] = None,
+) -> AsyncIterator[bytes]:
+    """
+    Get a byte stream of the audio of some text, through the cache.
+
+    Audio cached on disk is streamed from the file, otherwise see
+    fill_audio_cache.
+
+    :param text: String text to convert.
+    :param voice: VoiceSelectionParams to convert with.
+    :param audio_config: AudioConfig to convert with.
+    :param redis_pool: Optional Redis connection pool for the shared cache.
+    :yields: Audio stream.
+    """
+    cache_key = get_audio_cache_key(text, voice, audio_config)
+    audio_file = None
+    if settings.tts_cache_enabled:
+        audio_file = await asyncio.to_thread(open_cached_audio, cache_key)
+
+    if audio_file is not None:
+        cached_chunks = stream_cached_audio(audio_file)
+        async for chunk in cached_chunks:
+            yield chunk
+    elif settings.tts_cache_enabled:
+        yield await fill_audio_cache(
+            cache_key,
+            text,
+            voice,
+            audio_config,
+            redis_pool,
+        )
+    else:
+        yield await synthesize_speech(text, voice, audio_config)
+
+
+async def get_sentence_audio(
+    sentence: str,
+    voice: texttospeech.VoiceSelectionParams,
+    audio_config: texttospeech.AudioConfig,
+    redis_pool: Optional[ConnectionPool],
+) -> bytes:
+    """
+    Get the whole audio of a sentence, through the cache.
+
+    :param sentence: String sentence to convert.
+    :param voice: VoiceSelectionParams to convert with.
+    :param audio_config: AudioConfig to convert with.
+    :param redis_pool: Optional Redis connection pool for the shared cache.
+    :returns: Bytes of MP3 audio.
+    """
+    audio_stream = get_cached_audio_stream(sentence, voice, audio_config, redis_pool)
+
+    return b"".join([chunk async for chunk in audio_stream])
+
+
+def start_sentence_synthesis(
+    sentences: List[str],
+    language_code: str,
+    redis_pool: Optional[ConnectionPool],
+) -> SentenceTasks:
+    """
+    Start getting the audio of each sentence.
+
+    Up to settings.tts_chunk_concurrency sentences are synthesized at once.
+
+    :param sentences: List of string sentences to convert.
+    :param language_code: String language_code to convert to.
+    :param redis_pool: Optional Redis connection pool for the shared cache.
+    :returns: List of the task getting each sentence's audio, in order.
+    """
+    voice, audio_config = get_synthesis_config(language_code)
+    semaphore = asyncio.Semaphore(settings.tts_chunk_concurrency)
+
+    async def _get_sentence_audio(sentence: str) -> bytes:  # noqa: WPS430
+        async with semaphore:
+            return await get_sentence_audio(sentence, voice, audio_config, redis_pool)
+
+    return [
+        asyncio.create_task(_get_sentence_audio(sentence)) for sentence in sentences
+    ]
+
+
+async def stream_sentence_tasks(
+    sentence_tasks: SentenceTasks,
+) -> AsyncIterator[bytes]:
+    """
+    Stream the audio of each sentence in order, as each is ready.
+
+    The tasks still running are cancelled if the stream stops early.
+
+    :param sentence_tasks: List of tasks from start_sentence_synthesis.
+    :yields: MP3 audio stream.
+    :raises Exception: If a sentence failed.
+    :raises asyncio.CancelledError: If the request was cancelled.
+    :raises GeneratorExit: If the client has gone before the last sentence.
+    """
+    try:
+        for sentence_task in sentence_tasks:
+            yield await sentence_task
+    except (Exception, asyncio.CancelledError, GeneratorExit):
+        for unfinished_task in sentence_tasks:
+            unfinished_task.cancel()
+        raise
+
+
+async def get_audio_stream_from_text(
+    text: str,
+    language_code: str,
+    redis_pool: Optional[ConnectionPool] = None,
+) -> AsyncIterator[bytes]:
+    """
+    Given some text, return a byte stream of the audio as MP3.
+
+    With settings.tts_sentence_chunking_enabled, each sentence is synthesized
+    and cached on its own, up to settings.tts_chunk_concurrency at once. The
+    sentences are yielded in order as each is ready, so playback can start
+    once the first one is. MP3 frames play back to back, so the chunks
+    concatenate into one stream.
+
+    :param text: String text to convert.
+    :param language_code: String language_code to convert to.
+    :param redis_pool: Optional Redis connection pool for the shared cache.
+    :yields: MP3 audio stream.
+    """
+    sentences = get_sentences(text)
+
+    if len(sentences) == 1:
+        voice, audio_config = get_synthesis_config(language_code)
+        audio_stream = get_cached_audio_stream(text, voice, audio_config, redis_pool)
+    else:
+        audio_stream = stream_sentence_tasks(
+            start_sentence_synthesis(sentences, language_code, redis_pool),
+        )
+
+    async for chunk in audio_stream:
+        yield chunk
+
+
+def get_audio_handle(text: str, language_code: str) -> str:
+    """
+    Get the handle of the audio of some text.
+
+    :param text: String text to convert.
+    :param language_code: String language_code to convert to.
+    :returns: String hex digest.
+    """
+    return hashlib.sha256(
+        json.dumps([text, language_code], ensure_ascii=False).encode(),
+    ).hexdigest()
+
+
+def forget_prewarm_when_done(
+    audio_handle: str,
+    sentence_tasks: SentenceTasks,
+) -> None:
+    """
+    Log sentences that fail to pre-warm, and forget the pre-warm once done.
+
+    :param audio_handle: String audio handle of the pre-warm.
+    :param sentence_tasks: List of tasks from start_sentence_synthesis.
+    """
+
+    def _on_sentence_done(sentence_task: "asyncio.Task[bytes]") -> None:  # noqa: WPS430
+        if not sentence_task.cancelled() and sentence_task.exception() is not None:
+            logger.opt(exception=sentence_task.exception()).error(
+                "Failed to pre-warm reply audio",
+            )
+        if all(task.done() for task in sentence_tasks):
+            _prewarm_tasks.pop(audio_handle, None)
+
+    for sentence_task in sentence_tasks:
+        sentence_task.add_done_callback(_on_sentence_done)
+
+
+async def prewarm_audio(
+    text: str,
+    language_code: str,
+    redis_pool: Optional[ConnectionPool] = None,
+) -> Optional[str]:
+    """
+    Start synthesizing the audio of a reply into the cache, and store its handle.
+
+    The synthesis runs in the background, and isn't started again if it's
+    already under way in this worker. The handle is stored in Redis for
+    settings.tts_audio_handle_ttl_seconds, so any server can fetch the audio
+    by it.
+
+    :param text: String reply to convert.
+    :param language_code: String language_code to convert to.
+    :param redis_pool: Optional Redis connection pool to store the handle in.
+    :returns: String audio handle, or None if it couldn't be stored.
+    """
+    audio_handle = get_audio_handle(text, language_code)
+
+    if audio_handle not in _prewarm_tasks:
+        sentence_tasks = start_sentence_synthesis(
+            get_sentences(text),
+            language_code,
+            redis_pool,
+        )
+        _prewarm_tasks[audio_handle] = sentence_tasks
+        forget_prewarm_when_done(audio_handle, sentence_tasks)
+
+    if redis_pool is None:
+        return None
+
+    audio_handle_spec = AudioHandleSpec(text=text, language_code=language_code)
+    try:
+        async with Redis(connection_pool=redis_pool) as redis:
+            await redis.set(
+                f"{AUDIO_HANDLE_PREFIX}:{audio_handle}",
+                audio_handle_spec.model_dump_json(),
+                ex=settings.tts_audio_handle_ttl_seconds,
+            )
+    except RedisError:
+        logger.exception("Failed to store an audio handle")
+        return None
+
+    return audio_handle
+
+
+async def stream_prewarming_audio(
+    audio_handle_spec: AudioHandleSpec,
+    sentence_tasks: SentenceTasks,
+    redis_pool: ConnectionPool,
+) -> AsyncIterator[bytes]:
+    """
+    Stream the audio of a pre-warm still under way, as each sentence is ready.
+
+    Sentences that failed to pre-warm are synthesized again.
+
+    :param audio_handle_spec: AudioHandleSpec of the pre-warmed audio.
+    :param sentence_tasks: List of the pre-warm's tasks, from
+                           start_sentence_synthesis.
+    :param redis_pool: Redis connection pool for the shared cache.
+    :yields: MP3 audio stream.
+    """
+    voice, audio_config = get_synthesis_config(audio_handle_spec.language_code)
+    sentences = get_sentences(audio_handle_spec.text)
+
+    for sentence, sentence_task in zip(sentences, sentence_tasks):
+        try:
+            # Shielded, so a client going away doesn't cancel the pre-warm.
+            yield await asyncio.shield(sentence_task)
+        except Exception:
+            yield await get_sentence_audio(sentence, voice, audio_config, redis_pool)
+
+
+async def get_audio_stream_from_handle(
+    audio_handle: str,
+    redis_pool: ConnectionPool,
+) -> Optional[AsyncIterator[bytes]]:
+    """
+    Get a byte stream of the audio of a handle from prewarm_audio.
+
+    If the audio is still being pre-warmed in this worker, each sentence is
+    streamed as the pre-warm finishes it, rather than synthesizing it again.
+
+    :param audio_handle: String audio handle.
+    :param redis_pool: Redis connection pool the handle is stored in.
+    :returns: MP3 audio stream, or None if the handle is unknown or expired.
+    """
+    async with Redis(connection_pool=redis_pool) as redis:
+        raw_audio_handle_spec = await redis.get(
+            f"{AUDIO_HANDLE_PREFIX}:{audio_handle}",
+        )
+
+    if raw_audio_handle_spec is None:
+        return None
+
+    audio_handle_spec = AudioHandleSpec.model_validate_json(raw_audio_handle_spec)
+
+    sentence_tasks = _prewarm_tasks.get(audio_handle)
+    if sentence_tasks is not None:
+        return stream_prewarming_audio(audio_handle_spec, sentence_tasks, redis_pool)
+
+    return get_audio_stream_from_text(
+        audio_handle_spec.text,
+        audio_handle_spec.language_code,
+        redis_pool,
+    )
+
+
+async def stream_voice_response(
+    converse_response: ConverseResponse,
+    redis_pool: ConnectionPool,
+    boundary: str,
+) -> AsyncIterator[bytes]:
+    """
+    Stream a reply and its audio as one multipart/mixed body.
+
+    The first part is the ConverseResponse JSON and the second the MP3 of the
+    reply, streamed as it's ready. The audio part is left out if the reply has
+    no audio handle.
+
+    :param converse_response: ConverseResponse with an audio_handle.
+    :param redis_pool: Redis connection pool the handle is stored in.
+    :param boundary: String boundary between the parts.
+    :yields: Bytes of the multipart body.
+    """
+    json_part = converse_response.model_dump_json()
+    yield f"--{boundary}\r\nContent-Type: application/json\r\n\r\n{json_part}".encode()
+
+    audio_stream = None
+    if converse_response.audio_handle is not None:
+        audio_stream = await get_audio_stream_from_handle(
+            converse_response.audio_handle,
+            redis_pool,
+        )
+
+    if audio_stream is not None:
+        yield f"\r\n--{boundary}\r\nContent-Type: audio/mpeg\r\n\r\n".encode()
+        async for chunk in audio_stream:
+            yield chunk
+
+    yield f"\r\n--{boundary}--\r\n".encode()
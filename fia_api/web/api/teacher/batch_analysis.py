@@ -0,0 +1,329 @@
+"""
+Look for mistakes in many messages with as few OpenAI calls as possible.
+
+Messages are packed into batches of up to
+settings.batch_learning_moments_max_messages, each checked with one function
+call, so the learning moments prompt is only sent once per batch. Messages are
+sent to the model with their index in the request as their ID rather than the
+client's ID, which keeps them short and unique.
+"""
+import asyncio
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+from loguru import logger
+from redis.asyncio import ConnectionPool
+
+from fia_api.db.models.user_conversation_model import UserConversationModel
+from fia_api.db.models.user_model import UserModel
+from fia_api.services.llm.gateway import create_chat_completion
+from fia_api.services.llm.routing import LLMRoute
+from fia_api.settings import settings
+from fia_api.web.api.teacher.prompts import get_prompt_registry
+from fia_api.web.api.teacher.schema import (
+    AnalyzedMessage,
+    AnalyzeMessage,
+    AnalyzeMessagesResponse,
+    BatchLearningMoments,
+    LearningMoments,
+)
+from fia_api.web.api.teacher.token_usage import store_token_usage
+from fia_api.web.api.teacher.utils import (
+    create_conversation,
+    create_flashcards_from_learning_moments,
+)
+
+# Index of the message in the request, and the message.
+IndexedMessage = Tuple[int, str]
+
+
+def is_batch_full(
+    batch: List[IndexedMessage],
+    batch_characters: int,
+    message: str,
+) -> bool:
+    """
+    Whether a message has to start a new batch.
+
+    :param batch: List of (index, message) in the current batch.
+    :param batch_characters: Int number of characters in the current batch.
+    :param message: String message to add.
+    :returns: True if adding the message would make the batch too big.
+    """
+    if len(batch) >= settings.batch_learning_moments_max_messages:
+        return True
+
+    return (
+        batch_characters + len(message) > settings.batch_learning_moments_max_characters
+    )
+
+
+def batch_messages(messages: List[str]) -> List[List[IndexedMessage]]:
+    """
+    Split messages into batches small enough to check in one call.
+
+    :param messages: List of string messages.
+    :returns: List of batches of (index, message).
+    """
+    batches: List[List[IndexedMessage]] = []
+    batch_characters = 0
+
+    for index, message in enumerate(messages):
+        if not batches or is_batch_full(batches[-1], batch_characters, message):
+            batches.append([])
+            batch_characters = 0
+
+        batches[-1].append((index, message))
+        batch_characters += len(message)
+
+    return batches
+
+
+def parse_batch_learning_moments(
+    openai_response: Any,
+    conversation_id: str,
+) -> Optional[BatchLearningMoments]:
+    """
+    Parse the function call arguments of a batch learning moments response.
+
+    :param openai_response: The OpenAI response object.
+    :param conversation_id: String ID of the conversation, to log.
+    :returns: BatchLearningMoments, or None if the response was malformed.
+    """
+    try:
+        openai_message = openai_response.choices[0].message
+        return BatchLearningMoments(
+            **json.loads(openai_message.function_call.arguments, strict=False),
+        )
+    except (AttributeError, TypeError, ValueError):
+        logger.warning(
+            {
+                "message": "Malformed batch learning moments",
+                "conversation_id": conversation_id,
+            },
+        )
+        return None
+
+
+def get_learning_moments_by_index(
+    batch: List[IndexedMessage],
+    batch_learning_moments: BatchLearningMoments,
+) -> Dict[int, LearningMoments]:
+    """
+    Match the LearningMoments in a batch response up with their messages.
+
+    IDs the model made up, or that aren't in the batch, are dropped.
+
+    :param batch: List of (index, message) that were checked.
+    :param batch_learning_moments: BatchLearningMoments of the batch.
+    :returns: Dict of message index -> LearningMoments.
+    """
+    batch_indexes = {str(index) for index, _ in batch}
+
+    return {
+        int(message_learning_moments.id): LearningMoments(
+            learning_moments=message_learning_moments.learning_moments,
+        )
+        for message_learning_moments in batch_learning_moments.messages
+        if message_learning_moments.id in batch_indexes
+    }
+
+
+async def request_batch_learning_moments(
+    batch: List[IndexedMessage],
+    conversation_id: str,
+    language_code: str,
+) -> Dict[int, LearningMoments]:
+    """
+    Ask OpenAI for the LearningMoments of a batch of messages.
+
+    A malformed response is logged and treated as no mistakes.
+
+    :param batch: List of (index, message) to check.
+    :param conversation_id: Store the token usage in the conversation.
+    :param language_code: String ISO 639-1 language code of the messages.
+    :returns: Dict of message index -> LearningMoments.
+    """
+    prompt_definition = get_prompt_registry().batch_learning_moments
+
+    openai_response = await create_chat_completion(
+        route=LLMRoute.BATCH_LEARNING_MOMENTS,
+        messages=[
+            {
+                "role": "system",
+                "content": prompt_definition.get_prompt(language_code),
+            },
+            {
+                "role": "user",
+                "content": json.dumps(
+                    [
+                        {"id": str(index), "message": message}
+                        for index, message in batch
+                    ],
+                    ensure_ascii=False,
+                ),
+            },
+        ],
+        **prompt_definition.get_function_kwargs(),
+    )
+
+    await store_token_usage(conversation_id, openai_response)
+
+    batch_learning_moments = parse_batch_learning_moments(
+        openai_response,
+        conversation_id,
+    )
+    if batch_learning_moments is None:
+        return {}
+
+    return get_learning_moments_by_index(batch, batch_learning_moments)
+
+
+async def get_batch_learning_moments(
+    batch: List[IndexedMessage],
+    conversation_id: str,
+    language_code: str,
+) -> Dict[int, LearningMoments]:
+    """
+    Get the LearningMoments of a batch of messages, or none if that fails.
+
+    Failures are logged rather than raised, so one failed batch doesn't lose
+    the learning moments of the others.
+
+    :param batch: List of (index, message) to check.
+    :param conversation_id: Store the token usage in the conversation.
+    :param language_code: String ISO 639-1 language code of the messages.
+    :returns: Dict of message index -> LearningMoments.
+    """
+    try:
+        return await request_batch_learning_moments(
+            batch,
+            conversation_id,
+            language_code,
+        )
+    except Exception:
+        logger.exception(
+            {
+                "message": "Failed to get batch learning moments",
+                "conversation_id": conversation_id,
+                "message_indexes": [index for index, _ in batch],
+            },
+        )
+        return {}
+
+
+async def find_learning_moments(
+    conversation_id: str,
+    language_code: str,
+    messages: List[AnalyzeMessage],
+) -> Dict[int, LearningMoments]:
+    """
+    Find the LearningMoments in many messages, one OpenAI call per batch.
+
+    The messages of a batch that fails are treated as having no mistakes.
+
+    :param conversation_id: Store the token usage in the conversation.
+    :param language_code: String ISO 639-1 language code of the messages.
+    :param messages: List of AnalyzeMessage to check.
+    :returns: Dict of message index -> LearningMoments, for those with any.
+    """
+    batches = batch_messages([analyze_message.message for analyze_message in messages])
+    batch_results = await asyncio.gather(
+        *[
+            get_batch_learning_moments(batch, conversation_id, language_code)
+            for batch in batches
+        ],
+    )
+
+    return {
+        index: learning_moments
+        for batch_result in batch_results
+        for index, learning_moments in batch_result.items()
+    }
+
+
+def merge_learning_moments(
+    learning_moments_by_index: Dict[int, LearningMoments],
+) -> LearningMoments:
+    """
+    Merge the LearningMoments of many messages, in message order.
+
+    :param learning_moments_by_index: Dict of message index -> LearningMoments.
+    :returns: LearningMoments of every message.
+    """
+    ordered_learning_moments = [
+        learning_moments_by_index[index] for index in sorted(learning_moments_by_index)
+    ]
+
+    return LearningMoments(
+        learning_moments=[
+            learning_moment
+            for message_learning_moments in ordered_learning_moments
+            for learning_moment in message_learning_moments.learning_moments
+        ],
+    )
+
+
+def build_analyzed_messages(
+    messages: List[AnalyzeMessage],
+    learning_moments_by_index: Dict[int, LearningMoments],
+) -> List[AnalyzedMessage]:
+    """
+    Pair each message with its LearningMoments, if it has any.
+
+    :param messages: List of AnalyzeMessage that were checked.
+    :param learning_moments_by_index: Dict of message index -> LearningMoments.
+    :returns: List of AnalyzedMessage, in the same order.
+    """
+    return [
+        AnalyzedMessage(
+            id=analyze_message.id,
+            learning_moments=learning_moments_by_index.get(
+                index,
+                LearningMoments(learning_moments=[]),
+            ),
+        )
+        for index, analyze_message in enumerate(messages)
+    ]
+
+
+async def analyze_messages_in_batches(
+    conversation_id: str,
+    messages: List[AnalyzeMessage],
+    user: UserModel,
+    redis_pool: Optional[ConnectionPool] = None,
+) -> AnalyzeMessagesResponse:
+    """
+    Find the LearningMoments in many messages and store them as flashcards.
+
+    :param conversation_id: String ID of the conversation the messages are
+                            from, or "new" to start a new one.
+    :param messages: List of AnalyzeMessage to check.
+    :param user: UserModel, needed to store flashcards.
+    :param redis_pool: Optional Redis connection pool for caching.
+    :returns: AnalyzeMessagesResponse
+    """
+    if conversation_id == "new":
+        user_conversation_model = await create_conversation(user, redis_pool)
+        conversation_id = str(user_conversation_model.conversation_id)
+    else:
+        user_conversation_model = await UserConversationModel.get(
+            conversation_id=conversation_id,
+        )
+
+    learning_moments_by_index = await find_learning_moments(
+        conversation_id,
+        user_conversation_model.language_code,
+        messages,
+    )
+
+    await create_flashcards_from_learning_moments(
+        merge_learning_moments(learning_moments_by_index),
+        user,
+        conversation_id,
+    )
+
+    return AnalyzeMessagesResponse(
+        conversation_id=conversation_id,
+        messages=build_analyzed_messages(messages, learning_moments_by_index),
+    )
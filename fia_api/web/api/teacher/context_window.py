@@ -0,0 +1,253 @@
+"""
+Keeps the messages sent to OpenAI for long conversations within a budget.
+
+Once a conversation goes over settings.context_window_token_budget, only the
+initial prompt and the most recent turns are sent verbatim. Older messages are
+folded into a rolling summary, which is stored and only regenerated once
+enough new messages have built up behind it. If summarizing fails, the previous
+summary is used, or without one only the recent turns are sent.
+"""
+import uuid
+from typing import Dict, List, Optional
+
+import openai
+from loguru import logger
+
+from fia_api.db.models.conversation_model import ConversationElementRole
+from fia_api.db.models.conversation_summary_model import ConversationSummaryModel
+from fia_api.services.llm.gateway import create_chat_completion
+from fia_api.services.llm.resilience import LLMUnavailableError
+from fia_api.services.llm.routing import LLMRoute
+from fia_api.services.token_usage.accounting import record_token_usage
+from fia_api.settings import settings
+from fia_api.web.api.teacher.token_usage import store_token_usage
+
+# Rough estimate for the languages we support, avoids needing a tokenizer.
+CHARS_PER_TOKEN = 4
+# Tokens OpenAI adds for the role etc. of each message.
+TOKENS_PER_MESSAGE = 4
+
+
+def estimate_tokens(messages: List[Dict[str, str]]) -> int:
+    """
+    Estimate how many prompt tokens a list of messages will use.
+
+    :param messages: List of OpenAI messages.
+    :returns: Int estimated number of tokens.
+    """
+    return sum(
+        TOKENS_PER_MESSAGE + len(message["content"]) // CHARS_PER_TOKEN
+        for message in messages
+    )
+
+
+def format_transcript(messages: List[Dict[str, str]]) -> str:
+    """
+    Format messages as a plain transcript for summarizing.
+
+    :param messages: List of OpenAI messages.
+    :returns: String transcript.
+    """
+    speakers = {
+        ConversationElementRole.USER.value: "Learner",
+        ConversationElementRole.SYSTEM.value: "Fia",
+        ConversationElementRole.ASSISTANT.value: "Fia",
+    }
+
+    return "\n".join(
+        ": ".join((speakers[message["role"]], message["content"]))
+        for message in messages
+    )
+
+
+async def summarize_messages(
+    conversation_id: str,
+    previous_summary: Optional[str],
+    messages: List[Dict[str, str]],
+) -> str:
+    """
+    Fold messages into the rolling summary of a conversation.
+
+    :param conversation_id: String ID of the conversation, to store usage.
+    :param previous_summary: Optional String summary of everything before.
+    :param messages: List of OpenAI messages to add to the summary.
+    :returns: String new summary.
+    """
+    transcript = format_transcript(messages)
+    if previous_summary:
+        transcript = f"Summary so far: {previous_summary}\n\n{transcript}"
+
+    openai_response = await create_chat_completion(
+        route=LLMRoute.CONVERSATION_SUMMARY,
+        messages=[
+            {
+                "role": "system",
+                "content": settings.conversation_summary_prompt,
+            },
+            {
+                "role": "user",
+                "content": transcript,
+            },
+        ],
+    )
+
+    await store_token_usage(conversation_id, openai_response)
+
+    return openai_response.choices[0].message.content  # noqa: WPS219
+
+
+def get_recent_message_count() -> int:
+    """
+    Get how many of the latest messages are always sent verbatim.
+
+    :returns: Int count of the latest user message, and the user message and
+              reply of each recent turn.
+    """
+    return 2 * settings.context_window_recent_turns + 1
+
+
+def needs_context_window(messages: List[Dict[str, str]], full_tokens: int) -> bool:
+    """
+    Whether a conversation is long enough to summarize its older messages.
+
+    :param messages: List of every OpenAI message in the conversation.
+    :param full_tokens: Int estimated tokens of all the messages.
+    :returns: True if the messages are over the budget and there are older
+              messages to summarize.
+    """
+    if not settings.context_window_enabled:
+        return False
+
+    over_budget = full_tokens > settings.context_window_token_budget
+
+    return over_budget and len(messages) > get_recent_message_count() + 1
+
+
+def is_summary_due(
+    summary_model: Optional[ConversationSummaryModel],
+    older_message_count: int,
+) -> bool:
+    """
+    Whether enough older messages have built up to regenerate the summary.
+
+    :param summary_model: Optional stored ConversationSummaryModel.
+    :param older_message_count: Int count of the messages before the recent
+                                turns.
+    :returns: True if the summary should be regenerated.
+    """
+    if summary_model is None:
+        return True
+
+    unsummarized_count = older_message_count - summary_model.summarized_message_count
+
+    return unsummarized_count >= 2 * settings.context_window_summary_interval_turns
+
+
+async def update_summary(
+    conversation_id: str,
+    summary_model: Optional[ConversationSummaryModel],
+    older_messages: List[Dict[str, str]],
+) -> Optional[ConversationSummaryModel]:
+    """
+    Fold the older messages into the stored summary, if it is due.
+
+    If summarizing fails, the conversation carries on with the previous
+    summary, or without one, rather than failing the request.
+
+    :param conversation_id: String ID of the conversation.
+    :param summary_model: Optional stored ConversationSummaryModel.
+    :param older_messages: List of OpenAI messages before the recent turns.
+    :returns: The ConversationSummaryModel to use, or None if there isn't one.
+    """
+    if not is_summary_due(summary_model, len(older_messages)):
+        return summary_model
+
+    summarized_count = summary_model.summarized_message_count if summary_model else 0
+    try:
+        summary = await summarize_messages(
+            conversation_id,
+            summary_model.summary if summary_model else None,
+            older_messages[summarized_count:],
+        )
+    except (LLMUnavailableError, openai.error.OpenAIError):
+        logger.exception(
+            {
+                "message": "Failed to summarize conversation",
+                "conversation_id": conversation_id,
+            },
+        )
+        return summary_model
+
+    summary_model, _ = await ConversationSummaryModel.update_or_create(
+        defaults={
+            "summary": summary,
+            "summarized_message_count": len(older_messages),
+        },
+        conversation_id=uuid.UUID(conversation_id),
+    )
+
+    return summary_model
+
+
+def build_context_window(
+    messages: List[Dict[str, str]],
+    summary_model: Optional[ConversationSummaryModel],
+) -> List[Dict[str, str]]:
+    """
+    Replace the summarized messages of a conversation with their summary.
+
+    :param messages: List of every OpenAI message in the conversation, starting
+                     with the initial prompt.
+    :param summary_model: Optional ConversationSummaryModel. Without one, only
+                          the initial prompt and the recent turns are kept.
+    :returns: List of OpenAI messages.
+    """
+    initial_prompt = messages[0]
+
+    if summary_model is None:
+        return [initial_prompt, *messages[-get_recent_message_count() :]]
+
+    return [
+        initial_prompt,
+        {
+            "role": ConversationElementRole.SYSTEM.value,
+            "content": f"Summary of the earlier conversation: {summary_model.summary}",
+        },
+        *messages[summary_model.summarized_message_count + 1 :],
+    ]
+
+
+async def get_context_window(
+    conversation_id: str,
+    messages: List[Dict[str, str]],
+) -> List[Dict[str, str]]:
+    """
+    Get the messages to actually send to OpenAI for a conversation.
+
+    :param conversation_id: String ID of the conversation.
+    :param messages: List of every OpenAI message in the conversation, starting
+                     with the initial prompt.
+    :returns: List of OpenAI messages within the budget where possible.
+    """
+    full_tokens = estimate_tokens(messages)
+    if not needs_context_window(messages, full_tokens):
+        return messages
+
+    summary_model = await ConversationSummaryModel.get_or_none(
+        conversation_id=uuid.UUID(conversation_id),
+    )
+    summary_model = await update_summary(
+        conversation_id,
+        summary_model,
+        messages[1 : -get_recent_message_count()],
+    )
+    context_window = build_context_window(messages, summary_model)
+
+    await record_token_usage(
+        conversation_id,
+        0,
+        0,
+        saved_prompt_tokens=max(full_tokens - estimate_tokens(context_window), 0),
+    )
+
+    return context_window
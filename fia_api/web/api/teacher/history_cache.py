@@ -0,0 +1,257 @@
+"""
+Cache of conversation histories, so each turn doesn't reload the whole thing.
+
+Redis holds the history of each conversation as a list of OpenAI messages,
+appended to as each new element is written. Each worker keeps its own copy
+of recently used histories in memory and only fetches the elements it is
+missing from Redis. On a Redis miss the history is rebuilt from the DB, and
+only cached if nothing was appended to it meanwhile, as the rebuilt history
+might be missing that message.
+"""
+import json
+import uuid
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from loguru import logger
+from redis.asyncio import ConnectionPool, Redis, RedisError, WatchError
+
+from fia_api.db.models.conversation_model import ConversationElementModel
+from fia_api.settings import settings
+
+HISTORY_CACHE_PREFIX = "conversation_history"
+
+# OpenAI messages of a conversation.
+History = List[Dict[str, str]]
+
+# Most recently used histories in this worker, conversation_id -> messages.
+_local_histories: "OrderedDict[str, History]" = OrderedDict()
+
+
+def get_history_key(conversation_id: str) -> str:
+    """
+    Get the Redis key of a conversation history.
+
+    :param conversation_id: String ID of the conversation.
+    :returns: String Redis key.
+    """
+    return f"{HISTORY_CACHE_PREFIX}:{conversation_id}"
+
+
+def get_appends_key(conversation_id: str) -> str:
+    """
+    Get the Redis key counting appends to a conversation history.
+
+    It's written to even when the history isn't cached, so a rebuild of the
+    history can tell it raced an append.
+
+    :param conversation_id: String ID of the conversation.
+    :returns: String Redis key.
+    """
+    return f"{HISTORY_CACHE_PREFIX}:appends:{conversation_id}"
+
+
+def _store_local_history(
+    conversation_id: str,
+    messages: List[Dict[str, str]],
+) -> None:
+    """
+    Keep a copy of a history in this worker, evicting the least recently used.
+
+    :param conversation_id: String ID of the conversation.
+    :param messages: The OpenAI messages of the conversation.
+    """
+    _local_histories[conversation_id] = messages
+    _local_histories.move_to_end(conversation_id)
+
+    while len(_local_histories) > settings.conversation_history_cache_max_local:
+        _local_histories.popitem(last=False)
+
+
+async def load_conversation_history(conversation_id: str) -> List[Dict[str, str]]:
+    """
+    Load a conversation history from the DB.
+
+    :param conversation_id: String ID of the conversation.
+    :return: List of dicts of shape {"role": EnumValue, "content": "message"}
+    """
+    raw_conversation = await ConversationElementModel.filter(
+        conversation_id=uuid.UUID(conversation_id),
+    ).values()
+
+    return [
+        {
+            "role": conversation_element["role"].value,
+            "content": conversation_element["content"],
+        }
+        for conversation_element in raw_conversation
+    ]
+
+
+async def start_conversation_history(
+    redis_pool: ConnectionPool,
+    conversation_id: str,
+    messages: List[Dict[str, str]],
+) -> None:
+    """
+    Replace the cached history of a conversation.
+
+    :param redis_pool: Redis connection pool.
+    :param conversation_id: String ID of the conversation.
+    :param messages: The OpenAI messages of the conversation.
+    """
+    history_key = get_history_key(conversation_id)
+
+    try:
+        async with Redis(connection_pool=redis_pool) as redis:
+            async with redis.pipeline(transaction=True) as pipe:
+                pipe.delete(history_key)
+                if messages:
+                    pipe.rpush(history_key, *[json.dumps(msg) for msg in messages])
+                pipe.expire(
+                    history_key,
+                    settings.conversation_history_cache_ttl_seconds,
+                )
+                await pipe.execute()
+    except RedisError:
+        logger.exception("Failed to write to the conversation history cache")
+        return
+
+    _store_local_history(conversation_id, list(messages))
+
+
+async def append_conversation_history(
+    redis_pool: ConnectionPool,
+    conversation_id: str,
+    message: Dict[str, str],
+) -> None:
+    """
+    Append a message to the cached history of a conversation.
+
+    Nothing is cached if the history isn't already, it'll be rebuilt from the
+    DB on the next read instead.
+
+    :param redis_pool: Redis connection pool.
+    :param conversation_id: String ID of the conversation.
+    :param message: OpenAI message of shape {"role": ..., "content": ...}.
+    """
+    history_key = get_history_key(conversation_id)
+    appends_key = get_appends_key(conversation_id)
+
+    try:
+        async with Redis(connection_pool=redis_pool) as redis:
+            async with redis.pipeline(transaction=True) as pipe:
+                pipe.rpushx(history_key, json.dumps(message))
+                pipe.incr(appends_key)
+                for appended_key in (history_key, appends_key):
+                    pipe.expire(
+                        appended_key,
+                        settings.conversation_history_cache_ttl_seconds,
+                    )
+                await pipe.execute()
+    except RedisError:
+        logger.exception("Failed to append to the conversation history cache")
+        # The cached history is now missing this message, so drop it.
+        _local_histories.pop(conversation_id, None)
+
+
+async def rebuild_conversation_history(
+    redis_pool: ConnectionPool,
+    conversation_id: str,
+) -> History:
+    """
+    Load a conversation history from the DB, and cache it.
+
+    The history is watched from before it is loaded, and isn't cached if a
+    message was appended meanwhile, as the load might be missing it. The next
+    miss rebuilds it instead.
+
+    :param redis_pool: Redis connection pool.
+    :param conversation_id: String ID of the conversation.
+    :return: List of dicts of shape {"role": EnumValue, "content": "message"}
+    """
+    history_key = get_history_key(conversation_id)
+
+    async with Redis(connection_pool=redis_pool) as redis:
+        async with redis.pipeline(transaction=True) as pipe:
+            await pipe.watch(history_key, get_appends_key(conversation_id))
+            messages = await load_conversation_history(conversation_id)
+
+            pipe.multi()
+            pipe.delete(history_key)
+            if messages:
+                pipe.rpush(history_key, *[json.dumps(msg) for msg in messages])
+            pipe.expire(history_key, settings.conversation_history_cache_ttl_seconds)
+            try:
+                await pipe.execute()
+            except WatchError:
+                logger.info(
+                    {
+                        "message": "Conversation history appended to while rebuilt",
+                        "conversation_id": conversation_id,
+                    },
+                )
+                return messages
+
+    _store_local_history(conversation_id, list(messages))
+
+    return messages
+
+
+async def _fetch_history(
+    redis_pool: ConnectionPool,
+    conversation_id: str,
+    local_history: History,
+) -> Optional[History]:
+    """
+    Fetch the history of a conversation from Redis, on top of the local copy.
+
+    :param redis_pool: Redis connection pool.
+    :param conversation_id: String ID of the conversation.
+    :param local_history: List of the messages this worker already has.
+    :return: List of messages, or None if Redis doesn't have the history.
+    """
+    history_key = get_history_key(conversation_id)
+
+    async with Redis(connection_pool=redis_pool) as redis:
+        history_length = await redis.llen(history_key)
+        if not history_length or history_length < len(local_history):
+            return None
+
+        # Only fetch what was appended since this worker last looked.
+        raw_new_messages = await redis.lrange(history_key, len(local_history), -1)
+
+    return local_history + [json.loads(raw_message) for raw_message in raw_new_messages]
+
+
+async def get_conversation_history(
+    redis_pool: ConnectionPool,
+    conversation_id: str,
+) -> History:
+    """
+    Get the history of a conversation without touching the DB if possible.
+
+    :param redis_pool: Redis connection pool.
+    :param conversation_id: String ID of the conversation.
+    :return: List of dicts of shape {"role": EnumValue, "content": "message"}
+    """
+    try:
+        cached_messages = await _fetch_history(
+            redis_pool,
+            conversation_id,
+            _local_histories.get(conversation_id, []),
+        )
+    except RedisError:
+        logger.exception("Failed to read the conversation history cache")
+        return await load_conversation_history(conversation_id)
+
+    if cached_messages is not None:
+        _store_local_history(conversation_id, cached_messages)
+        return list(cached_messages)
+
+    try:
+        return await rebuild_conversation_history(redis_pool, conversation_id)
+    except RedisError:
+        logger.exception("Failed to rebuild the conversation history cache")
+
+    return await load_conversation_history(conversation_id)
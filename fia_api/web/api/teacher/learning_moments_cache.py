@@ -0,0 +1,212 @@
+"""
+Redis cache of LearningMoments, so repeated messages skip the LLM call.
+
+Entries are content addressed by language code, prompt version and the
+normalized message. Each entry has a TTL, and the number of entries is capped
+by evicting the least recently used ones.
+"""
+import hashlib
+import json
+import re
+import time
+import unicodedata
+from typing import Any, Dict, Optional
+
+from loguru import logger
+from redis.asyncio import ConnectionPool, Redis, RedisError
+
+from fia_api.settings import settings
+from fia_api.web.api.teacher.schema import LearningMoments, LearningMomentsCacheStats
+
+CACHE_PREFIX = "learning_moments_cache"
+# Sorted set of every cached key, scored by when it was last used.
+CACHE_INDEX_KEY = f"{CACHE_PREFIX}:index"
+CACHE_STATS_KEY = f"{CACHE_PREFIX}:stats"
+
+
+def normalize_message(message: str) -> str:
+    """
+    Normalize a message so trivially different copies share a cache entry.
+
+    Case is left alone, as capitalisation can be the mistake (e.g. German
+    nouns).
+
+    :param message: String message from the user.
+    :returns: String normalized message.
+    """
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", message)).strip()
+
+
+def get_cache_key(language_code: str, prompt_version: str, message: str) -> str:
+    """
+    Get the cache key for the LearningMoments of a message.
+
+    :param language_code: String ISO 639-1 language code of the conversation.
+    :param prompt_version: String version of the learning moments prompt.
+    :param message: String message from the user.
+    :returns: String Redis key.
+    """
+    message_hash = hashlib.sha256(
+        normalize_message(message).encode("utf-8"),
+    ).hexdigest()
+
+    return f"{CACHE_PREFIX}:{language_code}:{prompt_version}:{message_hash}"
+
+
+def is_cacheable(message: str) -> bool:
+    """
+    Only short messages are likely to be repeated, so only cache those.
+
+    :param message: String message from the user.
+    :returns: True if the message should be cached.
+    """
+    return (
+        settings.learning_moments_cache_enabled
+        and len(normalize_message(message))
+        <= settings.learning_moments_cache_max_message_length
+    )
+
+
+async def get_cached_learning_moments(
+    redis_pool: ConnectionPool,
+    language_code: str,
+    prompt_version: str,
+    message: str,
+) -> Optional[LearningMoments]:
+    """
+    Get the cached LearningMoments for a message, counting the hit or miss.
+
+    :param redis_pool: Redis connection pool.
+    :param language_code: String ISO 639-1 language code of the conversation.
+    :param prompt_version: String version of the learning moments prompt.
+    :param message: String message from the user.
+    :returns: LearningMoments if cached, otherwise None.
+    """
+    cache_key = get_cache_key(language_code, prompt_version, message)
+
+    try:
+        async with Redis(connection_pool=redis_pool) as redis:
+            cached_value = await redis.get(cache_key)
+
+            if cached_value is None:
+                await redis.hincrby(CACHE_STATS_KEY, "misses", 1)
+                return None
+
+            cached_entry = json.loads(cached_value)
+
+            async with redis.pipeline(transaction=False) as pipe:
+                pipe.zadd(CACHE_INDEX_KEY, {cache_key: time.time()})
+                pipe.hincrby(CACHE_STATS_KEY, "hits", 1)
+                pipe.hincrby(
+                    CACHE_STATS_KEY,
+                    "saved_prompt_tokens",
+                    cached_entry["prompt_tokens"],
+                )
+                pipe.hincrby(
+                    CACHE_STATS_KEY,
+                    "saved_completion_tokens",
+                    cached_entry["completion_tokens"],
+                )
+                await pipe.execute()
+    except RedisError:
+        logger.exception("Failed to read the learning moments cache")
+        return None
+
+    return LearningMoments(**cached_entry["learning_moments"])
+
+
+async def _store_entry(
+    redis: Redis,
+    cache_key: str,
+    cached_entry: Dict[str, Any],
+) -> int:
+    """
+    Store a cache entry and index it, forgetting keys that have expired.
+
+    :param redis: Redis client.
+    :param cache_key: String key from get_cache_key.
+    :param cached_entry: Dict of the entry to store as JSON.
+    :returns: Int number of entries in the cache.
+    """
+    async with redis.pipeline(transaction=False) as pipe:
+        pipe.set(
+            cache_key,
+            json.dumps(cached_entry),
+            ex=settings.learning_moments_cache_ttl_seconds,
+        )
+        pipe.zadd(CACHE_INDEX_KEY, {cache_key: time.time()})
+        pipe.zremrangebyscore(
+            CACHE_INDEX_KEY,
+            0,
+            time.time() - settings.learning_moments_cache_ttl_seconds,
+        )
+        pipe.zcard(CACHE_INDEX_KEY)
+        pipe_results = await pipe.execute()
+
+    return pipe_results[-1]
+
+
+async def _evict_overflow(redis: Redis, cache_size: int) -> None:
+    """
+    Evict the least recently used entries over the cap.
+
+    :param redis: Redis client.
+    :param cache_size: Int number of entries in the cache.
+    """
+    overflow = cache_size - settings.learning_moments_cache_max_entries
+    if overflow > 0:
+        evicted = await redis.zpopmin(CACHE_INDEX_KEY, overflow)
+        await redis.delete(*[evicted_key for evicted_key, _ in evicted])
+
+
+async def cache_learning_moments(  # noqa: WPS211
+    redis_pool: ConnectionPool,
+    language_code: str,
+    prompt_version: str,
+    message: str,
+    learning_moments: LearningMoments,
+    token_usage: Dict[str, int],
+) -> None:
+    """
+    Cache the LearningMoments for a message, evicting old entries if full.
+
+    :param redis_pool: Redis connection pool.
+    :param language_code: String ISO 639-1 language code of the conversation.
+    :param prompt_version: String version of the learning moments prompt.
+    :param message: String message from the user.
+    :param learning_moments: The LearningMoments to cache.
+    :param token_usage: The OpenAI usage of the call, used to report savings.
+    """
+    cache_key = get_cache_key(language_code, prompt_version, message)
+    cached_entry = {
+        "learning_moments": learning_moments.model_dump(),
+        "prompt_tokens": token_usage["prompt_tokens"],
+        "completion_tokens": token_usage["completion_tokens"],
+    }
+
+    try:
+        async with Redis(connection_pool=redis_pool) as redis:
+            cache_size = await _store_entry(redis, cache_key, cached_entry)
+            await _evict_overflow(redis, cache_size)
+    except RedisError:
+        logger.exception("Failed to write to the learning moments cache")
+
+
+async def get_cache_stats(redis_pool: ConnectionPool) -> LearningMomentsCacheStats:
+    """
+    Get the hit/miss counters of the cache, and the tokens it has saved.
+
+    :param redis_pool: Redis connection pool.
+    :returns: LearningMomentsCacheStats
+    """
+    async with Redis(connection_pool=redis_pool) as redis:
+        raw_stats = await redis.hgetall(CACHE_STATS_KEY)
+        entries = await redis.zcard(CACHE_INDEX_KEY)
+
+    return LearningMomentsCacheStats(
+        entries=entries,
+        **{
+            stat_name.decode(): int(stat_value)
+            for stat_name, stat_value in raw_stats.items()
+        },
+    )
@@ -0,0 +1,286 @@
+"""
+Pool of ready made greetings to start new conversations with.
+
+Each language in language_code_map gets a Redis list of openers, generated in
+the background with the conversation_opener prompt. The key includes the
+prompt version, so openers from an old prompt are never served.
+
+A new conversation that starts with a short greeting is answered with an
+opener from the pool, so the user only waits on the learning moments of their
+first message rather than on a conversation continuation too.
+
+Every worker runs the refiller, but each refill is claimed with a Redis lock,
+so only one of them tops up the pools at a time.
+"""
+import asyncio
+import json
+from typing import List, Optional
+
+from fastapi import FastAPI
+from loguru import logger
+from redis.asyncio import ConnectionPool, Redis, RedisError
+
+from fia_api.services.llm.gateway import create_chat_completion
+from fia_api.services.llm.routing import LLMRoute
+from fia_api.settings import settings
+from fia_api.web.api.teacher.prompts import get_prompt_registry, language_code_map
+from fia_api.web.api.teacher.schema import (
+    ConversationContinuation,
+    ConversationOpenerPoolStats,
+)
+
+OPENER_POOL_PREFIX = "conversation_openers"
+OPENER_POOL_STATS_KEY = f"{OPENER_POOL_PREFIX}:stats"
+OPENER_POOL_REFILL_LOCK_KEY = f"{OPENER_POOL_PREFIX}:refill_lock"
+
+
+def get_opener_pool_key(language_code: str) -> str:
+    """
+    Get the key of the pool for a language.
+
+    :param language_code: String ISO 639-1 language code.
+    :returns: String Redis key.
+    """
+    prompt_version = get_prompt_registry().conversation_opener.version
+
+    return f"{OPENER_POOL_PREFIX}:{language_code}:{prompt_version}"
+
+
+def is_opener_eligible(message: str) -> bool:
+    """
+    Whether a first message is short enough to be answered from the pool.
+
+    :param message: String first message from the user.
+    :returns: True if an opener may be used as the reply.
+    """
+    return (
+        settings.conversation_opener_pool_enabled
+        and len(message.strip()) <= settings.conversation_opener_max_message_characters
+    )
+
+
+async def generate_opener(language_code: str) -> str:
+    """
+    Ask OpenAI for an opener.
+
+    The usage isn't tied to any conversation, so isn't recorded.
+
+    :param language_code: String ISO 639-1 language code.
+    :returns: String opener.
+    """
+    prompt_definition = get_prompt_registry().conversation_opener
+
+    openai_response = await create_chat_completion(
+        route=LLMRoute.SHORT_CONVERSATION_CONTINUATION,
+        messages=[
+            {
+                "role": "system",
+                "content": prompt_definition.get_prompt(language_code),
+            },
+        ],
+        **prompt_definition.get_function_kwargs(),
+    )
+
+    return ConversationContinuation(
+        **json.loads(
+            openai_response.choices[0].message.function_call.arguments,  # noqa: WPS219
+            strict=False,
+        ),
+    ).message
+
+
+async def generate_openers(language_code: str, count: int) -> List[str]:
+    """
+    Ask OpenAI for several openers at once, dropping any that fail.
+
+    :param language_code: String ISO 639-1 language code.
+    :param count: Int number of openers to ask for.
+    :returns: List of String openers.
+    """
+    openers = await asyncio.gather(
+        *[generate_opener(language_code) for _ in range(count)],
+        return_exceptions=True,
+    )
+
+    return [opener for opener in openers if isinstance(opener, str)]
+
+
+async def push_openers(
+    redis_pool: ConnectionPool,
+    pool_key: str,
+    openers: List[str],
+) -> None:
+    """
+    Add openers to a pool, without going over settings.conversation_opener_pool_size.
+
+    :param redis_pool: Redis connection pool.
+    :param pool_key: String key from get_opener_pool_key.
+    :param openers: List of String openers to add.
+    """
+    async with Redis(connection_pool=redis_pool) as redis:
+        async with redis.pipeline(transaction=True) as pipe:
+            pipe.rpush(pool_key, *openers)
+            # Refills normally only run in one worker, but a slow one can
+            # overlap the next.
+            pipe.ltrim(pool_key, 0, settings.conversation_opener_pool_size - 1)
+            await pipe.execute()
+
+
+async def refill_opener_pool(redis_pool: ConnectionPool, language_code: str) -> int:
+    """
+    Top up the pool of a language to settings.conversation_opener_pool_size.
+
+    :param redis_pool: Redis connection pool.
+    :param language_code: String ISO 639-1 language code.
+    :returns: Int number of openers added.
+    """
+    pool_key = get_opener_pool_key(language_code)
+
+    async with Redis(connection_pool=redis_pool) as redis:
+        missing = settings.conversation_opener_pool_size - await redis.llen(pool_key)
+
+    if missing <= 0:
+        return 0
+
+    new_openers = await generate_openers(language_code, missing)
+    if new_openers:
+        await push_openers(redis_pool, pool_key, new_openers)
+
+    return len(new_openers)
+
+
+async def claim_opener_pool_refill(redis_pool: ConnectionPool) -> bool:
+    """
+    Claim the next refill of the pools, so only one worker makes it.
+
+    The claim is taken with SET NX PX and expires after
+    settings.conversation_opener_refill_interval_seconds rather than being
+    released, so a worker that dies holding it only delays one refill.
+
+    :param redis_pool: Redis connection pool.
+    :returns: True if this worker should refill the pools.
+    """
+    async with Redis(connection_pool=redis_pool) as redis:
+        claimed = await redis.set(
+            OPENER_POOL_REFILL_LOCK_KEY,
+            1,
+            nx=True,
+            px=int(settings.conversation_opener_refill_interval_seconds * 1000),
+        )
+
+    return bool(claimed)
+
+
+async def refill_opener_pools(redis_pool: ConnectionPool) -> int:
+    """
+    Top up the pool of every language.
+
+    :param redis_pool: Redis connection pool.
+    :returns: Int number of openers added.
+    """
+    added = await asyncio.gather(
+        *[
+            refill_opener_pool(redis_pool, language_code)
+            for language_code in language_code_map
+        ],
+    )
+
+    return sum(added)
+
+
+async def take_opener(redis_pool: ConnectionPool, language_code: str) -> Optional[str]:
+    """
+    Take an opener from the pool, counting the hit or miss.
+
+    :param redis_pool: Redis connection pool.
+    :param language_code: String ISO 639-1 language code.
+    :returns: String opener, or None if the pool is empty.
+    """
+    try:
+        async with Redis(connection_pool=redis_pool) as redis:
+            opener = await redis.lpop(get_opener_pool_key(language_code))
+            await redis.hincrby(
+                OPENER_POOL_STATS_KEY,
+                "misses" if opener is None else "hits",
+                1,
+            )
+    except RedisError:
+        logger.exception("Failed to take a conversation opener")
+        return None
+
+    if opener is None:
+        return None
+
+    return opener.decode()
+
+
+async def get_opener_pool_stats(
+    redis_pool: ConnectionPool,
+) -> ConversationOpenerPoolStats:
+    """
+    Get how many openers are ready for each language, and the hit rate.
+
+    :param redis_pool: Redis connection pool.
+    :returns: ConversationOpenerPoolStats
+    """
+    async with Redis(connection_pool=redis_pool) as redis:
+        depths = {
+            language_code: await redis.llen(get_opener_pool_key(language_code))
+            for language_code in language_code_map
+        }
+        raw_stats = await redis.hgetall(OPENER_POOL_STATS_KEY)
+
+    hits = int(raw_stats.get(b"hits", 0))
+    misses = int(raw_stats.get(b"misses", 0))
+
+    return ConversationOpenerPoolStats(
+        depths=depths,
+        hits=hits,
+        misses=misses,
+        hit_rate=hits / (hits + misses) if hits + misses else 0,
+    )
+
+
+async def run_opener_pool_refiller(
+    redis_pool: ConnectionPool,
+) -> None:  # pragma: no cover
+    """
+    Periodically refill the opener pools, if no other worker is.
+
+    :param redis_pool: Redis connection pool.
+    """
+    while True:  # noqa: WPS457
+        try:
+            if await claim_opener_pool_refill(redis_pool):
+                await refill_opener_pools(redis_pool)
+        except Exception:
+            logger.exception("Conversation opener refiller failed")
+
+        await asyncio.sleep(settings.conversation_opener_refill_interval_seconds)
+
+
+def init_opener_pool(app: FastAPI) -> None:  # pragma: no cover
+    """
+    Starts refilling the opener pools if they are enabled.
+
+    Must run after the Redis pool is created.
+
+    :param app: current fastapi application.
+    """
+    app.state.opener_pool_refiller = None
+
+    if settings.conversation_opener_pool_enabled:
+        app.state.opener_pool_refiller = asyncio.create_task(
+            run_opener_pool_refiller(app.state.redis_pool),
+        )
+
+
+async def shutdown_opener_pool(app: FastAPI) -> None:  # pragma: no cover
+    """
+    Stops refilling the opener pools.
+
+    :param app: current FastAPI app.
+    """
+    if app.state.opener_pool_refiller is not None:
+        app.state.opener_pool_refiller.cancel()
+        await asyncio.gather(app.state.opener_pool_refiller, return_exceptions=True)
@@ -0,0 +1,175 @@
+"""
+Registry of the prompts and function specs sent to OpenAI.
+
+Everything is built once (at startup) rather than per request, and each
+prompt carries a version hash that changes whenever the prompt, its function
+spec or the model it is routed to changes. Store the version alongside
+anything generated with a prompt, and use it in cache keys.
+"""
+import functools
+import hashlib
+import json
+from typing import Any, Dict, Optional
+
+from pydantic import BaseModel
+
+from fia_api.services.llm.routing import LLMRoute, get_route_model
+from fia_api.settings import settings
+from fia_api.web.api.teacher.schema import (
+    BatchLearningMoments,
+    ConversationContinuation,
+    LearningMoments,
+)
+
+# Hex characters of the hash kept as a prompt's version.
+PROMPT_VERSION_LENGTH = 12
+
+language_code_map = {
+    "de": {
+        "language": "German",
+    },
+    "fr": {
+        "language": "French",
+    },
+    "it": {
+        "language": "Italian",
+    },
+    "es": {
+        "language": "Spanish",
+    },
+    "nl": {
+        "language": "Dutch",
+    },
+}
+
+
+class PromptDefinition(BaseModel):
+    """A prompt formatted for every language, and the function to call."""
+
+    version: str
+    # Language code -> formatted prompt.
+    prompts: Dict[str, str]
+    function: Optional[Dict[str, Any]] = None
+
+    def get_prompt(self, language_code: str) -> str:
+        """
+        Returns the prompt formatted for the language.
+
+        :param language_code: String ISO 639-1 language code
+        :returns: String of the prompt
+        """
+        return self.prompts[language_code]
+
+    def get_function_kwargs(self) -> Dict[str, Any]:
+        """
+        Returns the kwargs for OpenAI to call this prompt's function.
+
+        :returns: Dict of the functions and function_call kwargs.
+        """
+        if self.function is None:
+            return {}
+
+        return {
+            "functions": [self.function],
+            "function_call": {"name": self.function["name"]},
+        }
+
+
+class PromptRegistry(BaseModel):
+    """Every prompt used by the Teacher."""
+
+    learning_moments: PromptDefinition
+    batch_learning_moments: PromptDefinition
+    conversation_continuation: PromptDefinition
+    conversation_opener: PromptDefinition
+
+
+def build_prompt_definition(
+    prompt_template: str,
+    route: LLMRoute,
+    function: Optional[Dict[str, Any]] = None,
+) -> PromptDefinition:
+    """
+    Format a prompt for every language and work out its version.
+
+    :param prompt_template: String prompt with a {language} placeholder.
+    :param route: LLMRoute the prompt is sent on.
+    :param function: Optional function spec for the model to call.
+    :returns: PromptDefinition
+    """
+    version_source = json.dumps(
+        {
+            "model": get_route_model(route),
+            "prompt": prompt_template,
+            "function": function,
+        },
+        sort_keys=True,
+    )
+
+    return PromptDefinition(
+        version=hashlib.sha256(version_source.encode("utf-8")).hexdigest()[
+            :PROMPT_VERSION_LENGTH
+        ],
+        prompts={
+            language_code: prompt_template.format(language=language["language"])
+            for language_code, language in language_code_map.items()
+        },
+        function=function,
+    )
+
+
+@functools.lru_cache
+def get_prompt_registry() -> PromptRegistry:
+    """
+    Returns the PromptRegistry, building it the first time.
+
+    :returns: PromptRegistry
+    """
+    return PromptRegistry(
+        learning_moments=build_prompt_definition(
+            settings.get_learning_moments_prompt,
+            LLMRoute.LEARNING_MOMENTS,
+            {
+                "name": "get_learning_moments",
+                "description": "List all of the mistakes in the user's message and any words in the user message that they would like translated.",  # noqa: E501
+                "parameters": LearningMoments.model_json_schema(),
+            },
+        ),
+        batch_learning_moments=build_prompt_definition(
+            "\n\n".join(
+                [
+                    settings.get_learning_moments_prompt,
+                    settings.batch_learning_moments_prompt,
+                ],
+            ),
+            LLMRoute.BATCH_LEARNING_MOMENTS,
+            {
+                "name": "get_batch_learning_moments",
+                "description": "List all of the mistakes in each of the user's messages.",  # noqa: E501
+                "parameters": BatchLearningMoments.model_json_schema(),
+            },
+        ),
+        conversation_continuation=build_prompt_definition(
+            settings.conversation_continuation_prompt,
+            LLMRoute.CONVERSATION_CONTINUATION,
+            {
+                "name": "get_conversation_response",
+                "description": "Get the conversational response to the user's message.",
+                "parameters": ConversationContinuation.model_json_schema(),
+            },
+        ),
+        conversation_opener=build_prompt_definition(
+            "\n\n".join(
+                [
+                    settings.conversation_continuation_prompt,
+                    settings.conversation_opener_prompt,
+                ],
+            ),
+            LLMRoute.SHORT_CONVERSATION_CONTINUATION,
+            {
+                "name": "get_conversation_response",
+                "description": "Get the conversational response to the user's message.",
+                "parameters": ConversationContinuation.model_json_schema(),
+            },
+        ),
+    )
@@ -1,8 +1,10 @@
-from typing import Any, List, Optional, Union
+from typing import Any, Dict, List, Optional, Union
 
 from fastapi import UploadFile
 from pydantic import BaseModel, Field
 
+from fia_api.settings import settings
+
 
 # OpenAI Related Response Models:
 class Mistake(BaseModel):
@@ -47,6 +49,27 @@ class LearningMoments(BaseModel):
     )
 
 
+class MessageLearningMoments(BaseModel):
+    """The LearningMoments of one message in a batch."""
+
+    id: str = Field(description="The id of the message")
+    learning_moments: List[LearningMoment] = Field(
+        description=(
+            "A list of language learning mistakes in the message. There "
+            "should be one LearningMoment per individual mistake."
+        ),
+    )
+
+
+# This is returned by the model looking for mistakes in a batch of messages.
+class BatchLearningMoments(BaseModel):
+    """The LearningMoments of every message in a batch."""
+
+    messages: List[MessageLearningMoments] = Field(
+        description="The learning moments of each message, by message id.",
+    )
+
+
 # This is returned by the model trying to continue on the conversation with the
 # user in an educational way.
 class ConversationContinuation(BaseModel):
@@ -77,6 +100,37 @@ class TeacherConverseRequest(BaseModel):
     message: str
 
 
+class AnalyzeMessage(BaseModel):
+    """A message to look for mistakes in, with an ID chosen by the client."""
+
+    id: str
+    message: str
+
+
+class AnalyzeMessagesRequest(BaseModel):
+    """Request object for calls to the analyze-messages endpoint."""
+
+    # If conversation_id is "new", then start a new conversation.
+    conversation_id: str
+    messages: List[AnalyzeMessage] = Field(
+        max_length=settings.batch_learning_moments_max_request_messages,
+    )
+
+
+class AnalyzedMessage(BaseModel):
+    """The LearningMoments found in one message."""
+
+    id: str
+    learning_moments: LearningMoments
+
+
+class AnalyzeMessagesResponse(BaseModel):
+    """Response from the analyze-messages endpoint."""
+
+    conversation_id: str
+    messages: List[AnalyzedMessage]
+
+
 class ConversationSnippet(BaseModel):
     """A simple preview of a conversation."""
 
@@ -112,6 +166,72 @@ class ConverseResponse(BaseModel):
     learning_moments: LearningMoments
     input_message: str
     conversation_response: str
+    # Fetch the audio of conversation_response by this handle. Only set with
+    # settings.tts_prewarm_enabled.
+    audio_handle: Optional[str] = None
+
+
+class ReplyOptions(BaseModel):
+    """How to reply to a message in a conversation."""
+
+    # ISO 639-1 language code of the conversation, looked up if not given.
+    language_code: Optional[str] = None
+    # Reply with this, instead of asking OpenAI.
+    opener: Optional[str] = None
+    # Synthesize the audio of the reply, and return a handle to fetch it by.
+    prewarm_reply_audio: bool = False
+
+
+class Reply(BaseModel):
+    """A reply to a message in a conversation."""
+
+    message: str
+    # Fetch the audio of the reply by this handle, with
+    # ReplyOptions.prewarm_reply_audio.
+    audio_handle: Optional[str] = None
+
+
+class ConverseStreamToken(BaseModel):
+    """A single token of the reply from the streaming Converse endpoint."""
+
+    token: str
+
+
+class ConverseStreamError(BaseModel):
+    """Sent by the streaming Converse endpoint if the reply can't be finished."""
+
+    detail: str
+
+
+class LearningMomentsCacheStats(BaseModel):
+    """Counters for the learning moments cache."""
+
+    entries: int = 0
+    hits: int = 0
+    misses: int = 0
+    # Tokens the cache hits would have cost if sent to OpenAI.
+    saved_prompt_tokens: int = 0
+    saved_completion_tokens: int = 0
+
+
+class ConversationOpenerPoolStats(BaseModel):
+    """Depth and hit rate of the conversation opener pool."""
+
+    # Language code -> number of openers ready.
+    depths: Dict[str, int]
+    hits: int = 0
+    misses: int = 0
+    hit_rate: float = 0
+
+
+class ConversationTokenUsage(BaseModel):
+    """Token usage of a conversation."""
+
+    conversation_id: str
+    prompt_token_usage: int
+    completion_token_usage: int
+    # Estimated prompt tokens not sent thanks to summarizing the conversation.
+    saved_prompt_token_usage: int
 
 
 class GetAudioRequest(BaseModel):
@@ -122,6 +242,13 @@ class GetAudioRequest(BaseModel):
     # TODO: Add features like language and speaker type?
 
 
+class AudioHandleSpec(BaseModel):
+    """The audio an audio handle is for."""
+
+    text: str
+    language_code: str
+
+
 class ConverseWithAudioRequest(BaseModel):
     """Request object for an audio file."""
 
@@ -0,0 +1,291 @@
+"""
+Conversing with the reply streamed as Server-Sent Events.
+
+The reply is streamed token by token as it is generated, without a function
+call, and the learning moments of the user's message are sent as soon as they
+are ready. The reply is stored when the stream closes, however it ends, so a
+client disconnecting never leaves the user's message without a reply.
+"""
+import asyncio
+from contextlib import aclosing
+from typing import AsyncGenerator, AsyncIterator, List, Optional, Tuple
+
+from loguru import logger
+from pydantic import BaseModel
+from redis.asyncio import ConnectionPool
+
+from fia_api.db.models.conversation_model import ConversationElementRole
+from fia_api.db.models.user_model import UserModel
+from fia_api.services.llm.gateway import stream_chat_completion
+from fia_api.services.llm.resilience import LLMUnavailableError
+from fia_api.services.llm.routing import get_continuation_route
+from fia_api.services.token_usage.accounting import record_token_usage
+from fia_api.settings import settings
+from fia_api.web.api.teacher.audio import prewarm_audio
+from fia_api.web.api.teacher.context_window import estimate_tokens, get_context_window
+from fia_api.web.api.teacher.schema import (
+    ConverseResponse,
+    ConverseStreamError,
+    ConverseStreamToken,
+    LearningMoments,
+)
+from fia_api.web.api.teacher.utils import (
+    create_conversation,
+    create_conversation_element,
+    get_and_store_learning_moments,
+    get_conversation_language_code,
+    get_messages_from_conversation_id,
+)
+
+
+async def stream_conversation_continuation(
+    conversation_id: str,
+    redis_pool: Optional[ConnectionPool] = None,
+) -> AsyncIterator[str]:
+    """
+    Continue the conversation with the user, streaming the reply.
+
+    Unlike get_conversation_continuation this doesn't use a function call, as
+    the arguments of one can't be shown to the user until they're complete.
+
+    The conversation in the DB must be updated with the most recent user
+    message.
+
+    :param conversation_id: String conversation to continue on.
+    :param redis_pool: Optional Redis connection pool for caching.
+    :yields: String tokens of the reply as they are generated.
+    """
+    completion_tokens = 0
+    messages = await get_context_window(
+        conversation_id,
+        await get_messages_from_conversation_id(conversation_id, redis_pool),
+    )
+
+    reply_tokens = stream_chat_completion(
+        route=get_continuation_route(messages[-1]["content"]),
+        messages=messages,
+    )
+    async for token in reply_tokens:
+        completion_tokens += 1
+        yield token
+
+    # Streamed responses don't include usage, but OpenAI sends one token per
+    # chunk, and the prompt is estimated the same way as for the context window.
+    await record_token_usage(
+        conversation_id,
+        estimate_tokens(messages),
+        completion_tokens,
+    )
+
+
+def format_sse_event(event: str, data: BaseModel) -> str:
+    """
+    Format a Server-Sent Event.
+
+    :param event: String name of the event.
+    :param data: Pydantic model to send as the JSON data of the event.
+    :returns: String of the event, ready to be written to the stream.
+    """
+    return f"event: {event}\ndata: {data.model_dump_json()}\n\n"
+
+
+async def resolve_conversation(
+    conversation_id: str,
+    user: UserModel,
+    redis_pool: Optional[ConnectionPool] = None,
+) -> Tuple[str, str]:
+    """
+    Get the ID and language of a conversation, creating it if it's new.
+
+    :param conversation_id: String ID of the conversation, or "new" to start a
+                            new one.
+    :param user: The user the conversation is with. For a new conversation,
+                 fetch it with select_related("user_details").
+    :param redis_pool: Optional Redis connection pool for caching.
+    :returns: Tuple of the string conversation ID and ISO 639-1 language code.
+    """
+    if conversation_id != "new":
+        return conversation_id, await get_conversation_language_code(
+            conversation_id,
+        )
+
+    user_conversation_model = await create_conversation(user, redis_pool)
+
+    return (
+        str(user_conversation_model.conversation_id),
+        user_conversation_model.language_code,
+    )
+
+
+async def stream_reply_events(
+    conversation_id: str,
+    redis_pool: Optional[ConnectionPool],
+    learning_moments_task: "asyncio.Task[LearningMoments]",
+    reply_tokens: List[str],
+) -> AsyncGenerator[str, None]:
+    """
+    Stream the reply, and the learning moments as soon as they're ready.
+
+    :param conversation_id: String ID representing the conversation.
+    :param redis_pool: Optional Redis connection pool for caching.
+    :param learning_moments_task: Task getting the LearningMoments of the
+                                  user's message.
+    :param reply_tokens: List the tokens of the reply are appended to.
+    :yields: String "token" and "learning_moments" Server-Sent Events.
+    """
+    learning_moments_sent = False
+
+    async for token in stream_conversation_continuation(conversation_id, redis_pool):
+        reply_tokens.append(token)
+        yield format_sse_event("token", ConverseStreamToken(token=token))
+
+        if not learning_moments_sent and learning_moments_task.done():
+            learning_moments_sent = True
+            yield format_sse_event("learning_moments", learning_moments_task.result())
+
+    if not learning_moments_sent:
+        yield format_sse_event("learning_moments", await learning_moments_task)
+
+
+async def store_reply(
+    conversation_id: str,
+    reply_tokens: List[str],
+    redis_pool: Optional[ConnectionPool],
+) -> None:
+    """
+    Store as much of the reply as was streamed, if any of it was.
+
+    :param conversation_id: String ID representing the conversation.
+    :param reply_tokens: List of the tokens of the reply.
+    :param redis_pool: Optional Redis connection pool for caching.
+    """
+    if reply_tokens:
+        await create_conversation_element(
+            conversation_id,
+            ConversationElementRole.SYSTEM,
+            "".join(reply_tokens),
+            redis_pool,
+        )
+
+
+async def stream_reply(
+    conversation_id: str,
+    message: str,
+    language_code: str,
+    redis_pool: Optional[ConnectionPool],
+    learning_moments_task: "asyncio.Task[LearningMoments]",
+) -> AsyncGenerator[str, None]:
+    """
+    Stream the reply to a stored message, storing the reply when it ends.
+
+    :param conversation_id: String ID representing the conversation.
+    :param message: String message the user sent.
+    :param language_code: String ISO 639-1 language code of the conversation.
+    :param redis_pool: Optional Redis connection pool for caching.
+    :param learning_moments_task: Task getting the LearningMoments of the
+                                  user's message.
+    :yields: String Server-Sent Events.
+    """
+    reply_tokens: List[str] = []
+    reply_events = stream_reply_events(
+        conversation_id,
+        redis_pool,
+        learning_moments_task,
+        reply_tokens,
+    )
+    try:
+        async with aclosing(reply_events):
+            async for reply_event in reply_events:
+                yield reply_event
+    except LLMUnavailableError as exc:
+        # The response has already started, so it can't become a 503.
+        yield format_sse_event("error", ConverseStreamError(detail=str(exc)))
+        return
+    finally:
+        # Even if the stream fails or the client disconnects, so the next turn
+        # never sees two user messages in a row.
+        await asyncio.shield(store_reply(conversation_id, reply_tokens, redis_pool))
+
+    conversation_response = "".join(reply_tokens)
+    yield format_sse_event(
+        "done",
+        ConverseResponse(
+            conversation_id=conversation_id,
+            learning_moments=learning_moments_task.result(),
+            input_message=message,
+            conversation_response=conversation_response,
+            audio_handle=(
+                await prewarm_audio(conversation_response, language_code, redis_pool)
+                if settings.tts_prewarm_enabled
+                else None
+            ),
+        ),
+    )
+
+
+async def stream_response(
+    conversation_id: str,
+    message: str,
+    user: UserModel,
+    redis_pool: Optional[ConnectionPool] = None,
+) -> AsyncGenerator[str, None]:
+    """
+    Converse with OpenAI, streaming the response as Server-Sent Events.
+
+    Emits a "token" event for each token of the reply as it is generated, a
+    "learning_moments" event as soon as those are ready, and finally a "done"
+    event with the whole ConverseResponse once the reply is stored. If the
+    reply can't be finished an "error" event is sent instead of "done".
+
+    :param conversation_id: String ID representing the conversation, or "new"
+                            to start a new one.
+    :param message: String message the user wants to send.
+    :param user: UserModel, needed to store flashcards.
+    :param redis_pool: Optional Redis connection pool for caching.
+    :yields: String Server-Sent Events.
+    """
+    conversation_id, language_code = await resolve_conversation(
+        conversation_id,
+        user,
+        redis_pool,
+    )
+
+    learning_moments_task = asyncio.create_task(
+        get_and_store_learning_moments(
+            await create_conversation_element(
+                conversation_id,
+                ConversationElementRole.USER,
+                message,
+                redis_pool,
+            ),
+            user,
+            language_code,
+            redis_pool,
+        ),
+    )
+
+    reply_stream = stream_reply(
+        conversation_id,
+        message,
+        language_code,
+        redis_pool,
+        learning_moments_task,
+    )
+    try:
+        async with aclosing(reply_stream):
+            async for sse_event in reply_stream:
+                yield sse_event
+    except Exception:
+        logger.exception(
+            {
+                "message": "Failed to stream reply",
+                "conversation_id": conversation_id,
+            },
+        )
+        yield format_sse_event(
+            "error",
+            ConverseStreamError(detail="Failed to finish the reply."),
+        )
+    finally:
+        # However the stream ends, so the task is never left orphaned.
+        await asyncio.shield(learning_moments_task)
@@ -0,0 +1,35 @@
+"""Teacher tasks run by the background worker."""
+from typing import Any, Dict
+
+from fia_api.db.models.conversation_model import ConversationElementModel
+from fia_api.db.models.user_model import UserModel
+from fia_api.services.task_queue.queue import register_task
+from fia_api.web.api.teacher.schema import LearningMoments
+from fia_api.web.api.teacher.utils import (
+    PERSIST_LEARNING_MOMENTS_TASK,
+    persist_learning_moments,
+)
+
+
+@register_task(PERSIST_LEARNING_MOMENTS_TASK)
+async def persist_learning_moments_task(
+    conversation_element_id: int,
+    learning_moments: Dict[str, Any],
+    username: str,
+    conversation_id: str,
+) -> None:
+    """
+    Store learning moments and their flashcards.
+
+    :param conversation_element_id: Int ID of the ConversationElement the
+                                    moments are from.
+    :param learning_moments: The LearningMoments, dumped to a dict.
+    :param username: String username the flashcards belong to.
+    :param conversation_id: String conversation ID for context.
+    """
+    await persist_learning_moments(
+        await ConversationElementModel.get(id=conversation_element_id),
+        LearningMoments(**learning_moments),
+        await UserModel.get(username=username),
+        conversation_id,
+    )
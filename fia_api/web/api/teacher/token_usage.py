@@ -0,0 +1,20 @@
+from typing import Any
+
+from fia_api.services.token_usage.accounting import record_token_usage
+
+
+async def store_token_usage(
+    conversation_id: str,
+    openai_response: Any,
+) -> None:  # type: ignore
+    """
+    Store the token usage for an OpenAI request.
+
+    :param conversation_id: String to store the usage under
+    :param openai_response: The messy openAI datatype
+    """
+    await record_token_usage(
+        conversation_id,
+        openai_response.usage["prompt_tokens"],
+        openai_response.usage["completion_tokens"],
+    )
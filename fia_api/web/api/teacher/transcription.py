@@ -0,0 +1,44 @@
+"""Transcription of the audio messages users upload."""
+import asyncio
+from typing import IO
+
+from fastapi import HTTPException, UploadFile, status
+
+from fia_api.services.llm.gateway import transcribe_audio
+from fia_api.settings import settings
+
+
+def read_audio_upload(audio_file: IO[bytes]) -> bytes:
+    """
+    Read an upload, up to one byte over settings.audio_upload_max_bytes.
+
+    Blocks while the upload is read from its spooled file, so run it in a
+    thread.
+
+    :param audio_file: File-like object of the upload.
+    :returns: Bytes of the upload, longer than the max if it's too large.
+    """
+    audio_file.seek(0)
+
+    return audio_file.read(settings.audio_upload_max_bytes + 1)
+
+
+async def get_text_from_audio(audio_file: UploadFile, language_code: str) -> str:
+    """
+    Given a file, return the text.
+
+    :param audio_file: UploadFile object to transcode to text.
+    :param language_code: String language code the audio is in.
+    :raises HTTPException: If the upload is over the max size.
+    :return: String text.
+    """
+    audio = await asyncio.to_thread(read_audio_upload, audio_file.file)
+
+    if len(audio) > settings.audio_upload_max_bytes:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail="Audio file too large",
+        )
+
+    # TODO: Store the token usage too
+    return await transcribe_audio(audio, language_code)
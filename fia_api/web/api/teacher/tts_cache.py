@@ -0,0 +1,291 @@
+"""
+Cache of synthesized audio, so the same text is only sent to Text-to-Speech once.
+
+Entries are content addressed by the text, language code, voice and audio
+config. They are stored as files in settings.tts_cache_dir, so hits are
+streamed straight from disk, and the least recently played files are evicted
+once the directory grows over settings.tts_cache_max_bytes. A file's mtime is
+when it was last played. The size of the directory is kept as a running total,
+so it is only scanned on the first write and when evicting.
+
+With settings.tts_cache_redis_enabled, entries are also stored in Redis with a
+TTL, so a server can fill its disk cache from audio another one synthesized.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from pathlib import Path
+from typing import AsyncIterator, BinaryIO, Dict, List, Optional, Tuple
+
+from google.cloud import texttospeech
+from loguru import logger
+from redis.asyncio import ConnectionPool, Redis, RedisError
+
+from fia_api.settings import settings
+
+CACHE_PREFIX = "tts_cache"
+CACHE_FILE_SUFFIX = ".mp3"
+# 64 KiB.
+READ_CHUNK_BYTES = 65536
+# Evict down to this fraction of settings.tts_cache_max_bytes, so a full cache
+# isn't evicting (and scanning) on every write.
+EVICT_TO_FRACTION = 0.9
+
+
+class CacheSize:
+    """
+    Running total of the bytes cached on disk, per cache directory.
+
+    Counted from the directory on the first write and on each eviction, and
+    added to by each write in between. Files written by other processes
+    sharing the directory are only counted from the next eviction.
+    """
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.total_bytes: Dict[Path, int] = {}
+
+
+cache_size = CacheSize()
+
+
+def get_audio_cache_key(
+    text: str,
+    voice: texttospeech.VoiceSelectionParams,
+    audio_config: texttospeech.AudioConfig,
+) -> str:
+    """
+    Get the key of the audio of some text.
+
+    :param text: String text to convert.
+    :param voice: VoiceSelectionParams it is converted with, which include the
+                  language code.
+    :param audio_config: AudioConfig it is converted with.
+    :returns: String hex digest.
+    """
+    key_source = json.dumps(
+        {
+            "text": text,
+            "voice": texttospeech.VoiceSelectionParams.to_dict(voice),
+            "audio_config": texttospeech.AudioConfig.to_dict(audio_config),
+        },
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+
+    return hashlib.sha256(key_source.encode()).hexdigest()
+
+
+def get_audio_cache_path(cache_key: str) -> Path:
+    """
+    Get the path the audio of a key is stored at.
+
+    :param cache_key: String key from get_audio_cache_key.
+    :returns: Path
+    """
+    return settings.tts_cache_dir / f"{cache_key}{CACHE_FILE_SUFFIX}"
+
+
+def open_cached_audio(cache_key: str) -> Optional[BinaryIO]:
+    """
+    Open the cached audio of a key, marking it as recently played.
+
+    The file stays readable if it is evicted while open.
+
+    :param cache_key: String key from get_audio_cache_key.
+    :returns: Binary file, or None if it isn't cached.
+    """
+    cache_path = get_audio_cache_path(cache_key)
+
+    try:
+        audio_file = open(cache_path, "rb")  # noqa: WPS515
+    except FileNotFoundError:
+        return None
+
+    try:
+        os.utime(cache_path)
+    except OSError:
+        logger.warning({"message": "Failed to touch cached audio", "key": cache_key})
+
+    return audio_file
+
+
+def list_cached_audio() -> List[Tuple[float, int, str]]:
+    """
+    List the cached audio files, least recently played first.
+
+    :returns: List of (mtime, size in bytes, path) of each file.
+    """
+    cached_files = []
+
+    for entry in os.scandir(settings.tts_cache_dir):
+        if not entry.name.endswith(CACHE_FILE_SUFFIX):
+            continue
+        try:
+            entry_stat = entry.stat()
+        except FileNotFoundError:
+            continue
+        cached_files.append((entry_stat.st_mtime, entry_stat.st_size, entry.path))
+
+    return sorted(cached_files)
+
+
+def evict_cached_audio() -> None:
+    """
+    Delete the least recently played audio until the cache is back under bound.
+
+    The cache is evicted down to EVICT_TO_FRACTION of its bound, and the
+    running total of its size is reset to what's left.
+    """
+    cached_files = list_cached_audio()
+    total_bytes = sum(file_size for _, file_size, _ in cached_files)
+    target_bytes = settings.tts_cache_max_bytes * EVICT_TO_FRACTION
+
+    for _, file_size, file_path in cached_files:
+        if total_bytes <= target_bytes:
+            break
+        Path(file_path).unlink(missing_ok=True)
+        total_bytes -= file_size
+
+    cache_size.total_bytes[settings.tts_cache_dir] = total_bytes
+
+
+def add_to_cache_size(audio_bytes: int) -> int:
+    """
+    Add a newly cached file to the running total of the cache's size.
+
+    :param audio_bytes: Int change in size, the file's size less that of any
+                        file it replaced.
+    :returns: Int total bytes cached.
+    """
+    total_bytes = cache_size.total_bytes.get(settings.tts_cache_dir)
+
+    if total_bytes is None:
+        total_bytes = sum(file_size for _, file_size, _ in list_cached_audio())
+    else:
+        total_bytes += audio_bytes
+
+    cache_size.total_bytes[settings.tts_cache_dir] = total_bytes
+
+    return total_bytes
+
+
+def get_cached_audio_size(cache_path: Path) -> int:
+    """
+    Get the size of a cached audio file.
+
+    :param cache_path: Path of the file.
+    :returns: Int size in bytes, 0 if it isn't cached.
+    """
+    try:
+        return cache_path.stat().st_size
+    except FileNotFoundError:
+        return 0
+
+
+def replace_cached_audio(temp_path: str, cache_path: Path, audio_bytes: int) -> None:
+    """
+    Move a written audio file into the cache, evicting if it goes over bound.
+
+    Any file it replaces has its size taken off the running total, so caching
+    the same key twice isn't counted twice.
+
+    :param temp_path: String path the audio was written to.
+    :param cache_path: Path to cache the audio at.
+    :param audio_bytes: Int size of the audio.
+    """
+    with cache_size.lock:
+        replaced_bytes = get_cached_audio_size(cache_path)
+        os.replace(temp_path, cache_path)
+        total_bytes = add_to_cache_size(audio_bytes - replaced_bytes)
+
+        if total_bytes > settings.tts_cache_max_bytes:
+            evict_cached_audio()
+
+
+def store_cached_audio(cache_key: str, audio: bytes) -> None:
+    """
+    Store the audio of a key on disk, evicting if the cache goes over its bound.
+
+    The audio is written to a temporary file and renamed into place, so a
+    reader never sees a partly written file. Audio already cached for the key
+    is replaced.
+
+    :param cache_key: String key from get_audio_cache_key.
+    :param audio: Bytes of MP3 audio.
+    """
+    settings.tts_cache_dir.mkdir(parents=True, exist_ok=True)
+
+    file_descriptor, temp_path = tempfile.mkstemp(
+        dir=settings.tts_cache_dir,
+        suffix=".tmp",
+    )
+    try:
+        with os.fdopen(file_descriptor, "wb") as temp_file:
+            temp_file.write(audio)
+        replace_cached_audio(temp_path, get_audio_cache_path(cache_key), len(audio))
+    except OSError:
+        logger.exception({"message": "Failed to cache audio", "key": cache_key})
+        Path(temp_path).unlink(missing_ok=True)
+
+
+async def stream_cached_audio(audio_file: BinaryIO) -> AsyncIterator[bytes]:
+    """
+    Stream an opened cached audio file in chunks, closing it at the end.
+
+    :param audio_file: Binary file from open_cached_audio.
+    :yields: Bytes of MP3 audio.
+    """
+    with audio_file:
+        while True:  # noqa: WPS457
+            chunk = await asyncio.to_thread(audio_file.read, READ_CHUNK_BYTES)
+            if not chunk:
+                break
+            yield chunk
+
+
+async def get_redis_cached_audio(
+    redis_pool: ConnectionPool,
+    cache_key: str,
+) -> Optional[bytes]:
+    """
+    Get the audio of a key from Redis.
+
+    Errors are logged and treated as a miss.
+
+    :param redis_pool: Redis connection pool.
+    :param cache_key: String key from get_audio_cache_key.
+    :returns: Bytes of MP3 audio, or None if it isn't cached.
+    """
+    try:
+        async with Redis(connection_pool=redis_pool) as redis:
+            return await redis.get(f"{CACHE_PREFIX}:{cache_key}")
+    except RedisError:
+        logger.exception({"message": "Failed to read cached audio", "key": cache_key})
+        return None
+
+
+async def set_redis_cached_audio(
+    redis_pool: ConnectionPool,
+    cache_key: str,
+    audio: bytes,
+) -> None:
+    """
+    Store the audio of a key in Redis for settings.tts_cache_redis_ttl_seconds.
+
+    :param redis_pool: Redis connection pool.
+    :param cache_key: String key from get_audio_cache_key.
+    :param audio: Bytes of MP3 audio.
+    """
+    try:
+        async with Redis(connection_pool=redis_pool) as redis:
+            await redis.set(
+                f"{CACHE_PREFIX}:{cache_key}",
+                audio,
+                ex=settings.tts_cache_redis_ttl_seconds,
+            )
+    except RedisError:
+        logger.exception({"message": "Failed to cache audio", "key": cache_key})
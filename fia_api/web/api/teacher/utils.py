@@ -1,13 +1,16 @@
 # noqa: WPS462
+import asyncio
+import functools
+import hashlib
 import json
-import os
 import uuid
-from typing import Any, Dict, List
+from typing import Dict, List, Optional, Sequence, Tuple
 
-import openai
-from fastapi import UploadFile
-from google.cloud import texttospeech
 from loguru import logger
+from pypika import Table
+from redis.asyncio import ConnectionPool
+from tortoise import timezone
+from tortoise.transactions import in_transaction
 
 from fia_api.db.models.conversation_model import (
     ConversationElementModel,
@@ -17,126 +20,131 @@ from fia_api.db.models.learning_moment_model import LearningMomentModel
 from fia_api.db.models.token_usage_model import TokenUsageModel
 from fia_api.db.models.user_conversation_model import UserConversationModel
 from fia_api.db.models.user_model import UserModel
+from fia_api.services.llm.gateway import create_chat_completion
+from fia_api.services.llm.resilience import LLMUnavailableError
+from fia_api.services.llm.routing import LLMRoute, get_continuation_route
+from fia_api.services.llm.single_flight import single_flight
+from fia_api.services.task_queue.queue import enqueue_task
 from fia_api.settings import settings
-from fia_api.web.api.flashcards.utils import create_flashcard
+from fia_api.web.api.flashcards.schema import FlashcardSpec
+from fia_api.web.api.flashcards.utils import bulk_create_flashcards
+from fia_api.web.api.teacher.audio import prewarm_audio
+from fia_api.web.api.teacher.context_window import get_context_window
+from fia_api.web.api.teacher.history_cache import (
+    append_conversation_history,
+    get_conversation_history,
+    load_conversation_history,
+    start_conversation_history,
+)
+from fia_api.web.api.teacher.learning_moments_cache import (
+    cache_learning_moments,
+    get_cache_key,
+    get_cached_learning_moments,
+    is_cacheable,
+)
+from fia_api.web.api.teacher.opener_pool import is_opener_eligible, take_opener
+from fia_api.web.api.teacher.prompts import get_prompt_registry
 from fia_api.web.api.teacher.schema import (
     ConversationContinuation,
     ConverseResponse,
     LearningMoments,
     Mistake,
+    Reply,
+    ReplyOptions,
 )
+from fia_api.web.api.teacher.token_usage import store_token_usage
+
+# Registered in fia_api.web.api.teacher.tasks.
+PERSIST_LEARNING_MOMENTS_TASK = "persist_learning_moments"
+
 
-openai.api_key = settings.openai_api_key
-
-# TODO: Move this to a constants/generic location.
-language_code_map = {
-    "de": {
-        "language": "German",
-    },
-    "fr": {
-        "language": "French",
-    },
-    "it": {
-        "language": "Italian",
-    },
-    "es": {
-        "language": "Spanish",
-    },
-    "nl": {
-        "language": "Dutch",
-    },
-}
-
-
-async def store_token_usage(
+async def get_messages_from_conversation_id(
     conversation_id: str,
-    openai_response: Any,
-) -> None:  # type: ignore
+    redis_pool: Optional[ConnectionPool] = None,
+) -> List[Dict[str, str]]:
     """
-    Store the token usage for an OpenAI request.
+    Given a conversation_id, return a list of dicts ready to pass to OpenAI.
 
-    :param conversation_id: String to store the usage under
-    :param openai_response: The messy openAI datatype
-    """
-    token_usage_model = await TokenUsageModel.get(
-        conversation_id=uuid.UUID(conversation_id),
-    )
+    If a redis_pool is given, the history is served from the conversation
+    history cache instead of the DB.
 
-    token_usage_model.prompt_token_usage += openai_response.usage["prompt_tokens"]
-    token_usage_model.completion_token_usage += openai_response.usage[
-        "completion_tokens"
-    ]
+    :param conversation_id: str ID of the conversation
+    :param redis_pool: Optional Redis connection pool for the cache.
+    :return: List of dicts of shape {"role": EnumValue, "content": "message"}
+    """
+    if redis_pool is not None and settings.conversation_history_cache_enabled:
+        return await get_conversation_history(redis_pool, conversation_id)
 
-    await token_usage_model.save()
+    return await load_conversation_history(conversation_id)
 
 
-async def get_messages_from_conversation_id(
+async def create_conversation_element(
     conversation_id: str,
-) -> List[Dict[str, str]]:
+    role: ConversationElementRole,
+    content: str,
+    redis_pool: Optional[ConnectionPool] = None,
+) -> ConversationElementModel:
     """
-    Given a conversation_id, return a list of dicts ready to pass to OpenAI.
+    Store a new element of a conversation, keeping the history cache in sync.
 
     :param conversation_id: str ID of the conversation
-    :return: List of dicts of shape {"role": EnumValue, "content": "message"}
+    :param role: ConversationElementRole the content is from.
+    :param content: String content of the element.
+    :param redis_pool: Optional Redis connection pool for the cache.
+    :returns: The created ConversationElementModel.
     """
-    raw_conversation = await ConversationElementModel.filter(
+    conversation_element = await ConversationElementModel.create(
         conversation_id=uuid.UUID(conversation_id),
-    ).values()
+        role=role,
+        content=content,
+    )
 
-    return [
-        {
-            "role": conversation_element["role"].value,
-            "content": conversation_element["content"],
-        }
-        for conversation_element in raw_conversation
-    ]
+    if redis_pool is not None and settings.conversation_history_cache_enabled:
+        await append_conversation_history(
+            redis_pool,
+            conversation_id,
+            {"role": role.value, "content": content},
+        )
 
+    return conversation_element
 
-async def get_learning_moments_from_message(
+
+async def request_learning_moments(
     message: str,
     conversation_id: str,
+    language_code: str,
+    redis_pool: Optional[ConnectionPool] = None,
 ) -> LearningMoments:
     """
-    Get LearningMoments from a user message.
+    Ask OpenAI for the LearningMoments in a user message.
 
     :param message: String message from the user to look for mistakes in.
     :param conversation_id: Store the token usage in the conversation.
+    :param language_code: String ISO 639-1 language code of the conversation.
+    :param redis_pool: Optional Redis connection pool to cache the result in.
     :returns: LearningMoments
     """
-    # TODO: This language code can be passed without needing a load of DB calls.
-    user_conversation_model = await UserConversationModel.get(
-        conversation_id=conversation_id,
-    )
-    learning_moments_prompt = get_learning_moments_prompt(
-        user_conversation_model.language_code,
-    )
+    prompt_definition = get_prompt_registry().learning_moments
 
-    openai_response = openai.ChatCompletion.create(
-        model="gpt-3.5-turbo-0613",
+    openai_response = await create_chat_completion(
+        route=LLMRoute.LEARNING_MOMENTS,
         messages=[
             {
                 "role": "system",
-                "content": learning_moments_prompt,
+                "content": prompt_definition.get_prompt(language_code),
             },
             {
                 "role": "user",
                 "content": message,
             },
         ],
-        functions=[
-            {
-                "name": "get_learning_moments",
-                "description": "List all of the mistakes in the user's message and any words in the user message that they would like translated.",  # noqa: E501
-                "parameters": LearningMoments.schema(),
-            },
-        ],
-        function_call={"name": "get_learning_moments"},
+        **prompt_definition.get_function_kwargs(),
     )
 
     await store_token_usage(conversation_id, openai_response)
 
     try:
-        return LearningMoments(
+        learning_moments = LearningMoments(
             **json.loads(
                 openai_response.choices[  # noqa: WPS219
                     0
@@ -146,38 +154,138 @@ async def get_learning_moments_from_message(
     except Exception:
         return LearningMoments(learning_moments=[])
 
+    if redis_pool is not None and is_cacheable(message):
+        await cache_learning_moments(
+            redis_pool,
+            language_code,
+            prompt_definition.version,
+            message,
+            learning_moments,
+            openai_response.usage,
+        )
+
+    return learning_moments
+
+
+async def get_learning_moments_from_message(
+    message: str,
+    conversation_id: str,
+    language_code: str,
+    redis_pool: Optional[ConnectionPool] = None,
+) -> LearningMoments:
+    """
+    Get LearningMoments from a user message.
+
+    If a redis_pool is given, repeated messages are served from the learning
+    moments cache instead of calling OpenAI. Identical messages being checked
+    at the same time share one request.
+
+    :param message: String message from the user to look for mistakes in.
+    :param conversation_id: Store the token usage in the conversation.
+    :param language_code: String ISO 639-1 language code of the conversation.
+    :param redis_pool: Optional Redis connection pool for the cache.
+    :returns: LearningMoments
+    """
+    prompt_version = get_prompt_registry().learning_moments.version
+
+    if redis_pool is not None and is_cacheable(message):
+        cached_learning_moments = await get_cached_learning_moments(
+            redis_pool,
+            language_code,
+            prompt_version,
+            message,
+        )
+        if cached_learning_moments is not None:
+            return cached_learning_moments
+
+    return await single_flight(
+        get_cache_key(language_code, prompt_version, message),
+        functools.partial(
+            request_learning_moments,
+            message,
+            conversation_id,
+            language_code,
+            redis_pool,
+        ),
+        LearningMoments,
+        redis_pool,
+    )
+
+
+async def request_conversation_continuation(
+    conversation_id: str,
+    messages: List[Dict[str, str]],
+) -> ConversationContinuation:
+    """
+    Ask OpenAI for the continuation of a conversation.
+
+    Failed calls are already retried by the LLM gateway, so a response with
+    malformed function call arguments isn't asked for again.
+
+    :param conversation_id: Store the token usage in the conversation.
+    :param messages: List of OpenAI messages to continue on from.
+    :raises LLMUnavailableError: If the response was malformed.
+    :returns: ConversationContinuation
+    """
+    openai_response = await create_chat_completion(
+        route=get_continuation_route(messages[-1]["content"]),
+        messages=messages,
+        **get_prompt_registry().conversation_continuation.get_function_kwargs(),
+    )
+
+    await store_token_usage(conversation_id, openai_response)
+
+    try:
+        openai_message = openai_response.choices[0].message
+        return ConversationContinuation(
+            **json.loads(
+                openai_message.function_call.arguments,
+                # The model sometimes leaves raw newlines in strings.
+                strict=False,
+            ),
+        )
+    except (AttributeError, TypeError, ValueError) as exc:
+        logger.warning(
+            {
+                "message": "Malformed conversation continuation",
+                "conversation_id": conversation_id,
+            },
+        )
+        raise LLMUnavailableError("Malformed conversation continuation") from exc
+
 
 async def get_conversation_continuation(
     conversation_id: str,
+    redis_pool: Optional[ConnectionPool] = None,
 ) -> ConversationContinuation:
     """
     Continue the conversation with the user based on the context.
 
     The conversation in the DB must be updated with the most recent user
-    message.
+    message. If the same message is sent to a conversation again while the
+    first is still in flight (e.g. a retry), both share one request.
 
     :param conversation_id: String conversation to continue on.
+    :param redis_pool: Optional Redis connection pool for caching.
     :returns: ConversationContinuation
     """
-    openai_response = openai.ChatCompletion.create(
-        model="gpt-3.5-turbo-0613",
-        messages=await get_messages_from_conversation_id(conversation_id),
-        functions=[
-            {
-                "name": "get_conversation_response",
-                "description": "Get the conversational response to the user's message.",
-                "parameters": ConversationContinuation.schema(),
-            },
-        ],
-        function_call={"name": "get_conversation_response"},
+    messages = await get_context_window(
+        conversation_id,
+        await get_messages_from_conversation_id(conversation_id, redis_pool),
     )
-
-    await store_token_usage(conversation_id, openai_response)
-
-    return ConversationContinuation(
-        **json.loads(
-            openai_response.choices[0].message.function_call.arguments,  # noqa: WPS219
+    last_message_hash = hashlib.sha256(
+        messages[-1]["content"].encode("utf-8"),
+    ).hexdigest()
+
+    return await single_flight(
+        f"conversation_continuation:{conversation_id}:{last_message_hash}",
+        functools.partial(
+            request_conversation_continuation,
+            conversation_id,
+            messages,
         ),
+        ConversationContinuation,
+        redis_pool,
     )
 
 
@@ -193,21 +301,26 @@ async def create_flashcards_from_learning_moments(
     :param user: UserModel to associate with the flashcards.
     :param conversation_id: String conversation ID for context.
     """
+    flashcard_specs = []
+
     for learning_moment in learning_moments.learning_moments:
         parsed_learning_moment = learning_moment.moment
 
         if isinstance(parsed_learning_moment, Mistake):
-            await create_flashcard(
-                user.username,
-                parsed_learning_moment.incorrect_section,
-                parsed_learning_moment.corrected_section,
-                conversation_id,
-                explanation=parsed_learning_moment.explanation,
+            flashcard_specs.append(
+                FlashcardSpec(
+                    conversation_id=conversation_id,
+                    front=parsed_learning_moment.incorrect_section,
+                    back=parsed_learning_moment.corrected_section,
+                    explanation=parsed_learning_moment.explanation,
+                ),
             )
         else:
             logger.error("Some weirdness going on....")
             logger.error(learning_moment)
 
+    await bulk_create_flashcards(user, flashcard_specs)
+
 
 async def store_learning_moments(
     user_conversation_element: ConversationElementModel,
@@ -216,24 +329,241 @@ async def store_learning_moments(
     """
     Store learning moments in the DB.
 
+    All the moments are inserted with one query, and linked to the element
+    with a single add, in one transaction, however many moments there are.
+
     :param user_conversation_element: ConversationElement these moments are
                                       related to.
     :param learning_moments: The LearningMoments to store in the DB.
     """
-    # TODO: These saves can't all be necessary...
-    for learning_moment in learning_moments.learning_moments:
-        learning_moment_model = LearningMomentModel(
-            learning_moment=learning_moment.model_dump_json(),
+    if not learning_moments.learning_moments:
+        return
+
+    created_at = timezone.now()
+
+    async with in_transaction() as connection:
+        insert_query = (
+            connection.query_class.into(Table(LearningMomentModel.Meta.table))
+            .columns("learning_moment", "last_modified", "first_created")
+            .insert(
+                *[
+                    (learning_moment.model_dump_json(), created_at, created_at)
+                    for learning_moment in learning_moments.learning_moments
+                ],
+            )
+        )
+        # Tortoise's bulk_create doesn't return the new rows, which are needed
+        # to link the moments, so they are read back from the insert itself.
+        moment_models: Sequence[LearningMomentModel] = await LearningMomentModel.raw(
+            f"{insert_query} RETURNING *",
+            using_db=connection,
+        )
+        await user_conversation_element.learning_moments.add(
+            *moment_models,
+            using_db=connection,
+        )
+
+
+async def persist_learning_moments(
+    user_conversation_element: ConversationElementModel,
+    learning_moments: LearningMoments,
+    user: UserModel,
+    conversation_id: str,
+) -> None:
+    """
+    Store learning moments and create their flashcards.
+
+    Both are stored in one transaction, so a task queue retry after a failure
+    never stores the moments twice.
+
+    :param user_conversation_element: ConversationElement the moments are from.
+    :param learning_moments: The LearningMoments to store.
+    :param user: UserModel to associate with the flashcards.
+    :param conversation_id: String conversation ID for context.
+    """
+    # The transaction in store_learning_moments, and the flashcards' insert,
+    # join this one.
+    async with in_transaction():
+        await store_learning_moments(user_conversation_element, learning_moments)
+
+        await create_flashcards_from_learning_moments(
+            learning_moments,
+            user,
+            conversation_id,
+        )
+
+
+async def get_and_store_learning_moments(
+    user_conversation_element: ConversationElementModel,
+    user: UserModel,
+    language_code: str,
+    redis_pool: Optional[ConnectionPool] = None,
+) -> LearningMoments:
+    """
+    Get the LearningMoments for a message and persist them.
+
+    With settings.task_queue_enabled they are persisted by the background
+    worker, so the reply doesn't wait on the inserts. Any failure is logged
+    and swallowed so a bad learning moment response can never block the
+    conversation reply.
+
+    :param user_conversation_element: ConversationElement of the message from
+                                      the user to look for mistakes in.
+    :param user: UserModel, needed to store flashcards.
+    :param language_code: String ISO 639-1 language code of the conversation.
+    :param redis_pool: Optional Redis connection pool for caching.
+    :returns: LearningMoments, empty if anything went wrong.
+    """
+    conversation_id = str(user_conversation_element.conversation_id)
+
+    try:
+        learning_moments = await get_learning_moments_from_message(
+            user_conversation_element.content,
+            conversation_id,
+            language_code,
+            redis_pool,
+        )
+
+        if not learning_moments.learning_moments:
+            return learning_moments
+
+        if settings.task_queue_enabled and redis_pool is not None:
+            await enqueue_task(
+                redis_pool,
+                PERSIST_LEARNING_MOMENTS_TASK,
+                conversation_element_id=user_conversation_element.id,
+                learning_moments=learning_moments.model_dump(mode="json"),
+                username=user.username,
+                conversation_id=conversation_id,
+            )
+        else:
+            await persist_learning_moments(
+                user_conversation_element,
+                learning_moments,
+                user,
+                conversation_id,
+            )
+    except Exception:
+        logger.exception(
+            {
+                "message": "Failed to get learning moments",
+                "conversation_id": conversation_id,
+            },
         )
-        await learning_moment_model.save()
-        await user_conversation_element.learning_moments.add(learning_moment_model)
-        await user_conversation_element.save()
+        return LearningMoments(learning_moments=[])
+
+    return learning_moments
+
+
+async def get_conversation_language_code(conversation_id: str) -> str:
+    """
+    Look up the language a conversation is in.
+
+    :param conversation_id: String ID of the conversation.
+    :returns: String ISO 639-1 language code.
+    """
+    user_conversation_model = await UserConversationModel.get(
+        conversation_id=conversation_id,
+    )
+
+    return user_conversation_model.language_code
+
+
+async def get_reply(
+    conversation_id: str,
+    language_code: str,
+    redis_pool: Optional[ConnectionPool],
+    reply_options: ReplyOptions,
+) -> Reply:
+    """
+    Get the reply to the last message of a conversation.
+
+    With reply_options.prewarm_reply_audio, the audio of the reply starts
+    being synthesized as soon as it's known.
+
+    :param conversation_id: String ID representing the conversation.
+    :param language_code: String ISO 639-1 language code of the conversation.
+    :param redis_pool: Optional Redis connection pool for caching.
+    :param reply_options: ReplyOptions of the reply.
+    :returns: Reply
+    """
+    if reply_options.opener is None:
+        conversation_continuation = await get_conversation_continuation(
+            conversation_id,
+            redis_pool,
+        )
+    else:
+        conversation_continuation = ConversationContinuation(
+            message=reply_options.opener,
+        )
+
+    reply = Reply(message=conversation_continuation.message)
+    if reply_options.prewarm_reply_audio:
+        reply.audio_handle = await prewarm_audio(
+            reply.message,
+            language_code,
+            redis_pool,
+        )
+
+    return reply
+
+
+async def get_learning_moments_and_reply(
+    user_conversation_element: ConversationElementModel,
+    user: UserModel,
+    language_code: str,
+    redis_pool: Optional[ConnectionPool],
+    reply_options: ReplyOptions,
+) -> Tuple[LearningMoments, Reply]:
+    """
+    Get (and store) the LearningMoments of a message, and the reply to it.
+
+    The reply only needs the stored user message, so when
+    settings.teacher_concurrent_pipeline is set, or the reply is an opener,
+    both are fetched concurrently.
+
+    :param user_conversation_element: ConversationElement of the message from
+                                      the user.
+    :param user: UserModel, needed to store flashcards.
+    :param language_code: String ISO 639-1 language code of the conversation.
+    :param redis_pool: Optional Redis connection pool for caching.
+    :param reply_options: ReplyOptions of the reply.
+    :returns: Tuple of the LearningMoments and the Reply.
+    """
+    conversation_id = str(user_conversation_element.conversation_id)
+
+    if reply_options.opener is not None or settings.teacher_concurrent_pipeline:
+        return await asyncio.gather(
+            get_and_store_learning_moments(
+                user_conversation_element,
+                user,
+                language_code,
+                redis_pool,
+            ),
+            get_reply(conversation_id, language_code, redis_pool, reply_options),
+        )
+
+    learning_moments = await get_and_store_learning_moments(
+        user_conversation_element,
+        user,
+        language_code,
+        redis_pool,
+    )
+
+    return learning_moments, await get_reply(
+        conversation_id,
+        language_code,
+        redis_pool,
+        reply_options,
+    )
 
 
 async def get_response(
     conversation_id: str,
     message: str,
     user: UserModel,
+    redis_pool: Optional[ConnectionPool] = None,
+    reply_options: Optional[ReplyOptions] = None,
 ) -> ConverseResponse:
     """
     Converse with OpenAI.
@@ -241,43 +571,53 @@ async def get_response(
     Given the conversation ID, and a new message to add to it, store the
     message, get the response, store that, and return it.
 
+    With reply_options.prewarm_reply_audio or settings.tts_prewarm_enabled,
+    the response comes with an audio handle to fetch the reply's audio by.
+
     :param conversation_id: String ID representing the conversation.
     :param message: String message the user wants to send.
     :param user: UserModel, needed to store flashcards.
+    :param redis_pool: Optional Redis connection pool for caching.
+    :param reply_options: Optional ReplyOptions of the reply.
     :return: ConverseResponse
     """
-    user_conversation_element = await ConversationElementModel.create(
-        conversation_id=uuid.UUID(conversation_id),
-        role=ConversationElementRole.USER,
-        content=message,
-    )
-    await user_conversation_element.save()
+    reply_options = reply_options or ReplyOptions()
+    if settings.tts_prewarm_enabled:
+        reply_options = reply_options.model_copy(
+            update={"prewarm_reply_audio": True},
+        )
+    language_code = reply_options.language_code
+    if language_code is None:
+        language_code = await get_conversation_language_code(conversation_id)
 
-    learning_moments = await get_learning_moments_from_message(
-        message,
+    user_conversation_element = await create_conversation_element(
         conversation_id,
+        ConversationElementRole.USER,
+        message,
+        redis_pool,
     )
 
-    await store_learning_moments(user_conversation_element, learning_moments)
-
-    await create_flashcards_from_learning_moments(
-        learning_moments,
+    learning_moments, reply = await get_learning_moments_and_reply(
+        user_conversation_element,
         user,
-        conversation_id,
+        language_code,
+        redis_pool,
+        reply_options,
     )
-    conversation_continuation = await get_conversation_continuation(conversation_id)
 
-    await ConversationElementModel.create(
-        conversation_id=uuid.UUID(conversation_id),
-        role=ConversationElementRole.SYSTEM,
-        content=conversation_continuation.message,
+    await create_conversation_element(
+        conversation_id,
+        ConversationElementRole.SYSTEM,
+        reply.message,
+        redis_pool,
     )
 
     return ConverseResponse(
         conversation_id=conversation_id,
         learning_moments=learning_moments,
         input_message=message,
-        conversation_response=conversation_continuation.message,
+        conversation_response=reply.message,
+        audio_handle=reply.audio_handle,
     )
 
 
@@ -288,9 +628,7 @@ def get_learning_moments_prompt(language_code: str) -> str:
     :param language_code: String ISO 639-1 language code
     :returns: String of the conversation prompt
     """
-    return settings.get_learning_moments_prompt.format(
-        language=language_code_map[language_code]["language"],
-    )
+    return get_prompt_registry().learning_moments.get_prompt(language_code)
 
 
 def get_conversation_continuation_prompt(language_code: str) -> str:
@@ -300,97 +638,137 @@ def get_conversation_continuation_prompt(language_code: str) -> str:
     :param language_code: String ISO 639-1 language code
     :returns: String of the conversation prompt
     """
-    return settings.conversation_continuation_prompt.format(
-        language=language_code_map[language_code]["language"],
+    return get_prompt_registry().conversation_continuation.get_prompt(
+        language_code,
     )
 
 
-async def initialize_conversation(
+async def create_conversation(
     user: UserModel,
-    message: str,
-) -> ConverseResponse:
+    redis_pool: Optional[ConnectionPool] = None,
+) -> UserConversationModel:
     """
-    Starts the conversation.
+    Set up the DB with the initial conversation prompt.
 
-    Set up the DB with the initial conversation prompt and return the new
-    conversation ID, along with the first response from the model.
+    The prompt, the conversation and its token usage are stored in one
+    transaction, so a conversation is never left half created.
 
-    :param user: The user initiating the conversation.
-    :param message: The message to start the conversation with.
-    :returns: ConversationResponse of the teacher's first reply.
+    :param user: The user initiating the conversation. Fetch it with
+                 select_related("user_details") to save a query.
+    :param redis_pool: Optional Redis connection pool for caching.
+    :returns: UserConversationModel of the new conversation.
     """
-    user_details = await user.user_details.get()
+    user_details = await user.user_details
     conversation_id = uuid.uuid4()
     conversation_continuation_prompt = get_conversation_continuation_prompt(
         user_details.current_language_code,
     )
 
-    await ConversationElementModel.create(
-        conversation_id=conversation_id,
-        role=ConversationElementRole.SYSTEM,
-        content=conversation_continuation_prompt,
-    )
+    async with in_transaction() as connection:
+        await ConversationElementModel.create(
+            conversation_id=conversation_id,
+            role=ConversationElementRole.SYSTEM,
+            content=conversation_continuation_prompt,
+            using_db=connection,
+        )
 
-    await UserConversationModel.create(
-        user=user,
-        conversation_id=conversation_id,
-        language_code=user_details.current_language_code,
-    )
+        user_conversation_model = await UserConversationModel.create(
+            user=user,
+            conversation_id=conversation_id,
+            language_code=user_details.current_language_code,
+            prompt_version=get_prompt_registry().conversation_continuation.version,
+            using_db=connection,
+        )
 
-    await TokenUsageModel.create(conversation_id=conversation_id)
+        await TokenUsageModel.create(
+            conversation_id=conversation_id,
+            using_db=connection,
+        )
 
-    return await get_response(str(conversation_id), message, user)
+    if redis_pool is not None and settings.conversation_history_cache_enabled:
+        await start_conversation_history(
+            redis_pool,
+            str(conversation_id),
+            [
+                {
+                    "role": ConversationElementRole.SYSTEM.value,
+                    "content": conversation_continuation_prompt,
+                },
+            ],
+        )
 
+    return user_conversation_model
 
-async def get_text_from_audio(audio_file: UploadFile, language_code: str) -> str:
-    """
-    Given a file, return the text.
 
-    :param audio_file: UploadFile object to transcode to text.
-    :param language_code: String language code the audio is in.
-    :return: String text.
+async def initialize_conversation(
+    user: UserModel,
+    message: str,
+    redis_pool: Optional[ConnectionPool] = None,
+    prewarm_reply_audio: bool = False,
+) -> ConverseResponse:
     """
-    # TODO: Shouldn't have to do this dance with writing/reading the file!
-    #   This may be related to with not working with async...
-    with open("/tmp/whatever.wav", "wb") as tmp_fh:  # noqa: S108
-        tmp_fh.write(audio_file.file.read())
-
-    with open("/tmp/whatever.wav", "rb") as in_fh:  # noqa: S108
-        # TODO: Store the token usage too
-        return openai.Audio.transcribe(
-            "whisper-1",
-            in_fh,
-            language=language_code,
-        )["text"]
-
+    Starts the conversation.
 
-# TODO: Make this bytes or whatever.
-def get_audio_stream_from_text(text: str, language_code: str) -> Any:
-    """
-    Given some text, return a byte stream of the audio as MP3.
+    Set up the DB with the initial conversation prompt and return the new
+    conversation ID, along with the first response from the model. A short
+    greeting is replied to from the opener pool when it can be.
 
-    :param text: String text to convert.
-    :param language_code: String language_code to convert to.
-    :yields: MP3 audio stream.
+    :param user: The user initiating the conversation.
+    :param message: The message to start the conversation with.
+    :param redis_pool: Optional Redis connection pool for caching.
+    :param prewarm_reply_audio: Whether to synthesize the audio of the reply.
+    :returns: ConversationResponse of the teacher's first reply.
     """
-    os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = settings.google_cloud_api_key_path
+    user_conversation_model = await create_conversation(user, redis_pool)
 
-    client = texttospeech.TextToSpeechClient()
-    synthesis_input = texttospeech.SynthesisInput(text=text)
+    opener = None
+    if redis_pool is not None and is_opener_eligible(message):
+        opener = await take_opener(redis_pool, user_conversation_model.language_code)
 
-    voice = texttospeech.VoiceSelectionParams(
-        language_code=language_code,
-        ssml_gender=texttospeech.SsmlVoiceGender.NEUTRAL,
+    return await get_response(
+        str(user_conversation_model.conversation_id),
+        message,
+        user,
+        redis_pool,
+        ReplyOptions(
+            language_code=user_conversation_model.language_code,
+            opener=opener,
+            prewarm_reply_audio=prewarm_reply_audio,
+        ),
     )
 
-    audio_config = texttospeech.AudioConfig(
-        audio_encoding=texttospeech.AudioEncoding.MP3,
-    )
 
-    response = client.synthesize_speech(
-        input=synthesis_input,
-        voice=voice,
-        audio_config=audio_config,
-    )
+async def reply_to_message(
+    conversation_id: str,
+    message: str,
+    user: UserModel,
+    redis_pool: Optional[ConnectionPool] = None,
+    prewarm_reply_audio: bool = False,
+) -> ConverseResponse:
+    """
+    Start or continue a conversation with a message from a user.
 
-    yield response.audio_content
+    :param conversation_id: String ID of the conversation, or "new" to start a
+                            new one.
+    :param message: String message the user wants to send.
+    :param user: UserModel of the user, fetched with
+                 select_related("user_details") to save a query.
+    :param redis_pool: Optional Redis connection pool for caching.
+    :param prewarm_reply_audio: Whether to synthesize the audio of the reply.
+    :returns: ConverseResponse
+    """
+    if conversation_id == "new":
+        return await initialize_conversation(
+            user,
+            message,
+            redis_pool,
+            prewarm_reply_audio,
+        )
+
+    return await get_response(
+        conversation_id,
+        message,
+        user,
+        redis_pool,
+        ReplyOptions(prewarm_reply_audio=prewarm_reply_audio),
+    )
@@ -1,21 +1,37 @@
-from fastapi import APIRouter, Depends, UploadFile
+import uuid
+
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, status
 from fastapi.responses import StreamingResponse
 from loguru import logger
+from redis.asyncio import ConnectionPool
 
+from fia_api.db.models.token_usage_model import TokenUsageModel
+from fia_api.db.models.user_conversation_model import UserConversationModel
 from fia_api.db.models.user_model import UserModel
+from fia_api.services.redis.dependency import get_redis_pool
+from fia_api.web.api.teacher.audio import (
+    get_audio_stream_from_handle,
+    get_audio_stream_from_text,
+    stream_voice_response,
+)
+from fia_api.web.api.teacher.batch_analysis import analyze_messages_in_batches
+from fia_api.web.api.teacher.learning_moments_cache import get_cache_stats
+from fia_api.web.api.teacher.opener_pool import get_opener_pool_stats
 from fia_api.web.api.teacher.schema import (
+    AnalyzeMessagesRequest,
+    AnalyzeMessagesResponse,
+    ConversationOpenerPoolStats,
+    ConversationTokenUsage,
     ConverseResponse,
     GetAudioRequest,
+    LearningMomentsCacheStats,
     TeacherConverseRequest,
 )
-from fia_api.web.api.teacher.utils import (
-    get_audio_stream_from_text,
-    get_response,
-    get_text_from_audio,
-    initialize_conversation,
-)
+from fia_api.web.api.teacher.streaming import stream_response
+from fia_api.web.api.teacher.transcription import get_text_from_audio
+from fia_api.web.api.teacher.utils import reply_to_message
 from fia_api.web.api.user.schema import AuthenticatedUser
-from fia_api.web.api.user.utils import get_current_user
+from fia_api.web.api.user.utils import get_current_user, get_rate_limited_user
 
 router = APIRouter()
 
@@ -23,13 +39,15 @@ router = APIRouter()
 @router.post("/converse", response_model=ConverseResponse)
 async def converse(
     converse_request: TeacherConverseRequest,
-    user: AuthenticatedUser = Depends(get_current_user),
+    user: UserModel = Depends(get_rate_limited_user("converse")),
+    redis_pool: ConnectionPool = Depends(get_redis_pool),
 ) -> ConverseResponse:
     """
     Starts or continues a conversation with the Teacher.
 
     :param converse_request: The request object.
-    :param user: The AuthenticatedUser making the request.
+    :param user: The UserModel making the request.
+    :param redis_pool: Redis connection pool.
     :returns: ConverseResponse of mistakes and conversation.
     """
     if converse_request.conversation_id == "new":
@@ -41,15 +59,41 @@ async def converse(
             },
         )
 
-        return await initialize_conversation(
-            await UserModel.get(username=user.username),
-            converse_request.message,
-        )
-
-    return await get_response(
+    return await reply_to_message(
         converse_request.conversation_id,
         converse_request.message,
-        await UserModel.get(username=user.username),
+        user,
+        redis_pool,
+    )
+
+
+@router.post("/converse-stream")
+async def converse_stream(
+    converse_request: TeacherConverseRequest,
+    user: UserModel = Depends(get_rate_limited_user("converse")),
+    redis_pool: ConnectionPool = Depends(get_redis_pool),
+) -> StreamingResponse:
+    """
+    Starts or continues a conversation with the Teacher, streaming the reply.
+
+    The response is a stream of Server-Sent Events: "token" events with the
+    reply as it is generated, a "learning_moments" event once those are ready,
+    and a final "done" event with the full ConverseResponse, or an "error"
+    event if the reply couldn't be finished.
+
+    :param converse_request: The request object.
+    :param user: The UserModel making the request.
+    :param redis_pool: Redis connection pool.
+    :returns: StreamingResponse of Server-Sent Events.
+    """
+    return StreamingResponse(
+        stream_response(
+            converse_request.conversation_id,
+            converse_request.message,
+            user,
+            redis_pool,
+        ),
+        media_type="text/event-stream",
     )
 
 
@@ -58,7 +102,8 @@ async def converse_with_audio(
     conversation_id: str,
     language_code: str,
     audio_file: UploadFile,
-    user: AuthenticatedUser = Depends(get_current_user),
+    user: UserModel = Depends(get_rate_limited_user("converse_with_audio")),
+    redis_pool: ConnectionPool = Depends(get_redis_pool),
 ) -> ConverseResponse:
     """
     Starts or continues a conversation with the Teacher with audio.
@@ -66,43 +111,216 @@ async def converse_with_audio(
     :param conversation_id: The conversation ID.
     :param language_code: The language of the uploaded audio.
     :param audio_file: The actual audio file.
-    :param user: The AuthenticatedUser making the request.
+    :param user: The UserModel making the request.
+    :param redis_pool: Redis connection pool.
     :returns: ConverseResponse of mistakes and conversation.
     """
     # TODO: Should be the same endpoint as above.
-    message = await get_text_from_audio(audio_file, language_code)
+    return await reply_to_message(
+        conversation_id,
+        await get_text_from_audio(audio_file, language_code),
+        user,
+        redis_pool,
+    )
 
-    if conversation_id == "new":
-        return await initialize_conversation(
-            await UserModel.get(username=user.username),
-            message,
-        )
 
-    return await get_response(
+@router.post("/converse-with-voice")
+async def converse_with_voice(
+    conversation_id: str,
+    language_code: str,
+    audio_file: UploadFile,
+    user: UserModel = Depends(get_rate_limited_user("converse_with_voice")),
+    redis_pool: ConnectionPool = Depends(get_redis_pool),
+) -> StreamingResponse:
+    """
+    Converse with the Teacher by voice, getting the reply and its audio at once.
+
+    The response is multipart/mixed: the ConverseResponse JSON, whose
+    input_message is the transcript, then the mp3 of the reply. The reply's
+    audio is synthesized while its learning moments are still being found.
+
+    :param conversation_id: The conversation ID.
+    :param language_code: The language of the uploaded audio.
+    :param audio_file: The actual audio file.
+    :param user: The UserModel making the request.
+    :param redis_pool: Redis connection pool.
+    :returns: StreamingResponse of the multipart body.
+    """
+    converse_response = await reply_to_message(
         conversation_id,
-        message,
-        await UserModel.get(username=user.username),
+        await get_text_from_audio(audio_file, language_code),
+        user,
+        redis_pool,
+        prewarm_reply_audio=True,
+    )
+
+    boundary = uuid.uuid4().hex
+
+    return StreamingResponse(
+        stream_voice_response(converse_response, redis_pool, boundary),
+        media_type=f"multipart/mixed; boundary={boundary}",
+    )
+
+
+@router.post("/analyze-messages", response_model=AnalyzeMessagesResponse)
+async def analyze_messages(
+    analyze_request: AnalyzeMessagesRequest,
+    user: UserModel = Depends(get_rate_limited_user("analyze_messages")),
+    redis_pool: ConnectionPool = Depends(get_redis_pool),
+) -> AnalyzeMessagesResponse:
+    """
+    Finds the mistakes in many messages at once, and makes them flashcards.
+
+    Messages are checked in batches, so this is much cheaper than sending
+    each one to converse, e.g. when importing chat logs.
+
+    :param analyze_request: The request object.
+    :param user: The UserModel making the request.
+    :param redis_pool: Redis connection pool.
+    :returns: AnalyzeMessagesResponse of the mistakes in each message.
+    :raises HTTPException: When they don't have permission to see conversation.
+    """
+    if analyze_request.conversation_id != "new":
+        has_access = await UserConversationModel.exists(
+            user=user,
+            conversation_id=uuid.UUID(analyze_request.conversation_id),
+        )
+        if not has_access:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Don't have permission to access that conversation.",
+            )
+
+    return await analyze_messages_in_batches(
+        analyze_request.conversation_id,
+        analyze_request.messages,
+        user,
+        redis_pool,
     )
 
 
 @router.post("/get-audio")
-def get_audio(
+async def get_audio(
     audio_request: GetAudioRequest,
     user: AuthenticatedUser = Depends(get_current_user),
+    redis_pool: ConnectionPool = Depends(get_redis_pool),
 ) -> StreamingResponse:
     """
     Given some text and metadata, return the mp3.
 
     :param audio_request: The details of the request.
     :param user: The AuthenticatedUser making the request.
+    :param redis_pool: Redis connection pool for the shared audio cache.
     :returns: GetAudioResponse.
     """
     audio_stream = get_audio_stream_from_text(
         audio_request.text,
         audio_request.language_code,
+        redis_pool,
+    )
+
+    return StreamingResponse(
+        audio_stream,
+        media_type="audio/mpeg",
     )
 
+
+@router.get("/audio/{audio_handle}")
+async def get_audio_by_handle(
+    audio_handle: str,
+    user: AuthenticatedUser = Depends(get_current_user),
+    redis_pool: ConnectionPool = Depends(get_redis_pool),
+) -> StreamingResponse:
+    """
+    Get the mp3 of a reply by the audio_handle it came with.
+
+    :param audio_handle: String audio handle from a ConverseResponse.
+    :param user: The AuthenticatedUser making the request.
+    :param redis_pool: Redis connection pool the handle is stored in.
+    :raises HTTPException: If the handle is unknown or has expired.
+    :returns: StreamingResponse of the mp3.
+    """
+    audio_stream = await get_audio_stream_from_handle(audio_handle, redis_pool)
+
+    if audio_stream is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Unknown audio handle.",
+        )
+
     return StreamingResponse(
         audio_stream,
         media_type="audio/mpeg",
     )
+
+
+@router.get(
+    "/learning-moments-cache-stats",
+    response_model=LearningMomentsCacheStats,
+)
+async def learning_moments_cache_stats(
+    user: AuthenticatedUser = Depends(get_current_user),
+    redis_pool: ConnectionPool = Depends(get_redis_pool),
+) -> LearningMomentsCacheStats:
+    """
+    Returns the hit/miss counters of the learning moments cache.
+
+    :param user: The AuthenticatedUser making the request.
+    :param redis_pool: Redis connection pool.
+    :returns: LearningMomentsCacheStats.
+    """
+    return await get_cache_stats(redis_pool)
+
+
+@router.get(
+    "/conversation-opener-pool-stats",
+    response_model=ConversationOpenerPoolStats,
+)
+async def conversation_opener_pool_stats(
+    user: AuthenticatedUser = Depends(get_current_user),
+    redis_pool: ConnectionPool = Depends(get_redis_pool),
+) -> ConversationOpenerPoolStats:
+    """
+    Returns the depth of each conversation opener pool, and its hit rate.
+
+    :param user: The AuthenticatedUser making the request.
+    :param redis_pool: Redis connection pool.
+    :returns: ConversationOpenerPoolStats.
+    """
+    return await get_opener_pool_stats(redis_pool)
+
+
+@router.get("/token-usage", response_model=ConversationTokenUsage)
+async def get_token_usage(
+    conversation_id: str,
+    user: AuthenticatedUser = Depends(get_current_user),
+) -> ConversationTokenUsage:
+    """
+    Returns the token usage of a conversation.
+
+    :param conversation_id: String conversation_id.
+    :param user: The AuthenticatedUser making the request.
+    :returns: ConversationTokenUsage.
+    :raises HTTPException: When they don't have permission to see conversation.
+    """
+    user_model = await UserModel.get(username=user.username)
+
+    if not await UserConversationModel.exists(  # noqa: WPS337
+        user=user_model,
+        conversation_id=uuid.UUID(conversation_id),
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Don't have permission to access that conversation.",
+        )
+
+    token_usage = await TokenUsageModel.get(
+        conversation_id=uuid.UUID(conversation_id),
+    )
+
+    return ConversationTokenUsage(
+        conversation_id=conversation_id,
+        prompt_token_usage=token_usage.prompt_token_usage,
+        completion_token_usage=token_usage.completion_token_usage,
+        saved_prompt_token_usage=token_usage.saved_prompt_token_usage,
+    )
@@ -1,18 +1,22 @@
+import math
 import uuid
 from datetime import datetime, timedelta
-from typing import Any, Union
+from typing import Any, Awaitable, Callable, Union
 
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import jwt
 from passlib.context import CryptContext
 from pydantic import ValidationError
+from redis.asyncio import ConnectionPool
 
 from fia_api.db.models.conversation_model import (
     ConversationElementModel,
     ConversationElementRole,
 )
 from fia_api.db.models.user_model import UserModel
+from fia_api.services.rate_limit.limiter import check_limits, start_token_quota
+from fia_api.services.redis.dependency import get_redis_pool
 from fia_api.settings import settings
 from fia_api.web.api.teacher.schema import ConversationElement, ConversationResponse
 from fia_api.web.api.user.schema import AuthenticatedUser, TokenPayload
@@ -81,12 +85,12 @@ def create_refresh_token(subject: Union[str, Any]) -> str:
     return jwt.encode(to_encode, settings.jwt_refresh_secret_key, ALGORITHM)
 
 
-async def get_current_user(token: str = Depends(reuseable_oauth)) -> AuthenticatedUser:
+def decode_token(token: str) -> TokenPayload:
     """
-    Given a JWT token of a logged in user, return the AuthenticatedUser object for them.
+    Decode and validate a JWT token.
 
     :param token: String JWT token to decode.
-    :returns: AuthenticatedUser object
+    :returns: TokenPayload
     :raises HTTPException: Whenever the token is expired or the credentials are bad.
     """
     try:
@@ -110,7 +114,22 @@ async def get_current_user(token: str = Depends(reuseable_oauth)) -> Authenticat
             headers={"WWW-Authenticate": "Bearer"},
         )
 
-    user = await UserModel.get(username=token_data.sub)
+    return token_data
+
+
+async def get_user_from_token(token: str) -> UserModel:
+    """
+    Given a JWT token of a logged in user, return their UserModel.
+
+    Their user_details are fetched in the same query.
+
+    :param token: String JWT token to decode.
+    :returns: UserModel
+    :raises HTTPException: Whenever the token is expired or the credentials are bad.
+    """
+    token_data = decode_token(token)
+
+    user = await UserModel.get(username=token_data.sub).select_related("user_details")
 
     if not user:
         raise HTTPException(
@@ -118,9 +137,57 @@ async def get_current_user(token: str = Depends(reuseable_oauth)) -> Authenticat
             detail="Could not find user",
         )
 
+    return user
+
+
+async def get_current_user(token: str = Depends(reuseable_oauth)) -> AuthenticatedUser:
+    """
+    Given a JWT token of a logged in user, return the AuthenticatedUser object for them.
+
+    :param token: String JWT token to decode.
+    :returns: AuthenticatedUser object
+    """
+    user = await get_user_from_token(token)
+
     return AuthenticatedUser(username=user.username)
 
 
+def get_rate_limited_user(
+    endpoint: str,
+) -> Callable[..., Awaitable[UserModel]]:
+    """
+    Like get_current_user, but rate limited per user for the endpoint.
+
+    The token is decoded and the user looked up once, and LLM tokens used by
+    the rest of the request count towards the user's quota. The dependency
+    resolves to the UserModel, with its user_details fetched, so the endpoint
+    doesn't have to look the user up again.
+
+    :param endpoint: String name of the endpoint being limited.
+    :returns: The dependency.
+    """
+
+    async def _get_rate_limited_user(  # noqa: WPS430
+        token: str = Depends(reuseable_oauth),
+        redis_pool: ConnectionPool = Depends(get_redis_pool),
+    ) -> UserModel:
+        user = await get_user_from_token(token)
+
+        retry_after = await check_limits(redis_pool, str(user.id), endpoint)
+        if retry_after:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many requests",
+                headers={"Retry-After": str(math.ceil(retry_after))},
+            )
+
+        start_token_quota(redis_pool, str(user.id))
+
+        return user
+
+    return _get_rate_limited_user
+
+
 async def format_conversation_element(
     conversation_element: ConversationElementModel,
 ) -> ConversationElement:
@@ -7,7 +7,9 @@ from tortoise.contrib.fastapi import register_tortoise
 
 from fia_api.db.config import TORTOISE_CONFIG
 from fia_api.logging import configure_logging
+from fia_api.services.llm.resilience import LLMUnavailableError
 from fia_api.web.api.router import api_router
+from fia_api.web.exception_handlers import llm_unavailable_handler
 from fia_api.web.lifetime import register_shutdown_event, register_startup_event
 
 
@@ -41,6 +43,8 @@ def get_app() -> FastAPI:
     register_startup_event(app)
     register_shutdown_event(app)
 
+    app.add_exception_handler(LLMUnavailableError, llm_unavailable_handler)
+
     # Main router for the API.
     app.include_router(router=api_router, prefix="/api")
     # Configures tortoise orm.
@@ -0,0 +1,23 @@
+from fastapi import Request, status
+from fastapi.responses import UJSONResponse
+
+from fia_api.services.llm.resilience import LLMUnavailableError
+from fia_api.settings import settings
+
+
+async def llm_unavailable_handler(
+    request: Request,
+    exc: LLMUnavailableError,
+) -> UJSONResponse:
+    """
+    Tell the client to try again later when the LLM is unavailable.
+
+    :param request: The request that failed.
+    :param exc: The LLMUnavailableError raised.
+    :returns: 503 response with a Retry-After header.
+    """
+    return UJSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(int(settings.llm_circuit_reset_seconds))},
+    )
@@ -2,7 +2,12 @@ from typing import Awaitable, Callable
 
 from fastapi import FastAPI
 
+from fia_api.services.llm.lifetime import init_llm, shutdown_llm
 from fia_api.services.redis.lifetime import init_redis, shutdown_redis
+from fia_api.services.token_usage.lifetime import init_token_usage, shutdown_token_usage
+from fia_api.services.tts.lifetime import init_tts, shutdown_tts
+from fia_api.web.api.teacher.opener_pool import init_opener_pool, shutdown_opener_pool
+from fia_api.web.api.teacher.prompts import get_prompt_registry
 
 
 def register_startup_event(
@@ -22,6 +27,12 @@ def register_startup_event(
     async def _startup() -> None:  # noqa: WPS430
         app.middleware_stack = None
         init_redis(app)
+        init_llm(app)
+        init_token_usage(app)
+        init_tts(app)
+        # Build the prompts up front rather than on the first request.
+        get_prompt_registry()
+        init_opener_pool(app)
         app.middleware_stack = app.build_middleware_stack()
         pass  # noqa: WPS420
 
@@ -40,7 +51,11 @@ def register_shutdown_event(
 
     @app.on_event("shutdown")
     async def _shutdown() -> None:  # noqa: WPS430
+        await shutdown_opener_pool(app)
+        await shutdown_token_usage(app)
+        await shutdown_tts(app)
         await shutdown_redis(app)
+        await shutdown_llm(app)
         pass  # noqa: WPS420
 
     return _shutdown
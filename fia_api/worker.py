@@ -0,0 +1,50 @@
+import asyncio
+
+from loguru import logger
+from redis.asyncio import ConnectionPool
+from tortoise import Tortoise
+
+from fia_api.db.config import TORTOISE_CONFIG
+from fia_api.logging import configure_logging
+from fia_api.services.task_queue.queue import process_next_task, requeue_stale_tasks
+from fia_api.settings import settings
+from fia_api.web.api.teacher import tasks  # noqa: F401
+
+
+async def run_worker() -> None:  # pragma: no cover
+    """
+    Run background tasks from the queue until stopped.
+
+    :raises asyncio.CancelledError: When the worker is stopped.
+    """
+    redis_pool = ConnectionPool.from_url(str(settings.redis_url))
+    await Tortoise.init(config=TORTOISE_CONFIG)
+    logger.info(
+        {
+            "message": "Task worker started",
+            "requeued_tasks": await requeue_stale_tasks(redis_pool),
+        },
+    )
+
+    try:
+        while True:  # noqa: WPS457
+            await process_next_task(
+                redis_pool,
+                settings.task_queue_poll_timeout_seconds,
+            )
+    except asyncio.CancelledError:
+        logger.info("Task worker stopped")
+        raise
+    finally:
+        await Tortoise.close_connections()
+        await redis_pool.disconnect()
+
+
+def main() -> None:  # pragma: no cover
+    """Entrypoint of the background task worker."""
+    configure_logging()
+    asyncio.run(run_worker())
+
+
+if __name__ == "__main__":
+    main()